@@ -0,0 +1,31 @@
+# Loaded by gunicorn from the working directory, see the Dockerfile
+import os
+import shutil
+import tempfile
+from typing import Any
+
+# Every worker writes its Prometheus metrics to files in this directory and
+# /metrics adds them up, so they are right whichever worker answers the scrape. It
+# has to be set before the workers import prometheus_client.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "pawtrails_metrics")
+)
+
+# The proxies whose X-Forwarded-For / X-Forwarded-Proto headers are trusted, e.g.
+# the address of the load balancer, comma separated. The uvicorn workers then see
+# the real client address, which the login throttling is keyed on. Only list the
+# proxies: any client of a trusted address can pick the address it is counted as.
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def on_starting(server: Any) -> None:
+    # The files of the last run would be counted again
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    from prometheus_client import multiprocess
+
+    # Drops the gauges of the dead worker (e.g. its requests in progress)
+    multiprocess.mark_process_dead(worker.pid)
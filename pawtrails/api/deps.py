@@ -1,28 +1,60 @@
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+import math
+from typing import Optional, Sequence
+
+from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from pydantic import ValidationError
 
-from pawtrails.core.security import TokenData
+from pawtrails.core.database import (
+    BaseModel,
+    Cursor,
+    decode_cursor,
+    encode_cursor,
+    set_read_only,
+)
+from pawtrails.core.ratelimit import throttle_login
+from pawtrails.core.security import TokenData, revoked_tokens
 from pawtrails.core.settings import settings
 from pawtrails.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/login")
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+CONSISTENCY_HEADER = "X-Consistency-Token"
+
+
+def _credentials_exception(
+    detail: str = "Could not validate credentials",
+) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+
+async def get_token_data(token: str = Depends(oauth2_scheme)) -> TokenData:
+    """Decodes and checks the access token, without loading its user."""
     try:
         payload = jwt.decode(
             token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]
         )
-        token_data = TokenData(uuid=payload.get("sub"))
-    except (JWTError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+        token_data = TokenData(
+            uuid=payload.get("sub"),
+            username=payload.get("username"),
+            is_active=payload.get("is_active"),
+            issued_at=payload.get("iat", 0.0),
         )
-    user = User.get_by_uuid(uuid=token_data.uuid)
+    except (JWTError, ValidationError):
+        raise _credentials_exception()
+    if revoked_tokens.is_revoked(token_data.uuid, token_data.issued_at):
+        raise _credentials_exception("The token has been revoked, log in again")
+    return token_data
+
+
+async def get_current_user(token_data: TokenData = Depends(get_token_data)) -> User:
+    user = await User.aget_by_uuid(uuid=token_data.uuid)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
@@ -38,3 +70,84 @@ async def get_current_active_user(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user"
         )
     return current_user
+
+
+async def get_current_identity(
+    token_data: TokenData = Depends(get_token_data),
+) -> TokenData:
+    """The active user of the request, from the signed claims of its token, without
+    a database read. For the routes that only need the uuid or username of the user.
+    A deleted or deactivated user, or one that changed the password, is caught by the
+    revocation of its tokens. Tokens without the claims fall back to loading the user.
+    """
+    if token_data.is_active is None or token_data.username is None:
+        user = await get_current_active_user(await get_current_user(token_data))
+        return TokenData(
+            uuid=token_data.uuid,
+            username=user.username,
+            is_active=user.is_active,
+            issued_at=token_data.issued_at,
+        )
+    if not token_data.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user"
+        )
+    return token_data
+
+
+async def get_cursor(cursor: Optional[str] = None) -> Optional[Cursor]:
+    """Decodes the cursor query parameter of the paginated list routes."""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def set_next_cursor(response: Response, page: Sequence[BaseModel], limit: int) -> None:
+    """Sets the cursor of the next page in a response header, if there is one."""
+    if page and len(page) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page[-1])
+
+
+async def read_only() -> None:
+    """Lets a route that only reads, but is not a GET request, use the read replicas."""
+    set_read_only()
+
+
+def check_batch_size(items: Sequence) -> None:
+    """Rejects batch requests with more than BATCH_MAX_SIZE items.
+
+    Args:
+        items (Sequence): The items of the batch
+
+    Raises:
+        HTTPException: The batch is too large
+    """
+    if len(items) > settings.BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch can contain at most {settings.BATCH_MAX_SIZE} items.",
+        )
+
+
+async def limit_login(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+) -> None:
+    """Rejects the login attempts over the rate limits of the client address or of
+    the account, before the user is read or its password checked. Behind a trusted
+    proxy (see forwarded_allow_ips in gunicorn.conf.py) the client address is the
+    one it forwarded.
+
+    Raises:
+        HTTPException: Too many attempts, with the seconds to wait in Retry-After
+    """
+    client = request.client.host if request.client else "unknown"
+    wait = await throttle_login(client, form_data.username)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later.",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
@@ -1,9 +1,25 @@
-from typing import List, cast
+from typing import Any, Dict, List, Optional, cast
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Body, HTTPException, Response, status
 from fastapi.param_functions import Depends
 
-from pawtrails.api.deps import get_current_active_user
+from pawtrails.api.deps import (
+    check_batch_size,
+    get_current_active_user,
+    get_current_identity,
+    get_cursor,
+    read_only,
+    set_next_cursor,
+)
+from pawtrails.core.database import (
+    BatchResultSchema,
+    Cursor,
+    atomic,
+    run_async,
+    serialize,
+    serialize_all,
+)
+from pawtrails.core.security import TokenData
 from pawtrails.models.location import (
     AddLocationSchema,
     Location,
@@ -26,27 +42,66 @@ router = APIRouter()
 
 
 async def _check_ownership(user: User, loc: Location) -> None:
-    if user != loc.creator:
+    if user != await loc.afetch("creator"):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"This user {user.username} did not create this location!",
         )
 
 
-@router.get("/", response_model=List[LocationSchema])
-async def get_locations(skip: int = 0, limit: int = 100) -> List[Location]:
-    return Location.get_all(skip, limit)
+async def get_location_or_404(uuid: str) -> Location:
+    loc = cast(Location, await Location.aget_by_uuid(uuid))
+    if not loc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"The location with the uuid {uuid} does not exist!",
+        )
+    return loc
 
 
-@router.post("/search", response_model=List[LocationSchema])
+async def get_review_or_404(uuid: str, review_uuid: str) -> Review:
+    loc = await get_location_or_404(uuid)
+    rew = cast(Review, await Review.aget_by_uuid(review_uuid))
+    if not rew:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"The location with the uuid {uuid} does not exist!",
+        )
+    if loc != await rew.afetch("location"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This review does not belong to this location!",
+        )
+    return rew
+
+
+@router.get("/", response_model=List[LocationSchema])
+async def get_locations(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Cursor] = Depends(get_cursor),
+) -> List[LocationSchema]:
+    locs = await Location.aget_all(skip, limit, after)
+    set_next_cursor(response, locs, limit)
+    return await serialize_all(LocationSchema, locs)
+
+
+@router.post(
+    "/search",
+    response_model=List[LocationSchema],
+    dependencies=[Depends(read_only)],
+)
 async def search_locations(
     search_in: SearchLocationSchema,
-    current_user: User = Depends(get_current_active_user),
-) -> List[Location]:
+    response: Response,
+    identity: TokenData = Depends(get_current_identity),
+) -> List[LocationSchema]:
+    after = await get_cursor(search_in.cursor)
     params = SearchLocationOptions(**search_in.dict())
     if search_in.created or search_in.favorited:
         params.user = SearchLocationUserOptions(
-            uuid=current_user.uuid,
+            uuid=identity.uuid,
             created=search_in.created,
             favorited=search_in.favorited,
         )
@@ -57,37 +112,114 @@ async def search_locations(
             max=search_in.max_distance,
         )
 
-    return Location.search(params)
+    locs = await Location.asearch(params, after)
+    set_next_cursor(response, locs, params.limit or 0)
+    return await serialize_all(LocationSchema, locs)
 
 
 @router.post("/", response_model=LocationSchema)
 async def add_location(
     loc_in: AddLocationSchema, current_user: User = Depends(get_current_active_user)
-) -> Location:
+) -> LocationSchema:
     loc = Location(**loc_in.dict())
-    loc.add_creator(current_user)
-    loc.save()
-    return loc
+    await run_async(loc.add_creator, current_user)
+    await loc.asave()
+    return await serialize(LocationSchema, loc)
+
+
+def _add_locations(
+    items: List[Dict[str, Any]], creator: User
+) -> List[BatchResultSchema]:
+    results: List[BatchResultSchema] = []
+    for index, item in enumerate(items):
+        try:
+            loc = Location(**AddLocationSchema.parse_obj(item).dict())
+        except (TypeError, ValueError) as error:
+            results.append(
+                BatchResultSchema(
+                    index=index,
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=str(error),
+                )
+            )
+            continue
+        loc.add_creator(creator)
+        loc.save()
+        results.append(
+            BatchResultSchema(index=index, status=status.HTTP_200_OK, uuid=loc.uuid)
+        )
+    return results
+
+
+@router.post("/batch", response_model=List[BatchResultSchema])
+async def add_locations(
+    locs_in: List[Dict[str, Any]] = Body(...),
+    current_user: User = Depends(get_current_active_user),
+) -> List[BatchResultSchema]:
+    """Adds many locations, each validated as in POST /location/, in one transaction.
+    Returns the result of every item; invalid items do not stop the others.
+    """
+    check_batch_size(locs_in)
+    async with atomic():
+        results = await run_async(_add_locations, locs_in, current_user)
+    return results
+
+
+def _add_favorites(
+    uuids: List[str], user: User, locs: Dict[str, Location]
+) -> List[BatchResultSchema]:
+    results: List[BatchResultSchema] = []
+    for index, uuid in enumerate(uuids):
+        loc = locs.get(uuid)
+        if not loc:
+            result = BatchResultSchema(
+                index=index,
+                status=status.HTTP_404_NOT_FOUND,
+                detail=f"The location with the uuid {uuid} does not exist!",
+            )
+        elif not user.add_favorite(loc):
+            result = BatchResultSchema(
+                index=index,
+                status=status.HTTP_409_CONFLICT,
+                uuid=uuid,
+                detail="This location is already a favorite.",
+            )
+        else:
+            result = BatchResultSchema(
+                index=index, status=status.HTTP_200_OK, uuid=uuid
+            )
+        results.append(result)
+    user.save()
+    return results
+
+
+@router.post("/favorite/batch", response_model=List[BatchResultSchema])
+async def add_favorites(
+    uuids: List[str] = Body(...),
+    current_user: User = Depends(get_current_active_user),
+) -> List[BatchResultSchema]:
+    """Favorites many locations, given by uuid, in one transaction.
+    Returns the result of every item.
+    """
+    check_batch_size(uuids)
+    locs = cast(Dict[str, Location], await Location.aget_many(uuids))
+    async with atomic():
+        results = await run_async(_add_favorites, uuids, current_user, locs)
+    return results
 
 
 @router.get("/{uuid}", response_model=LocationSchema)
-async def get_location(uuid: str) -> Location:
-    loc = cast(Location, Location.get_by_uuid(uuid))
-    if not loc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"The location with the uuid {uuid} does not exist!",
-        )
-    return loc
+async def get_location(uuid: str) -> LocationSchema:
+    return await serialize(LocationSchema, await get_location_or_404(uuid))
 
 
 @router.delete("/{uuid}", response_model=None)
 async def delete_location(
     uuid: str, current_user: User = Depends(get_current_active_user)
 ) -> None:
-    loc = await get_location(uuid)
+    loc = await get_location_or_404(uuid)
     await _check_ownership(current_user, loc)
-    loc.delete()
+    await loc.adelete()
 
 
 @router.patch("/{uuid}", response_model=LocationSchema)
@@ -95,43 +227,45 @@ async def update_location(
     loc_in: UpdateLocationSchema,
     uuid: str,
     current_user: User = Depends(get_current_active_user),
-) -> Location:
-    loc = await get_location(uuid)
+) -> LocationSchema:
+    loc = await get_location_or_404(uuid)
     await _check_ownership(current_user, loc)
     loc.update(**loc_in.dict())
-    loc.save()
-    return loc
+    await loc.asave()
+    return await serialize(LocationSchema, loc)
 
 
 @router.get("/{uuid}/favorite", response_model=List[UserSchema])
-async def get_location_favorites(uuid: str) -> List[User]:
-    loc = await get_location(uuid)
-    return loc.favorites
+async def get_location_favorites(uuid: str) -> List[UserSchema]:
+    loc = await get_location_or_404(uuid)
+    return await serialize_all(UserSchema, await loc.afetch("favorites"))
 
 
 @router.post("/{uuid}/favorite", response_model=UserSchema)
 async def add_favorite(
     uuid: str, current_user: User = Depends(get_current_active_user)
-) -> User:
-    loc = await get_location(uuid)
-    current_user.add_favorite(loc)
-    current_user.save()
-    return current_user
+) -> UserSchema:
+    loc = await get_location_or_404(uuid)
+    async with atomic():
+        await run_async(current_user.add_favorite, loc)
+        await current_user.asave()
+    return await serialize(UserSchema, current_user)
 
 
 @router.delete("/{uuid}/favorite", response_model=None)
 async def remove_favorite(
     uuid: str, current_user: User = Depends(get_current_active_user)
 ) -> None:
-    loc = await get_location(uuid)
-    current_user.remove_favorite(loc)
-    current_user.save()
+    loc = await get_location_or_404(uuid)
+    async with atomic():
+        await run_async(current_user.remove_favorite, loc)
+        await current_user.asave()
 
 
 @router.get("/{uuid}/review", response_model=List[ReviewSchema])
-async def get_reviews(uuid: str) -> List[Review]:
-    loc = await get_location(uuid)
-    return loc.reviews
+async def get_reviews(uuid: str) -> List[ReviewSchema]:
+    loc = await get_location_or_404(uuid)
+    return await serialize_all(ReviewSchema, await loc.afetch("reviews"))
 
 
 @router.post("/{uuid}/review", response_model=ReviewSchema)
@@ -139,30 +273,19 @@ async def add_review(
     rew_in: AddReviewSchema,
     uuid: str,
     current_user: User = Depends(get_current_active_user),
-) -> Review:
-    loc = await get_location(uuid)
-    rew = Review(**rew_in.dict())
-    rew.add_writer(current_user)
-    rew.add_location(loc)
-    rew.save()
-    return rew
+) -> ReviewSchema:
+    loc = await get_location_or_404(uuid)
+    async with atomic():
+        rew = Review(**rew_in.dict())
+        await run_async(rew.add_writer, current_user)
+        await run_async(rew.add_location, loc)
+        await rew.asave()
+    return await serialize(ReviewSchema, rew)
 
 
 @router.get("/{uuid}/review/{review_uuid}", response_model=ReviewSchema)
-async def get_review(uuid: str, review_uuid: str) -> Review:
-    loc = await get_location(uuid)  # noqa
-    rew = cast(Review, Review.get_by_uuid(review_uuid))
-    if not rew:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"The location with the uuid {uuid} does not exist!",
-        )
-    if loc != rew.location:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This review does not belong to this location!",
-        )
-    return rew
+async def get_review(uuid: str, review_uuid: str) -> ReviewSchema:
+    return await serialize(ReviewSchema, await get_review_or_404(uuid, review_uuid))
 
 
 @router.delete("/{uuid}/review/{review_uuid}")
@@ -171,13 +294,13 @@ async def remove_review(
     review_uuid: str,
     current_user: User = Depends(get_current_active_user),
 ) -> None:
-    rew = await get_review(uuid, review_uuid)
-    if current_user != rew.writer:
+    rew = await get_review_or_404(uuid, review_uuid)
+    if current_user != await rew.afetch("writer"):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You did not create this review!",
         )
-    rew.delete()
+    await rew.adelete()
 
 
 @router.patch("/{uuid}/review/{review_uuid}", response_model=ReviewSchema)
@@ -186,14 +309,14 @@ async def update_review(
     review_uuid: str,
     rew_in: UpdateReviewSchema,
     current_user: User = Depends(get_current_active_user),
-) -> Review:
-    rew = await get_review(uuid, review_uuid)
-    if current_user != rew.writer:
+) -> ReviewSchema:
+    rew = await get_review_or_404(uuid, review_uuid)
+    if current_user != await rew.afetch("writer"):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You did not create this review!",
         )
 
     rew.update(**rew_in.dict())
-    rew.save()
-    return rew
+    await rew.asave()
+    return await serialize(ReviewSchema, rew)
@@ -1,14 +1,27 @@
-from typing import List
+from typing import Dict, List, cast
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Body, Depends, status
 from fastapi.exceptions import HTTPException
 
-from pawtrails.api.deps import get_current_active_user, get_current_user
-from pawtrails.api.v0.routes.user import get_user_by_uuid
-from pawtrails.core.security import verify_password
-from pawtrails.models.location import Location, LocationSchema
-from pawtrails.models.pet import Pet, PetSchema
-from pawtrails.models.review import Review, UserReviewSchema
+from pawtrails.api.deps import (
+    check_batch_size,
+    get_current_active_user,
+    get_current_identity,
+    get_current_user,
+)
+from pawtrails.api.v0.routes.user import get_user_or_404
+from pawtrails.core.database import (
+    BatchResultSchema,
+    UniquenessError,
+    atomic,
+    run_async,
+    serialize,
+    serialize_all,
+)
+from pawtrails.core.security import TokenData, averify_password, revoked_tokens
+from pawtrails.models.location import LocationSchema
+from pawtrails.models.pet import PetSchema
+from pawtrails.models.review import UserReviewSchema
 from pawtrails.models.user import (
     DashboardSchema,
     UpdateUserSchema,
@@ -20,127 +33,175 @@ from pawtrails.models.user import (
 router = APIRouter()
 
 
+def _apply_update(user_in: UpdateUserSchema, current_user: User) -> None:
+    """Applies the requested changes to the user, except the password. A duplicate
+    email or username is only detected by the save, see UniquenessError."""
+    if user_in.email:
+        current_user.email = user_in.email
+    if user_in.username:
+        current_user.username = user_in.username
+    if user_in.full_name:
+        current_user.full_name = user_in.full_name
+    if user_in.home_longitude and user_in.home_latitude:
+        current_user.set_home(user_in.home_longitude, user_in.home_latitude)
+
+
 @router.get("/", response_model=UserFullSchema)
-async def get_me(current_user: User = Depends(get_current_user)) -> User:
-    return current_user
+async def get_me(current_user: User = Depends(get_current_user)) -> UserFullSchema:
+    return await serialize(UserFullSchema, current_user)
 
 
 @router.delete("/")
 async def delete_me(current_user: User = Depends(get_current_user)) -> None:
-    current_user.delete()
+    await current_user.adelete()
+    revoked_tokens.revoke(cast(str, current_user.uuid))
 
 
 @router.patch("/", response_model=UserFullSchema)
 async def update_me(
     user_in: UpdateUserSchema, current_user: User = Depends(get_current_user)
-) -> User:
-    if user_in.email:
-        try:
-            current_user.email = user_in.email
-        except Exception:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="The user with this email already exists in our system.",
-            )
-    if user_in.username:
-        try:
-            current_user.username = user_in.username
-        except Exception:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="The user with this username already exists in our system.",
-            )
+) -> UserFullSchema:
     if user_in.password:
-        if user_in.old_password and verify_password(
+        if not user_in.old_password or not await averify_password(
             user_in.old_password, current_user.password
         ):
-            current_user.password = user_in.password
-        else:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Old password not provided or does not match the current one.",
             )
-    if user_in.full_name:
-        current_user.full_name = user_in.full_name
-    if user_in.home_longitude and user_in.home_latitude:
-        current_user.set_home(user_in.home_longitude, user_in.home_latitude)
-
-    current_user.save()
-    return current_user
+    _apply_update(user_in, current_user)
+    if user_in.password:
+        await current_user.aset_password(user_in.password)
+    try:
+        # A single conditional write, the uniqueness constraints reject duplicates
+        await current_user.asave()
+    except UniquenessError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"The user with this {e.key} already exists in our system.",
+        )
+    if user_in.password or user_in.username:
+        # The tokens with the old password or the old username claim
+        revoked_tokens.revoke(cast(str, current_user.uuid))
+    return await serialize(UserFullSchema, current_user)
 
 
 @router.get("/dashboard", response_model=List[DashboardSchema])
 async def dashboard(
-    current_user: User = Depends(get_current_active_user),
+    identity: TokenData = Depends(get_current_identity),
 ) -> List[DashboardSchema]:
-    return current_user.get_dashboard()
+    return await User.aget_dashboard_by_uuid(identity.uuid)
 
 
 @router.post("/follow", response_model=UserSchema)
 async def follow_user(
     uuid: str, current_user: User = Depends(get_current_active_user)
-) -> User:
-    user = await get_user_by_uuid(uuid)
-    if not current_user.add_following(user):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You tried to follow already followed user or yourself.",
-        )
-
+) -> UserSchema:
+    user = await get_user_or_404(uuid)
+    async with atomic():
+        if not await run_async(current_user.add_following, user):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="You tried to follow already followed user or yourself.",
+            )
+        await current_user.asave()
+    return await serialize(UserSchema, user)
+
+
+def _follow_users(
+    uuids: List[str], current_user: User, users: Dict[str, User]
+) -> List[BatchResultSchema]:
+    results: List[BatchResultSchema] = []
+    for index, uuid in enumerate(uuids):
+        user = users.get(uuid)
+        if not user:
+            result = BatchResultSchema(
+                index=index,
+                status=status.HTTP_404_NOT_FOUND,
+                detail=f"User with uuid {uuid} does not exist",
+            )
+        elif not current_user.add_following(user):
+            result = BatchResultSchema(
+                index=index,
+                status=status.HTTP_400_BAD_REQUEST,
+                uuid=uuid,
+                detail="You tried to follow already followed user or yourself.",
+            )
+        else:
+            result = BatchResultSchema(
+                index=index, status=status.HTTP_200_OK, uuid=uuid
+            )
+        results.append(result)
     current_user.save()
-    return user
+    return results
+
+
+@router.post("/follow/batch", response_model=List[BatchResultSchema])
+async def follow_users(
+    uuids: List[str] = Body(...),
+    current_user: User = Depends(get_current_active_user),
+) -> List[BatchResultSchema]:
+    """Follows many users, given by uuid, in one transaction.
+    Returns the result of every item.
+    """
+    check_batch_size(uuids)
+    users = cast(Dict[str, User], await User.aget_many(uuids))
+    async with atomic():
+        results = await run_async(_follow_users, uuids, current_user, users)
+    return results
 
 
 @router.delete("/follow")
 async def unfollow_user(
     uuid: str, current_user: User = Depends(get_current_active_user)
 ) -> None:
-    user = await get_user_by_uuid(uuid)
-    if not current_user.remove_following(user):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You tried to unfollow yourself or someone you are not following.",
-        )
-
-    current_user.save()
+    user = await get_user_or_404(uuid)
+    async with atomic():
+        if not await run_async(current_user.remove_following, user):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="You tried to unfollow yourself"
+                " or someone you are not following.",
+            )
+        await current_user.asave()
     return None
 
 
 @router.get("/followers", response_model=List[UserSchema])
 async def get_followers(
     current_user: User = Depends(get_current_active_user),
-) -> List[User]:
-    return current_user.followers
+) -> List[UserSchema]:
+    return await serialize_all(UserSchema, await current_user.afetch("followers"))
 
 
 @router.get("/following", response_model=List[UserSchema])
 async def get_following(
     current_user: User = Depends(get_current_active_user),
-) -> List[User]:
-    return current_user.following
+) -> List[UserSchema]:
+    return await serialize_all(UserSchema, await current_user.afetch("following"))
 
 
 @router.get("/pets", response_model=List[PetSchema])
-async def get_pets(current_user: User = Depends(get_current_user)) -> List[Pet]:
-    return current_user.pets
+async def get_pets(current_user: User = Depends(get_current_user)) -> List[PetSchema]:
+    return await serialize_all(PetSchema, await current_user.afetch("pets"))
 
 
 @router.get("/locations", response_model=List[LocationSchema])
 async def get_locations(
     current_user: User = Depends(get_current_user),
-) -> List[Location]:
-    return current_user.locations
+) -> List[LocationSchema]:
+    return await serialize_all(LocationSchema, await current_user.afetch("locations"))
 
 
 @router.get("/favorites", response_model=List[LocationSchema])
 async def get_favorites(
     current_user: User = Depends(get_current_user),
-) -> List[Location]:
-    return current_user.favorites
+) -> List[LocationSchema]:
+    return await serialize_all(LocationSchema, await current_user.afetch("favorites"))
 
 
 @router.get("/reviews", response_model=List[UserReviewSchema])
 async def get_reviews(
     current_user: User = Depends(get_current_user),
-) -> List[Review]:
-    return current_user.reviews
+) -> List[UserReviewSchema]:
+    return await serialize_all(UserReviewSchema, await current_user.afetch("reviews"))
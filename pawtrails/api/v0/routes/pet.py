@@ -1,10 +1,23 @@
-from typing import List, cast
+from typing import Any, Dict, List, Optional, cast
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Body, HTTPException, Response, status
 from fastapi.param_functions import Depends
 
-from pawtrails.api.deps import get_current_active_user
-from pawtrails.api.v0.routes.user import get_user_by_uuid
+from pawtrails.api.deps import (
+    check_batch_size,
+    get_current_active_user,
+    get_cursor,
+    set_next_cursor,
+)
+from pawtrails.api.v0.routes.user import get_user_or_404
+from pawtrails.core.database import (
+    BatchResultSchema,
+    Cursor,
+    atomic,
+    run_async,
+    serialize,
+    serialize_all,
+)
 from pawtrails.models.pet import AddPetSchema, Pet, PetSchema, UpdatePetSchema
 from pawtrails.models.user import User, UserSchema
 
@@ -12,47 +25,94 @@ router = APIRouter()
 
 
 async def _check_ownership(user: User, pet: Pet) -> None:
-    if user not in pet.owners:
+    if user not in await pet.afetch("owners"):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"This user {user.username} does not own this pet!",
         )
 
 
+async def get_pet_or_404(uuid: str) -> Pet:
+    pet = cast(Pet, await Pet.aget_by_uuid(uuid))
+    if not pet:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"The pet with the uuid {uuid} does not exist!",
+        )
+
+    return pet
+
+
 @router.get("/", response_model=List[PetSchema])
-async def get_all_pets() -> List[Pet]:
-    return Pet.get_all()
+async def get_all_pets(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Cursor] = Depends(get_cursor),
+) -> List[PetSchema]:
+    pets = await Pet.aget_all(skip, limit, after)
+    set_next_cursor(response, pets, limit)
+    return await serialize_all(PetSchema, pets)
 
 
 @router.post("/", response_model=PetSchema)
 async def add_pet(
     pet_in: AddPetSchema, current_user: User = Depends(get_current_active_user)
-) -> Pet:
+) -> PetSchema:
     pet = Pet(**pet_in.dict())
-    pet.add_owner(current_user)
-    pet.save()
-    return pet
+    await run_async(pet.add_owner, current_user)
+    await pet.asave()
+    return await serialize(PetSchema, pet)
+
+
+def _add_pets(items: List[Dict[str, Any]], owner: User) -> List[BatchResultSchema]:
+    results: List[BatchResultSchema] = []
+    for index, item in enumerate(items):
+        try:
+            pet = Pet(**AddPetSchema.parse_obj(item).dict())
+        except (TypeError, ValueError) as error:
+            results.append(
+                BatchResultSchema(
+                    index=index,
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=str(error),
+                )
+            )
+            continue
+        pet.add_owner(owner)
+        pet.save()
+        results.append(
+            BatchResultSchema(index=index, status=status.HTTP_200_OK, uuid=pet.uuid)
+        )
+    return results
 
 
-@router.get("/{uuid}", response_model=PetSchema)
-async def get_pet(uuid: str) -> Pet:
-    pet = cast(Pet, Pet.get_by_uuid(uuid))
-    if not pet:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"The pet with the uuid {uuid} does not exist!",
-        )
+@router.post("/batch", response_model=List[BatchResultSchema])
+async def add_pets(
+    pets_in: List[Dict[str, Any]] = Body(...),
+    current_user: User = Depends(get_current_active_user),
+) -> List[BatchResultSchema]:
+    """Adds many pets, each validated as in POST /pet/, in one transaction.
+    Returns the result of every item; invalid items do not stop the others.
+    """
+    check_batch_size(pets_in)
+    async with atomic():
+        results = await run_async(_add_pets, pets_in, current_user)
+    return results
 
-    return pet
+
+@router.get("/{uuid}", response_model=PetSchema)
+async def get_pet(uuid: str) -> PetSchema:
+    return await serialize(PetSchema, await get_pet_or_404(uuid))
 
 
 @router.delete("/{uuid}", response_model=None)
 async def delete_pet(
     uuid: str, current_user: User = Depends(get_current_active_user)
 ) -> None:
-    pet = await get_pet(uuid)
+    pet = await get_pet_or_404(uuid)
     await _check_ownership(current_user, pet)
-    pet.delete()  # TODO: Perhaps we should just remove it from this owner
+    await pet.adelete()  # TODO: Perhaps we should just remove it from this owner
 
 
 @router.patch("/{uuid}", response_model=PetSchema)
@@ -60,47 +120,47 @@ async def update_pet(
     pet_in: UpdatePetSchema,
     uuid: str,
     current_user: User = Depends(get_current_active_user),
-) -> Pet:
-    pet = await get_pet(uuid)
+) -> PetSchema:
+    pet = await get_pet_or_404(uuid)
     await _check_ownership(current_user, pet)
     pet.update(**pet_in.dict())
-    pet.save()
-    return pet
+    await pet.asave()
+    return await serialize(PetSchema, pet)
 
 
 @router.get("/{uuid}/owner", response_model=List[UserSchema])
-async def get_pet_owners(uuid: str) -> List[User]:
-    pet = await get_pet(uuid)
-    return pet.owners
+async def get_pet_owners(uuid: str) -> List[UserSchema]:
+    pet = await get_pet_or_404(uuid)
+    return await serialize_all(UserSchema, await pet.afetch("owners"))
 
 
 @router.post("/{uuid}/owner", response_model=PetSchema)
 async def add_pet_owner(
     uuid: str, user_uuid: str, current_user: User = Depends(get_current_active_user)
-) -> Pet:
-    pet = await get_pet(uuid)
+) -> PetSchema:
+    pet = await get_pet_or_404(uuid)
     await _check_ownership(current_user, pet)
-    user = await get_user_by_uuid(user_uuid)
+    user = await get_user_or_404(user_uuid)
 
-    if not pet.add_owner(user):
+    if not await run_async(pet.add_owner, user):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="That user already owns this pet.",
         )
 
-    pet.save()
-    return pet
+    await pet.asave()
+    return await serialize(PetSchema, pet)
 
 
 @router.delete("/{uuid}/owner", response_model=PetSchema)
 async def remove_pet_owner(
     uuid: str, user_uuid: str, current_user: User = Depends(get_current_active_user)
-) -> Pet:
-    pet = await get_pet(uuid)
+) -> PetSchema:
+    pet = await get_pet_or_404(uuid)
     await _check_ownership(current_user, pet)
-    user = await get_user_by_uuid(user_uuid)
+    user = await get_user_or_404(user_uuid)
 
-    if not pet.remove_owner(user):
+    if not await run_async(pet.remove_owner, user):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="That user does not own this pet",
@@ -108,7 +168,7 @@ async def remove_pet_owner(
 
     # All owners decided to abandon this pet, remove it from the database
     if not pet.owners:
-        pet.delete()
-
-    pet.save()
-    return pet
+        await pet.adelete()
+    else:
+        await pet.asave()
+    return await serialize(PetSchema, pet)
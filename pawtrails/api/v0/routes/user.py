@@ -1,24 +1,20 @@
-from typing import List
+from typing import List, Optional, cast
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Depends, Response, status
 from fastapi.exceptions import HTTPException
 
-from pawtrails.models.location import Location, LocationSchema
-from pawtrails.models.pet import Pet, PetSchema
-from pawtrails.models.review import Review, UserReviewSchema
+from pawtrails.api.deps import get_cursor, set_next_cursor
+from pawtrails.core.database import Cursor, serialize, serialize_all
+from pawtrails.models.location import LocationSchema
+from pawtrails.models.pet import PetSchema
+from pawtrails.models.review import UserReviewSchema
 from pawtrails.models.user import User, UserSchema
 
 router = APIRouter()
 
 
-@router.get("/", response_model=List[UserSchema])
-async def get_user_list(skip: int = 0, limit: int = 100) -> List[User]:
-    return User.get_all(skip, limit)
-
-
-@router.get("/{uuid}", response_model=UserSchema)
-async def get_user_by_uuid(uuid: str) -> User:
-    user = User.get_by_uuid(uuid)
+async def get_user_or_404(uuid: str) -> User:
+    user = cast(User, await User.aget_by_uuid(uuid))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -28,37 +24,54 @@ async def get_user_by_uuid(uuid: str) -> User:
     return user
 
 
+@router.get("/", response_model=List[UserSchema])
+async def get_user_list(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Cursor] = Depends(get_cursor),
+) -> List[UserSchema]:
+    users = await User.aget_all(skip, limit, after)
+    set_next_cursor(response, users, limit)
+    return await serialize_all(UserSchema, users)
+
+
+@router.get("/{uuid}", response_model=UserSchema)
+async def get_user_by_uuid(uuid: str) -> UserSchema:
+    return await serialize(UserSchema, await get_user_or_404(uuid))
+
+
 @router.get("/{uuid}/followers", response_model=List[UserSchema])
-async def get_followers_by_uuid(uuid: str) -> List[User]:
-    user = await get_user_by_uuid(uuid)
-    return user.followers
+async def get_followers_by_uuid(uuid: str) -> List[UserSchema]:
+    user = await get_user_or_404(uuid)
+    return await serialize_all(UserSchema, await user.afetch("followers"))
 
 
 @router.get("/{uuid}/following", response_model=List[UserSchema])
-async def get_following_by_uuid(uuid: str) -> List[User]:
-    user = await get_user_by_uuid(uuid)
-    return user.following
+async def get_following_by_uuid(uuid: str) -> List[UserSchema]:
+    user = await get_user_or_404(uuid)
+    return await serialize_all(UserSchema, await user.afetch("following"))
 
 
 @router.get("/{uuid}/pets", response_model=List[PetSchema])
-async def get_pets_by_uuid(uuid: str) -> List[Pet]:
-    user = await get_user_by_uuid(uuid)  # NOTE: coroutines have to be awaited
-    return user.pets
+async def get_pets_by_uuid(uuid: str) -> List[PetSchema]:
+    user = await get_user_or_404(uuid)  # NOTE: coroutines have to be awaited
+    return await serialize_all(PetSchema, await user.afetch("pets"))
 
 
 @router.get("/{uuid}/locations", response_model=List[LocationSchema])
-async def get_locations_by_uuid(uuid: str) -> List[Location]:
-    user = await get_user_by_uuid(uuid)
-    return user.locations
+async def get_locations_by_uuid(uuid: str) -> List[LocationSchema]:
+    user = await get_user_or_404(uuid)
+    return await serialize_all(LocationSchema, await user.afetch("locations"))
 
 
 @router.get("/{uuid}/favorites", response_model=List[LocationSchema])
-async def get_favorites_by_uuid(uuid: str) -> List[Location]:
-    user = await get_user_by_uuid(uuid)
-    return user.favorites
+async def get_favorites_by_uuid(uuid: str) -> List[LocationSchema]:
+    user = await get_user_or_404(uuid)
+    return await serialize_all(LocationSchema, await user.afetch("favorites"))
 
 
 @router.get("/{uuid}/reviews", response_model=List[UserReviewSchema])
-async def get_reviews_by_uuid(uuid: str) -> List[Review]:
-    user = await get_user_by_uuid(uuid)
-    return user.reviews
+async def get_reviews_by_uuid(uuid: str) -> List[UserReviewSchema]:
+    user = await get_user_or_404(uuid)
+    return await serialize_all(UserReviewSchema, await user.afetch("reviews"))
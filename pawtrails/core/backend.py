@@ -0,0 +1,553 @@
+from __future__ import annotations
+
+import itertools
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from neotime import DateTime
+from py2neo import Node, Relationship
+
+from pawtrails.core.metrics import QUERY_SECONDS
+from pawtrails.core.tracing import traced
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Position in a list of nodes ordered by (created_at, uuid); used for pagination
+Cursor = Tuple[DateTime, str]
+
+
+class Counter(NamedTuple):
+    """A denormalized counter property: the number of relationships of a type, in a
+    direction (as in RelatedTo/RelatedFrom), to nodes with a label. With total set,
+    the sum of that property of the related nodes instead.
+    """
+
+    relationship_type: str
+    direction: int
+    label: str
+    total: Optional[str] = None
+
+    @property
+    def cypher(self) -> str:
+        left = "<-" if self.direction < 0 else "-"
+        right = "->" if self.direction > 0 else "-"
+        pattern = f"(n){left}[:{self.relationship_type}]{right}"
+        if self.total:
+            return (
+                f"reduce(s = 0, x IN [{pattern}(m:{self.label}) | m.{self.total}]"
+                " | s + x)"
+            )
+        return f"size({pattern}(:{self.label}))"
+
+
+class UniquenessError(Exception):
+    """Raised when a write would give two nodes with a label the same value of a
+    unique property (a uniqueness constraint in Neo4j). Nothing is written."""
+
+    def __init__(self, label: str, key: str) -> None:
+        super().__init__(f"A {label} with this {key} already exists.")
+        self.label = label
+        self.key = key
+
+
+class RelationshipChange(NamedTuple):
+    """A relationship of a node (start) to create or update, or to delete."""
+
+    relationship_type: str
+    direction: int
+    start: Node
+    end: Node
+    properties: Optional[Dict[str, Any]]  # None deletes the relationship
+
+
+class Changes(NamedTuple):
+    """Everything a unit of work writes, see Backend.commit."""
+
+    # New nodes, bound to the backend by the commit
+    create: List[Node]
+    # Existing nodes and the counter properties whose stored value is kept
+    update: List[Tuple[Node, Tuple[str, ...]]]
+    # Counter deltas of existing nodes; the new values are copied back to the nodes
+    counts: List[Tuple[Node, Dict[str, int]]]
+    relationships: List[RelationshipChange]
+    delete: List[Node]
+    # Counters by label, the ones of the neighbours of deleted nodes are recounted
+    counters: Dict[str, Dict[str, Counter]]
+    # Unique properties by label, see UniquenessError
+    unique: Dict[str, Tuple[str, ...]]
+
+
+class Backend:
+    """The storage the Models read from and write to. The Models only use the
+    operations below; queries that do not fit them (e.g. the location search) are
+    implemented once per backend and registered under a name, see register.
+    """
+
+    queries: Dict[str, Callable[..., Any]] = {}
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.queries = {}
+
+    @classmethod
+    def register(cls, name: str) -> Callable[[F], F]:
+        """Registers the implementation of a named query for this backend. It is
+        called with the backend as the first argument.
+
+        Args:
+            name (str): Name of the query, e.g. "Location.search"
+
+        Returns:
+            Callable[[F], F]: The decorator
+        """
+
+        def decorator(func: F) -> F:
+            cls.queries[name] = func
+            return func
+
+        return decorator
+
+    def query(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        """Runs a named query, see register.
+
+        Args:
+            name (str): Name of the query
+            args (list): Positional arguments of the query
+            kwargs (dict): Keyword arguments of the query
+
+        Raises:
+            NotImplementedError: The query is not registered for this backend
+
+        Returns:
+            Any: The result of the query
+        """
+        func = type(self).queries.get(name)
+        if func is None:
+            raise NotImplementedError(f"{type(self).__name__} has no query {name}.")
+        with QUERY_SECONDS.labels(name).time():
+            return func(self, *args, **kwargs)
+
+    def warm_up(self) -> None:
+        """Prepares the backend and checks that it works."""
+
+    def find(
+        self,
+        label: str,
+        properties: Dict[str, Any],
+        skip: int,
+        limit: int,
+        after: Optional[Cursor],
+    ) -> List[Node]:
+        """Returns the nodes with the label and property values, ordered by
+        (created_at, uuid).
+
+        Args:
+            label (str): Label of the nodes
+            properties (Dict[str, Any]): Property values the nodes must have
+            skip (int): Number of nodes to skip
+            limit (int): Maximum number of nodes to return
+            after (Optional[Cursor]): Only return the nodes after this cursor
+
+        Returns:
+            List[Node]: The matching nodes
+        """
+        raise NotImplementedError
+
+    def get_many(self, label: str, uuids: Sequence[str]) -> List[Node]:
+        """Returns the nodes with the label and one of the uuids.
+
+        Args:
+            label (str): Label of the nodes
+            uuids (Sequence[str]): The UUID4 hex strings
+
+        Returns:
+            List[Node]: The nodes that exist
+        """
+        raise NotImplementedError
+
+    def related(
+        self, label: str, uuids: Sequence[str], relationship_type: str, direction: int
+    ) -> List[Tuple[str, Dict[str, Any], Node]]:
+        """Returns the relationships of a type, in a direction, of many nodes.
+
+        Args:
+            label (str): Label of the nodes
+            uuids (Sequence[str]): The uuids of the nodes
+            relationship_type (str): Type of the relationships
+            direction (int): 1 outgoing, -1 incoming, 0 both
+
+        Returns:
+            List[Tuple[str, Dict[str, Any], Node]]: (uuid, relationship properties,
+                related node) of every relationship
+        """
+        raise NotImplementedError
+
+    def commit(self, changes: Changes) -> None:
+        """Writes all the changes atomically.
+
+        Args:
+            changes (Changes): The changes of a unit of work
+        """
+        raise NotImplementedError
+
+    def recount_all(
+        self, label: str, counters: Dict[str, Counter], batch_size: int
+    ) -> Iterator[int]:
+        """Recomputes the counter properties of all the nodes with the label.
+
+        Args:
+            label (str): Label of the nodes
+            counters (Dict[str, Counter]): The counter properties
+            batch_size (int): Number of nodes to recount at once
+
+        Yields:
+            Iterator[int]: The number of nodes recounted so far
+        """
+        raise NotImplementedError
+
+
+class _MemoryTransaction:
+    """The part of a py2neo Transaction used to load related objects."""
+
+    def __init__(self, graph: MemoryBackend) -> None:
+        self.graph = graph
+
+
+class MemoryBackend(Backend):
+    """Keeps the graph in the memory of the process, for tests and benchmarks that
+    should not need a Neo4j server. Nothing is persisted and every process has its
+    own graph. The nodes it returns are bound to it, so py2neo loads related objects
+    through update and match, the same as with a Graph. Each call of find, get_many,
+    related, query, match and commit counts as one statement, see query_stats.
+    """
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self.service = self  # Bound py2neo nodes hash their graph's service and name
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.nodes: Dict[int, Tuple[FrozenSet[str], Dict[str, Any]]] = {}
+        # Node ids by label and by uuid, the indexes of the memory graph
+        self.labels: Dict[str, Set[int]] = {}
+        self.uuids: Dict[str, int] = {}
+        # Relationships by id: (start id, type, end id, properties)
+        self.relationships: Dict[int, Tuple[int, str, int, Dict[str, Any]]] = {}
+        # Relationship ids by the id of a node at either end
+        self.edges: Dict[int, Set[int]] = {}
+
+    def clear(self, labels: Optional[Iterable[str]] = None) -> None:
+        """Deletes the nodes (with one of the labels) and their relationships.
+
+        Args:
+            labels (Optional[Iterable[str]]): Only delete nodes with these labels
+        """
+        with self.lock:
+            selected = set(labels) if labels else None
+            for identity, (node_labels, _) in list(self.nodes.items()):
+                if selected is None or node_labels & selected:
+                    self._delete(identity)
+
+    def create(self, labels: Iterable[str], properties: Dict[str, Any]) -> int:
+        """Stores a new node.
+
+        Args:
+            labels (Iterable[str]): Labels of the node
+            properties (Dict[str, Any]): Properties of the node
+
+        Returns:
+            int: Id of the node
+        """
+        with self.lock:
+            identity = next(self.ids)
+            self.nodes[identity] = (frozenset(labels), dict(properties))
+            for label in self.nodes[identity][0]:
+                self.labels.setdefault(label, set()).add(identity)
+            if properties.get("uuid"):
+                self.uuids[properties["uuid"]] = identity
+            return identity
+
+    def relate(
+        self, start: int, relationship_type: str, end: int, properties: Dict[str, Any]
+    ) -> int:
+        """Stores a new relationship between two nodes.
+
+        Args:
+            start (int): Id of the start node
+            relationship_type (str): Type of the relationship
+            end (int): Id of the end node
+            properties (Dict[str, Any]): Properties of the relationship
+
+        Returns:
+            int: Id of the relationship
+        """
+        with self.lock:
+            rel_id = next(self.ids)
+            rel = (start, relationship_type, end, dict(properties))
+            self.relationships[rel_id] = rel
+            self.edges.setdefault(start, set()).add(rel_id)
+            self.edges.setdefault(end, set()).add(rel_id)
+            return rel_id
+
+    def node(self, identity: int) -> Node:
+        """Returns a copy of a stored node, bound to this backend.
+
+        Args:
+            identity (int): Id of the node
+
+        Returns:
+            Node: The py2neo Node
+        """
+        labels, properties = self.nodes[identity]
+        node = Node(*labels, **properties)
+        node.graph, node.identity = self, identity
+        return node
+
+    def all(self, label: str) -> List[Node]:
+        """Returns all the nodes with the label, for the registered queries.
+
+        Args:
+            label (str): Label of the nodes
+
+        Returns:
+            List[Node]: The nodes, in no particular order
+        """
+        with self.lock:
+            return [self.node(identity) for identity in self.labels.get(label, ())]
+
+    @staticmethod
+    def page(
+        nodes: Iterable[Node], skip: int, limit: int, after: Optional[Cursor]
+    ) -> List[Node]:
+        """Orders the nodes by (created_at, uuid) and returns the requested page.
+
+        Args:
+            nodes (Iterable[Node]): The nodes
+            skip (int): Number of nodes to skip
+            limit (int): Maximum number of nodes to return
+            after (Optional[Cursor]): Only return the nodes after this cursor
+
+        Returns:
+            List[Node]: The page of nodes
+        """
+        ordered = sorted(nodes, key=lambda node: (node["created_at"], node["uuid"]))
+        if after:
+            ordered = [n for n in ordered if (n["created_at"], n["uuid"]) > after]
+        return ordered[skip : skip + limit]
+
+    @traced(lambda self, label, properties, *args: f"find {label} {sorted(properties)}")
+    def find(
+        self,
+        label: str,
+        properties: Dict[str, Any],
+        skip: int,
+        limit: int,
+        after: Optional[Cursor],
+    ) -> List[Node]:
+        nodes = [
+            node
+            for node in self.all(label)
+            if all(node.get(key) == value for key, value in properties.items())
+        ]
+        return self.page(nodes, skip, limit, after)
+
+    @traced(lambda self, label, uuids: f"get_many {label}")
+    def get_many(self, label: str, uuids: Sequence[str]) -> List[Node]:
+        with self.lock:
+            ids = {self.uuids.get(uuid) for uuid in uuids}
+            return [
+                self.node(identity)
+                for identity in ids
+                if identity is not None and label in self.nodes[identity][0]
+            ]
+
+    def _neighbours(
+        self, identity: int, relationship_type: Optional[str], direction: int
+    ) -> Iterator[Tuple[int, int]]:
+        """Yields the (relationship id, other node id) of the node's relationships."""
+        for rel_id in self.edges.get(identity, ()):
+            start, rel_type, end, _ = self.relationships[rel_id]
+            if relationship_type is not None and rel_type != relationship_type:
+                continue
+            if start == identity and direction >= 0:
+                yield rel_id, end
+            elif end == identity and direction <= 0:
+                yield rel_id, start
+
+    @traced(lambda self, label, uuids, *args: f"related {label} {args}")
+    def related(
+        self, label: str, uuids: Sequence[str], relationship_type: str, direction: int
+    ) -> List[Tuple[str, Dict[str, Any], Node]]:
+        with self.lock:
+            results: List[Tuple[str, Dict[str, Any], Node]] = []
+            for node in self.get_many(label, uuids):
+                for rel_id, other in self._neighbours(
+                    node.identity, relationship_type, direction
+                ):
+                    properties = dict(self.relationships[rel_id][3])
+                    results.append((node["uuid"], properties, self.node(other)))
+            return results
+
+    @traced(lambda self, name, *args, **kwargs: name)
+    def query(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        return super().query(name, *args, **kwargs)
+
+    def update(self, func: Callable[[_MemoryTransaction], Any], **kwargs: Any) -> None:
+        """Runs a function in a transaction, like Graph.update. Used by py2neo."""
+        with self.lock:
+            func(_MemoryTransaction(self))
+
+    @traced(lambda self, nodes, r_type=None: f"match {r_type}")
+    def match(
+        self, nodes: Iterable[Optional[Node]], r_type: Optional[str] = None
+    ) -> List[Relationship]:
+        """Returns the relationships between the nodes, like Graph.match. Used by
+        py2neo to load related objects, a None node matches any node.
+        """
+        ordered = not isinstance(nodes, (set, frozenset))
+        bound = [node.identity if node is not None else None for node in nodes]
+        matches: List[Relationship] = []
+        with self.lock:
+            known = [identity for identity in bound if identity is not None]
+            # Only the relationships of a given node can match, if there is one
+            rel_ids: Iterable[int] = (
+                self.edges.get(known[0], set()) if known else self.relationships
+            )
+            for rel_id in list(rel_ids):
+                start, rel_type, end, properties = self.relationships[rel_id]
+                if r_type is not None and rel_type != r_type:
+                    continue
+                if ordered and len(bound) == 2:
+                    ends = zip(bound, (start, end))
+                    if not all(b is None or b == i for b, i in ends):
+                        continue
+                elif not all(b is None or b in (start, end) for b in bound):
+                    continue
+                start_node, end_node = self.node(start), self.node(end)
+                rel = Relationship(start_node, rel_type, end_node, **properties)
+                rel.graph, rel.identity = self, rel_id
+                matches.append(rel)
+        return matches
+
+    @traced(lambda self, changes: "commit")
+    def commit(self, changes: Changes) -> None:
+        with self.lock:
+            self._check_unique(changes)
+            for node in changes.create:
+                node.graph, node.identity = self, self.create(node.labels, dict(node))
+            for node, keep in changes.update:
+                labels, stored = self.nodes[node.identity]
+                properties = dict(node)
+                properties.update({key: stored[key] for key in keep if key in stored})
+                self.nodes[node.identity] = (labels, properties)
+            for node, deltas in changes.counts:
+                stored = self.nodes[node.identity][1]
+                for key, delta in deltas.items():
+                    stored[key] = (stored.get(key) or 0) + delta
+                node.update({key: stored[key] for key in deltas})
+            for change in changes.relationships:
+                self._write_relationship(change)
+            for node in changes.delete:
+                deleted = node.identity
+                neighbours = {other for _, other in self._neighbours(deleted, None, 0)}
+                self._delete(deleted)
+                node.graph, node.identity = None, None
+                for identity in neighbours - {deleted}:
+                    self._recount(identity, changes.counters)
+
+    def _check_unique(self, changes: Changes) -> None:
+        """Enforces the uniqueness constraints of the labels, like Neo4j does."""
+        written = changes.create + [node for node, _ in changes.update]
+        # (label, key, value) -> the node of the batch that writes it
+        batch: Dict[Tuple[str, str, Any], Node] = {}
+        for node in written:
+            for label in node.labels:
+                for key in changes.unique.get(label, ()):
+                    value = node.get(key)
+                    if value is None:
+                        continue
+                    if batch.setdefault((label, key, value), node) is not node:
+                        raise UniquenessError(label, key)
+                    if key == "uuid":  # Indexed
+                        identity = self.uuids.get(value, node.identity)
+                        if identity != node.identity:
+                            raise UniquenessError(label, key)
+                        continue
+                    for identity in self.labels.get(label, ()):
+                        if identity != node.identity and (
+                            self.nodes[identity][1].get(key) == value
+                        ):
+                            raise UniquenessError(label, key)
+
+    def _write_relationship(self, change: RelationshipChange) -> None:
+        a, b = change.start.identity, change.end.identity
+        existing = [
+            rel_id
+            for rel_id, other in self._neighbours(
+                a, change.relationship_type, change.direction
+            )
+            if other == b
+        ]
+        if change.properties is None:
+            for rel_id in existing:
+                self._delete_relationship(rel_id)
+        elif existing:
+            start, rel_type, end, _ = self.relationships[existing[0]]
+            properties = dict(change.properties)
+            self.relationships[existing[0]] = (start, rel_type, end, properties)
+        else:
+            start, end = (b, a) if change.direction < 0 else (a, b)
+            self.relate(start, change.relationship_type, end, change.properties)
+
+    def _delete_relationship(self, rel_id: int) -> None:
+        start, _, end, _ = self.relationships.pop(rel_id)
+        self.edges.get(start, set()).discard(rel_id)
+        self.edges.get(end, set()).discard(rel_id)
+
+    def _delete(self, identity: int) -> None:
+        for rel_id in list(self.edges.get(identity, ())):
+            self._delete_relationship(rel_id)
+        self.edges.pop(identity, None)
+        labels, properties = self.nodes.pop(identity)
+        for label in labels:
+            self.labels[label].discard(identity)
+        self.uuids.pop(properties.get("uuid", ""), None)
+
+    def _count(self, identity: int, counter: Counter) -> int:
+        value = 0
+        for _, other in self._neighbours(
+            identity, counter.relationship_type, counter.direction
+        ):
+            labels, properties = self.nodes[other]
+            if counter.label in labels:
+                value += (properties.get(counter.total) or 0) if counter.total else 1
+        return value
+
+    def _recount(self, identity: int, counters: Dict[str, Dict[str, Counter]]) -> None:
+        labels, properties = self.nodes[identity]
+        for label in labels:
+            for key, counter in counters.get(label, {}).items():
+                properties[key] = self._count(identity, counter)
+
+    def recount_all(
+        self, label: str, counters: Dict[str, Counter], batch_size: int
+    ) -> Iterator[int]:
+        with self.lock:
+            ids = list(self.labels.get(label, ()))
+            for identity in ids:
+                self._recount(identity, {label: counters})
+        yield len(ids)
@@ -1,37 +1,973 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
-from typing import Any, List, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 from uuid import uuid4
 
 import jsonpickle
 from neotime import DateTime
-from py2neo import Graph
-from py2neo.ogm import Model, Property, Repository
+from py2neo import Graph, Node, Transaction
+from py2neo.errors import (
+    ClientError,
+    ConnectionLimit,
+    ConnectionUnavailable,
+    Neo4jError,
+    WriteServiceUnavailable,
+)
+from py2neo.ogm import Model, Property, RelatedObjects, Repository
+from py2neo.timing import Timer
 from pydantic import BaseModel as Schema
 from pydantic import Field
 
+from pawtrails.core.backend import (
+    Backend,
+    Changes,
+    Counter,
+    Cursor,
+    MemoryBackend,
+    RelationshipChange,
+    UniquenessError,
+)
+from pawtrails.core.metrics import (
+    POOL_IN_USE,
+    POOL_SIZE,
+    POOL_TIMEOUTS,
+    POOL_WAIT_SECONDS,
+    POOL_WAITING,
+    QUERY_SECONDS,
+)
 from pawtrails.core.settings import settings
+from pawtrails.core.tracing import trace_graph
+
+T = TypeVar("T")
+S = TypeVar("S", bound=Schema)
 
-graph = Graph(
-    host=settings.NEO4J_HOST,
-    auth=(settings.NEO4J_USER, settings.NEO4J_PASS),
-    name=settings.NEO4J_GRAPH_NAME,
+# Cypher condition for the nodes (aliased as _) that come after the cursor
+AFTER_CURSOR = (
+    "(_.created_at > $after_created_at"
+    " OR (_.created_at = $after_created_at AND _.uuid > $after_uuid))"
 )
 
-repository = Repository(
-    host=settings.NEO4J_HOST,
-    auth=(settings.NEO4J_USER, settings.NEO4J_PASS),
-    name=settings.NEO4J_GRAPH_NAME,
+
+def encode_cursor(obj: BaseModel) -> str:
+    """Returns an opaque cursor that points right after the given object.
+
+    Args:
+        obj (BaseModel): The last Neo4j Model Object of a page
+
+    Returns:
+        str: URL safe cursor
+    """
+    # Full (nanosecond) precision, a rounded cursor would repeat the last object
+    created_at = obj._created_at.iso_format() if obj._created_at else None
+    data = json.dumps([created_at, obj.uuid]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Decodes a cursor created by encode_cursor.
+
+    Args:
+        cursor (str): URL safe cursor
+
+    Raises:
+        ValueError: The cursor is not valid
+
+    Returns:
+        Cursor: The (created_at, uuid) the cursor points after
+    """
+    try:
+        created_at, uuid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return DateTime.from_iso_format(created_at), str(uuid)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Cursor {cursor} is not valid.") from e
+
+
+def cursor_parameters(after: Optional[Cursor]) -> Dict[str, Any]:
+    """Returns the query parameters used by the AFTER_CURSOR condition.
+
+    Args:
+        after (Optional[Cursor]): The decoded cursor
+
+    Returns:
+        Dict[str, Any]: The query parameters
+    """
+    if not after:
+        return {"after_created_at": None, "after_uuid": None}
+    return {"after_created_at": after[0], "after_uuid": after[1]}
+
+
+class DatabaseBusyError(Exception):
+    """Raised when no database connection could be acquired in time."""
+
+
+class _Connection:
+    """The backend, the Graphs (connection pools) and the executor of the current
+    process. All are created lazily, so every gunicorn worker opens its own after the
+    fork instead of sharing the connections of the master process.
+    """
+
+    lock = threading.Lock()
+    pid: Optional[int] = None
+    backend: Optional[Backend] = None
+    graph: Optional[Graph] = None
+    # One Graph per read replica in NEO4J_READ_HOSTS, see get_graph
+    read_graphs: List[Graph] = []
+    executor: Optional[ThreadPoolExecutor] = None
+    # Free executor slots per event loop, see run_async
+    slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    stats: Dict[str, float] = {"waiting": 0, "acquired": 0, "timeouts": 0, "wait": 0}
+
+    @staticmethod
+    def _open_graph(host: str) -> Graph:
+        graph = Graph(
+            host=host,
+            auth=(settings.NEO4J_USER, settings.NEO4J_PASS),
+            name=settings.NEO4J_GRAPH_NAME,
+            init_size=settings.NEO4J_POOL_INIT_SIZE,
+            max_size=settings.NEO4J_POOL_SIZE,
+            max_age=settings.NEO4J_MAX_CONNECTION_LIFETIME,
+        )
+        trace_graph(graph)
+        return graph
+
+    @classmethod
+    def open(cls) -> None:
+        with cls.lock:
+            if cls.pid == os.getpid():
+                return
+            if settings.DATABASE_BACKEND == "memory":
+                if not isinstance(cls.backend, MemoryBackend):
+                    cls.backend = MemoryBackend()
+            else:
+                cls.graph = cls._open_graph(settings.NEO4J_HOST)
+                cls.read_graphs = [
+                    cls._open_graph(host) for host in settings.NEO4J_READ_HOSTS
+                ]
+                cls.backend = Neo4jBackend()
+            # One thread per pooled connection, so no thread waits inside py2neo
+            cls.executor = ThreadPoolExecutor(
+                max_workers=settings.NEO4J_POOL_SIZE, thread_name_prefix="neo4j"
+            )
+            cls.slots = weakref.WeakKeyDictionary()
+            cls.pid = os.getpid()
+            POOL_SIZE.set(settings.NEO4J_POOL_SIZE)
+
+
+class _Routing:
+    """Where the reads of the current request go, see read_routing."""
+
+    def __init__(self, readonly: bool, last_write: float) -> None:
+        self.readonly = readonly
+        self.last_write = last_write
+        self.graph: Optional[Graph] = None
+
+
+_routing: contextvars.ContextVar[Optional[_Routing]] = contextvars.ContextVar(
+    "routing", default=None
 )
 
 
+def encode_consistency_token(last_write: float) -> str:
+    """Encodes the time of the last write of a client into an opaque token.
+
+    Args:
+        last_write (float): UNIX timestamp of the last committed write
+
+    Returns:
+        str: The consistency token
+    """
+    return f"{last_write:.6f}"
+
+
+def decode_consistency_token(token: Optional[str]) -> float:
+    """Decodes a consistency token, see encode_consistency_token.
+
+    Args:
+        token (Optional[str]): The token sent by the client
+
+    Returns:
+        float: UNIX timestamp of the last write, 0 if the token is missing or invalid
+    """
+    try:
+        return float(token) if token else 0.0
+    except ValueError:
+        return 0.0
+
+
+@contextmanager
+def read_routing(readonly: bool, token: Optional[str] = None) -> Iterator[_Routing]:
+    """Opens a (request) scope whose read queries may go to a read replica.
+
+    Reads go to a replica only if the scope is readonly and the client did not write
+    in the last NEO4J_REPLICA_MAX_LAG seconds, so clients see their own writes. This
+    stands in for causal consistency bookmarks, which py2neo cannot send with BEGIN.
+    The time of a write made inside the scope is kept in the yielded state, so it can
+    be handed back to the client as a new token.
+
+    Args:
+        readonly (bool): True if the scope does not write, e.g. a GET request
+        token (Optional[str]): Consistency token of the client's last write
+
+    Yields:
+        Iterator[_Routing]: The routing state of the scope
+    """
+    state = _Routing(readonly, decode_consistency_token(token))
+    reset = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(reset)
+
+
+def set_read_only() -> None:
+    """Allows the reads of the current scope to go to a read replica. For routes that
+    only read, but are not GET requests (e.g. search)."""
+    state = _routing.get()
+    if state is not None:
+        state.readonly = True
+
+
+def _mark_write() -> None:
+    state = _routing.get()
+    if state is not None:
+        state.last_write = time.time()
+        state.graph = None
+
+
+def get_graph(readonly: bool = False) -> Graph:
+    """Returns a Graph shared by the current process; opens them on the first call.
+    Writes always use the primary. A read uses one of the read replicas when the
+    current scope allows it (see read_routing) and the same one for the whole scope.
+
+    Args:
+        readonly (bool): True if the caller only reads. Defaults to False.
+
+    Raises:
+        RuntimeError: The memory backend is used, there is no Graph
+
+    Returns:
+        Graph: The py2neo Graph
+    """
+    if _Connection.pid != os.getpid():
+        _Connection.open()
+    if _Connection.graph is None:
+        raise RuntimeError("There is no Neo4j Graph, DATABASE_BACKEND is memory.")
+    state = _routing.get()
+    if (
+        readonly
+        and state is not None
+        and state.readonly
+        and _Connection.read_graphs
+        and time.time() - state.last_write >= settings.NEO4J_REPLICA_MAX_LAG
+    ):
+        if state.graph is None:
+            state.graph = random.choice(_Connection.read_graphs)
+        return state.graph
+    return cast(Graph, _Connection.graph)
+
+
+def get_repository(readonly: bool = False) -> Repository:
+    """Returns an OGM Repository that uses the shared Graph (and connection pool).
+
+    Args:
+        readonly (bool): True if the caller only reads, see get_graph
+
+    Returns:
+        Repository: The py2neo OGM Repository
+    """
+    return Repository.wrap(get_graph(readonly))
+
+
+def get_backend() -> Backend:
+    """Returns the backend the Models use, chosen by DATABASE_BACKEND.
+
+    Returns:
+        Backend: The backend of the current process
+    """
+    if _Connection.pid != os.getpid():
+        _Connection.open()
+    return cast(Backend, _Connection.backend)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the bounded executor that runs the blocking py2neo calls.
+
+    Returns:
+        ThreadPoolExecutor: The executor of the current process
+    """
+    if _Connection.pid != os.getpid():
+        _Connection.open()
+    return cast(ThreadPoolExecutor, _Connection.executor)
+
+
+def warm_up() -> None:
+    """Opens the connection pool, seeded with NEO4J_POOL_INIT_SIZE connections, and
+    checks that the database answers. Called when the application starts.
+    """
+    get_backend().warm_up()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Returns the usage statistics of the connection pool of the current process.
+
+    Returns:
+        Dict[str, Any]: The pool statistics
+    """
+    get_backend()
+    in_use = _Connection.graph.service.connector.in_use if _Connection.graph else {}
+    stats = _Connection.stats
+    return {
+        "pid": os.getpid(),
+        "size": settings.NEO4J_POOL_SIZE,
+        "read_replicas": len(_Connection.read_graphs),
+        "in_use": sum(in_use.values()),
+        "waiting": int(stats["waiting"]),
+        "acquired": int(stats["acquired"]),
+        "timeouts": int(stats["timeouts"]),
+        "wait_seconds": round(stats["wait"], 6),
+    }
+
+
+def _get_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _Connection.slots:
+        _Connection.slots[loop] = asyncio.Semaphore(settings.NEO4J_POOL_SIZE)
+    return _Connection.slots[loop]
+
+
+async def run_async(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking (py2neo) call on the database executor and awaits the result.
+    The current context is copied, so context variables are visible to the call.
+    Waits at most NEO4J_ACQUISITION_TIMEOUT seconds for a free connection.
+
+    Args:
+        func (Callable[..., T]): The blocking function to call
+        args (list): Positional arguments for the function
+        kwargs (dict): Keyword arguments for the function
+
+    Raises:
+        DatabaseBusyError: No connection was free in time
+
+    Returns:
+        T: The result of the function call
+    """
+    executor = get_executor()
+    slots = _get_slots()
+    stats = _Connection.stats
+    start = time.perf_counter()
+    stats["waiting"] += 1
+    POOL_WAITING.inc()
+    try:
+        await asyncio.wait_for(slots.acquire(), settings.NEO4J_ACQUISITION_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        POOL_TIMEOUTS.inc()
+        raise DatabaseBusyError("No database connection is available.")
+    finally:
+        stats["waiting"] -= 1
+        POOL_WAITING.dec()
+    stats["acquired"] += 1
+    stats["wait"] += time.perf_counter() - start
+    POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+    POOL_IN_USE.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await loop.run_in_executor(executor, call)
+    finally:
+        POOL_IN_USE.dec()
+        slots.release()
+
+
+def _serialize_all(schema: Type[S], objs: Iterable[Any]) -> List[S]:
+    objs = list(objs)
+    prefetch(schema, [obj for obj in objs if isinstance(obj, BaseModel)])
+    return [schema.from_orm(obj) for obj in objs]
+
+
+async def serialize(schema: Type[S], obj: Any) -> S:
+    """Converts a Neo4j Model Object into the given schema on the database executor.
+    Lazily loaded relationships (creator, grade, counts...) are resolved there.
+
+    Args:
+        schema (Type[S]): The Pydantic schema in orm_mode
+        obj (Any): The Neo4j Model Object
+
+    Returns:
+        S: The schema instance
+    """
+    return (await run_async(_serialize_all, schema, [obj]))[0]
+
+
+async def serialize_all(schema: Type[S], objs: Iterable[Any]) -> List[S]:
+    """Converts a list of Neo4j Model Objects into the given schema on the database
+    executor. See serialize above.
+
+    Args:
+        schema (Type[S]): The Pydantic schema in orm_mode
+        objs (Iterable[Any]): The Neo4j Model Objects
+
+    Returns:
+        List[S]: The schema instances
+    """
+    return await run_async(_serialize_all, schema, objs)
+
+
+def prefetch(schema: Type[Schema], objs: Sequence[BaseModel]) -> None:
+    """Loads every relationship the schema needs for all the objects at once, using
+    one query per relationship instead of one per object. The models declare which
+    schema fields are backed by which relationship in their __prefetch__ mapping.
+    Nested schemas (e.g. the creator of a location) are prefetched recursively.
+
+    Args:
+        schema (Type[Schema]): The Pydantic schema the objects will be converted to
+        objs (Sequence[BaseModel]): Neo4j Model Objects of the same type
+    """
+    if not objs:
+        return
+    relationships = type(objs[0]).__prefetch__
+    for name, field in schema.__fields__.items():
+        if name not in relationships:
+            continue
+        related = _prefetch_related(objs, relationships[name])
+        if isinstance(field.type_, type) and issubclass(field.type_, Schema):
+            prefetch(field.type_, related)
+
+
+def _get_loaded(related: RelatedObjects) -> Optional[List[Tuple[BaseModel, dict]]]:
+    # NOTE: py2neo keeps the loaded related objects in this private attribute
+    return related._RelatedObjects__related_objects  # type: ignore
+
+
+def _set_loaded(related: RelatedObjects, loaded: List[Tuple[BaseModel, dict]]) -> None:
+    related._RelatedObjects__related_objects = loaded  # type: ignore
+
+
+def _prefetch_related(objs: Sequence[BaseModel], attribute: str) -> List[BaseModel]:
+    """Loads a relationship of many objects at once, e.g. with one UNWIND query.
+
+    Args:
+        objs (Sequence[BaseModel]): Neo4j Model Objects of the same type
+        attribute (str): Name of the Related attribute, e.g. "_creator"
+
+    Returns:
+        List[BaseModel]: All the related objects (of all the objects)
+    """
+    model = type(objs[0])
+    descriptor = inspect.getattr_static(model, attribute)
+    pending: Dict[str, List[RelatedObjects]] = {}
+    related_objs: Dict[int, BaseModel] = {}
+    for obj in objs:
+        related = getattr(obj, attribute)
+        loaded = _get_loaded(related)
+        if loaded is not None:
+            related_objs.update((id(rel), rel) for rel, _ in loaded)
+        elif obj.__node__.graph is not None and obj.uuid:
+            pending.setdefault(obj.uuid, []).append(related)
+    if not pending:
+        return list(related_objs.values())
+
+    results: Dict[str, List[Tuple[BaseModel, dict]]] = {uuid: [] for uuid in pending}
+    related_class = getattr(objs[0], attribute).related_class
+    for uuid, properties, node in get_backend().related(
+        model.__primarylabel__,
+        list(pending),
+        descriptor.relationship_type,
+        descriptor.direction,
+    ):
+        rel = related_class.wrap(node)
+        related_objs[id(rel)] = rel
+        results[uuid].append((rel, properties))
+    for uuid, related_list in pending.items():
+        for related in related_list:
+            _set_loaded(related, list(results[uuid]))
+    return list(related_objs.values())
+
+
+# Nodes loaded during the current request, keyed by (label, uuid). See identity_map.
+_identity_map: contextvars.ContextVar[Optional[Dict[Tuple[str, str], BaseModel]]] = (
+    contextvars.ContextVar("identity_map", default=None)
+)
+
+
+@contextmanager
+def identity_map() -> Iterator[None]:
+    """Opens a (request) scope in which every Node is loaded only once. Looking up
+    the same uuid or traversing a relationship to an already loaded Node returns the
+    same Neo4j Model Object instead of a new copy.
+    """
+    token = _identity_map.set({})
+    try:
+        yield
+    finally:
+        _identity_map.reset(token)
+
+
+# Link operations: (relationship set, related object, properties or None to unlink)
+Link = Tuple[RelatedObjects, "BaseModel", Optional[Dict[str, Any]]]
+
+_unit_of_work: contextvars.ContextVar[Optional[UnitOfWork]] = contextvars.ContextVar(
+    "unit_of_work", default=None
+)
+
+
+class UnitOfWork:
+    """Collects the objects saved and deleted in a scope and commits all their
+    changes (new nodes, properties, counters and relationship additions/removals) in
+    one explicit transaction. The transaction is retried on transient errors for at
+    most NEO4J_MAX_RETRY_TIME seconds, so it only changes memory after the commit.
+
+    Outside of a scope, BaseModel.save and delete commit a unit of their own. Use it as
+    a context manager in blocking code and through atomic in async code.
+    """
+
+    def __init__(self) -> None:
+        self.saves: Dict[int, BaseModel] = {}
+        self.deletes: Dict[int, BaseModel] = {}
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> UnitOfWork:
+        self._token = _unit_of_work.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        _unit_of_work.reset(cast(contextvars.Token, self._token))
+        if exc_type is None:
+            self.commit()
+
+    def save(self, obj: BaseModel) -> UnitOfWork:
+        """Schedules the creation or update of an object.
+
+        Args:
+            obj (BaseModel): The Neo4j Model Object to save
+
+        Returns:
+            UnitOfWork: This unit of work
+        """
+        self.deletes.pop(id(obj), None)
+        obj._stamp()
+        self.saves[id(obj)] = obj
+        return self
+
+    def delete(self, obj: BaseModel) -> UnitOfWork:
+        """Schedules the deletion of an object.
+
+        Args:
+            obj (BaseModel): The Neo4j Model Object to delete
+
+        Returns:
+            UnitOfWork: This unit of work
+        """
+        self.saves.pop(id(obj), None)
+        if obj.__node__.graph is not None:
+            self.deletes[id(obj)] = obj
+        return self
+
+    def commit(self) -> None:
+        """Commits all the scheduled changes in a single transaction."""
+        # Related objects that were never saved are created along with the links
+        for obj in list(self.saves.values()):
+            for _, related, properties in obj._pending_links:
+                if properties is not None and related.__node__.graph is None:
+                    self.save(related)
+        if not self.saves and not self.deletes:
+            return
+
+        saves = list(self.saves.values())
+        new = [obj.__node__ for obj in saves if obj.__node__.graph is None]
+        new_ids = {id(node) for node in new}
+        counts: Dict[int, Tuple[BaseModel, Dict[str, int]]] = {}
+        for obj in saves:
+            for target, key, delta in obj._pending_counts:
+                deltas = counts.setdefault(id(target), (target, {}))[1]
+                deltas[key] = deltas.get(key, 0) + delta
+        # Counters of new nodes are plain properties, set them from the current value
+        for target, deltas in counts.values():
+            if target.__node__.graph is None:
+                for key, delta in deltas.items():
+                    target.__node__[key] = (target.__node__.get(key) or 0) + delta
+
+        # Only the last change of a relationship counts, e.g. add and then remove
+        links: Dict[Tuple[str, int, int, int], RelationshipChange] = {}
+        for obj in saves:
+            for related, other, properties in obj._pending_links:
+                direction = _direction(related)
+                link = (
+                    related.relationship_type,
+                    direction,
+                    id(related.node),
+                    id(other),
+                )
+                links[link] = RelationshipChange(
+                    related.relationship_type,
+                    direction,
+                    related.node,
+                    other.__node__,
+                    properties,
+                )
+        changes = Changes(
+            create=new,
+            update=[
+                (obj.__node__, tuple(obj.__counters__))
+                for obj in saves
+                if id(obj.__node__) not in new_ids
+            ],
+            counts=[
+                (
+                    target.__node__,
+                    {key: deltas.get(key, 0) for key in target.__counters__},
+                )
+                for target, deltas in counts.values()
+                if target.__node__.graph is not None
+            ],
+            relationships=list(links.values()),
+            delete=[obj.__node__ for obj in self.deletes.values()],
+            counters={
+                model.__primarylabel__: model.__counters__
+                for model in _subclasses(BaseModel)
+            },
+            unique={
+                model.__primarylabel__: model.__unique__
+                for model in _subclasses(BaseModel)
+            },
+        )
+        get_backend().commit(changes)
+        _mark_write()
+
+        loaded = _identity_map.get()
+        for obj in saves:
+            obj._pending_counts.clear()
+            obj._pending_links.clear()
+            obj._register()
+        for obj in self.deletes.values():
+            obj._pending_counts.clear()
+            obj._pending_links.clear()
+            for related in obj.__ogm__.all_related():
+                _set_loaded(related, [])
+            if loaded is not None:
+                loaded.pop((obj.__primarylabel__, obj._uuid), None)
+        self.saves.clear()
+        self.deletes.clear()
+
+
+def _direction(related: RelatedObjects) -> int:
+    # NOTE: py2neo only keeps the direction in the private relationship pattern
+    pattern = related._RelatedObjects__relationship_pattern  # type: ignore
+    return 1 if "->" in pattern else -1 if "<-" in pattern else 0
+
+
+def _pattern(relationship_type: str, direction: int) -> str:
+    if direction > 0:
+        return f"(a)-[_:{relationship_type}]->(b)"
+    if direction < 0:
+        return f"(a)<-[_:{relationship_type}]-(b)"
+    return f"(a)-[_:{relationship_type}]-(b)"
+
+
+def _links_query(pattern: str, unlink: bool) -> str:
+    """Returns the query that creates (or updates) or deletes a batch of single
+    relationships. Unlike pushing the Model, this leaves the rest of the set alone.
+    """
+    if unlink:
+        return (
+            f"UNWIND $rows AS row MATCH {pattern}"
+            " WHERE id(a) = row.a AND id(b) = row.b DELETE _"
+        )
+    return (
+        "UNWIND $rows AS row MATCH (a) WHERE id(a) = row.a"
+        " MATCH (b) WHERE id(b) = row.b"
+        f" MERGE {pattern} SET _ = row.properties"
+    )
+
+
+def _create_query(labels: FrozenSet[str]) -> str:
+    """Returns the query that creates a batch of nodes, like Transaction.create."""
+    names = "".join(f":`{label}`" for label in sorted(labels))
+    return f"UNWIND $rows AS row CREATE (_{names}) SET _ = row RETURN id(_)"
+
+
+def _update_auto(work: Callable[[Transaction], None]) -> None:
+    """Runs a unit of work of a single statement in an auto-commit transaction. The
+    statement may not be idempotent (e.g. a CREATE or counter deltas), so unlike
+    Graph.update it is only retried on the errors that leave it uncommitted: no
+    connection could be acquired, or the server rolled it back with a transient
+    error. A connection that breaks while it runs is not retried, the statement may
+    have been committed before.
+
+    Args:
+        work (Callable[[Transaction], None]): The unit of work
+
+    Raises:
+        ConnectionBroken: The connection broke while the statement ran
+        WriteServiceUnavailable: It still failed after NEO4J_MAX_RETRY_TIME seconds
+    """
+    graph = get_graph()
+    for _ in Timer.repeat(at_least=3, timeout=settings.NEO4J_MAX_RETRY_TIME):
+        try:
+            work(graph.auto())
+        except (ConnectionUnavailable, ConnectionLimit):
+            continue
+        except Neo4jError as error:
+            if error.should_retry():
+                continue
+            raise
+        return
+    raise WriteServiceUnavailable("Failed to execute the update.")
+
+
+# e.g. Node(42) already exists with label `User` and property `email` = 'a@b.c'
+_CONSTRAINT_ERROR = re.compile(r"label `(\w+)` and property `(\w+)`")
+
+
+def _push_query(keep: Tuple[str, ...]) -> str:
+    query = "UNWIND $rows AS row MATCH (n) WHERE id(n) = row.id"
+    if not keep:
+        return f"{query} SET n = row.properties"
+    # Keep the stored counters, the ones in memory may be outdated
+    values = ", ".join(f".{key}" for key in keep)
+    return (
+        f"{query} WITH n, row, n {{ {values} }} AS counts"
+        " SET n = row.properties SET n += counts"
+    )
+
+
+def _counters_query(keys: Tuple[str, ...]) -> str:
+    updates = ", ".join(
+        f"n.{key} = coalesce(n.{key}, 0) + row.deltas.{key}" for key in keys
+    )
+    values = ", ".join(f".{key}" for key in keys)
+    return (
+        "UNWIND $rows AS row MATCH (n) WHERE id(n) = row.id"
+        f" SET {updates} RETURN row.id AS id, n {{ {values} }} AS counts"
+    )
+
+
+def _recount(
+    tx: Transaction, label: str, counters: Dict[str, Counter], ids: List[int]
+) -> None:
+    """Recomputes the counter properties of the given nodes from the relationships.
+
+    Args:
+        tx (Transaction): The transaction to recount in
+        label (str): Label of the nodes
+        counters (Dict[str, Counter]): The counter properties of the label
+        ids (List[int]): The Neo4j internal ids of the nodes
+    """
+    if not counters:
+        return
+    updates = ", ".join(f"n.{key} = {c.cypher}" for key, c in counters.items())
+    tx.run(f"MATCH (n:{label}) WHERE id(n) IN $ids SET {updates}", ids=ids)
+
+
+class Neo4jBackend(Backend):
+    """Stores the graph in Neo4j, through the shared Graphs of get_graph."""
+
+    def warm_up(self) -> None:
+        get_graph().run("RETURN 1").evaluate()
+
+    def find(
+        self,
+        label: str,
+        properties: Dict[str, Any],
+        skip: int,
+        limit: int,
+        after: Optional[Cursor],
+    ) -> List[Node]:
+        conditions = [f"_.{key} = $properties.{key}" for key in properties]
+        if after:
+            conditions.append(AFTER_CURSOR)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = (
+            f"MATCH (_:{label}){where}"
+            " RETURN _ ORDER BY _.created_at, _.uuid SKIP $skip LIMIT $limit"
+        )
+        parameters = {
+            "properties": properties,
+            "skip": skip,
+            "limit": limit,
+            **cursor_parameters(after),
+        }
+        records = get_graph(readonly=True).run(query, parameters)
+        return [record["_"] for record in records]
+
+    def get_many(self, label: str, uuids: Sequence[str]) -> List[Node]:
+        query = f"MATCH (_:{label}) WHERE _.uuid IN $uuids RETURN _"
+        records = get_graph(readonly=True).run(query, uuids=list(set(uuids)))
+        return [record["_"] for record in records]
+
+    def related(
+        self, label: str, uuids: Sequence[str], relationship_type: str, direction: int
+    ) -> List[Tuple[str, Dict[str, Any], Node]]:
+        query = (
+            f"UNWIND $uuids AS uuid MATCH (a:{label} {{ uuid: uuid }})"
+            f"\nMATCH {_pattern(relationship_type, direction)}"
+            "\nRETURN a.uuid AS uuid, properties(_) AS properties, b"
+        )
+        records = get_graph(readonly=True).run(query, uuids=list(uuids))
+        return [(r["uuid"], dict(r["properties"]), r["b"]) for r in records]
+
+    def commit(self, changes: Changes) -> None:
+        """Writes the changes in one explicit transaction, retried on transient
+        errors for at most NEO4J_MAX_RETRY_TIME seconds."""
+        pushes: Dict[Tuple[str, ...], List[Node]] = {}
+        for node, keep in changes.update:
+            pushes.setdefault(keep, []).append(node)
+        counts: Dict[Tuple[str, ...], List[Tuple[Node, Dict[str, int]]]] = {}
+        for node, deltas in changes.counts:
+            counts.setdefault(tuple(deltas), []).append((node, deltas))
+        batches: Dict[Tuple[str, bool], List[RelationshipChange]] = {}
+        for change in changes.relationships:
+            pattern = _pattern(change.relationship_type, change.direction)
+            batches.setdefault((pattern, change.properties is None), []).append(change)
+
+        creates: Dict[FrozenSet[str], List[Node]] = {}
+        for node in changes.create:
+            creates.setdefault(frozenset(node.labels), []).append(node)
+
+        def work(tx: Transaction) -> None:
+            for node in changes.create:  # Unbind the nodes of a failed earlier attempt
+                node.graph, node.identity = None, None
+            for labels, nodes in creates.items():
+                rows = [dict(node) for node in nodes]
+                for node, record in zip(
+                    nodes, tx.run(_create_query(labels), rows=rows)
+                ):
+                    node.graph, node.identity = tx.graph, record[0]
+                    node._remote_labels = labels
+            for keep, nodes in pushes.items():
+                rows = [{"id": n.identity, "properties": dict(n)} for n in nodes]
+                tx.run(_push_query(keep), rows=rows)
+            for keys, node_deltas in counts.items():
+                by_id = {node.identity: node for node, _ in node_deltas}
+                rows = [{"id": n.identity, "deltas": d} for n, d in node_deltas]
+                for record in tx.run(_counters_query(keys), rows=rows):
+                    by_id[record["id"]].update(record["counts"])
+            for (pattern, unlink), links in batches.items():
+                rows = [
+                    {
+                        "a": c.start.identity,
+                        "b": c.end.identity,
+                        "properties": c.properties,
+                    }
+                    for c in links
+                ]
+                tx.run(_links_query(pattern, unlink), rows=rows)
+            for node in changes.delete:
+                self._delete(tx, node, changes.counters)
+
+        statements = len(creates) + len(pushes) + len(counts) + len(batches)
+        try:
+            if statements == 1 and not changes.delete:
+                # e.g. a new user, or the changed properties of one: one round trip
+                # instead of three (BEGIN, RUN and PULL, COMMIT)
+                _update_auto(work)
+            else:
+                get_graph().update(work, timeout=settings.NEO4J_MAX_RETRY_TIME)
+        except ClientError as error:
+            for node in changes.create:
+                node.graph, node.identity = None, None
+            if error.code != "Neo.ClientError.Schema.ConstraintValidationFailed":
+                raise
+            match = _CONSTRAINT_ERROR.search(error.message or "")
+            label, key = match.groups() if match else ("node", "value")
+            raise UniquenessError(label, key) from error
+
+    @staticmethod
+    def _delete(
+        tx: Transaction, node: Node, counters: Dict[str, Dict[str, Counter]]
+    ) -> None:
+        """Deletes a node and recounts the counters of its former neighbours."""
+        query = (
+            "MATCH (n)--(m) WHERE id(n) = $id"
+            " RETURN labels(m)[0] AS label, collect(DISTINCT id(m)) AS ids"
+        )
+        neighbours = tx.run(query, id=node.identity).data()
+        tx.delete(node)
+        for record in neighbours:
+            if record["label"] in counters:
+                _recount(tx, record["label"], counters[record["label"]], record["ids"])
+
+    def recount_all(
+        self, label: str, counters: Dict[str, Counter], batch_size: int
+    ) -> Iterator[int]:
+        query = (
+            f"MATCH (n:{label}) WHERE id(n) > $last"
+            " RETURN id(n) AS id ORDER BY id LIMIT $limit"
+        )
+        last, done = -1, 0
+        while counters:
+            ids = [
+                record["id"]
+                for record in get_graph().run(query, last=last, limit=batch_size)
+            ]
+            if not ids:
+                break
+            get_graph().update(lambda tx: _recount(tx, label, counters, ids))
+            last, done = ids[-1], done + len(ids)
+            yield done
+
+
+@asynccontextmanager
+async def atomic() -> AsyncIterator[UnitOfWork]:
+    """Opens a unit of work for an async route. The objects saved or deleted inside
+    the block are committed together, in one transaction, when the block exits. Nothing
+    is written if the block raises.
+
+    Yields:
+        AsyncIterator[UnitOfWork]: The unit of work
+    """
+    unit = UnitOfWork()
+    token = _unit_of_work.set(unit)
+    try:
+        yield unit
+    finally:
+        _unit_of_work.reset(token)
+    await run_async(unit.commit)
+
+
 class BaseModel(Model):
     """A Neo4j OGM Base Model. This class extends the base model with some useful
     methods. Additionaly contains automatic created and updated timestamp on save.
     """
 
     __primarykey__ = "uuid"
+    # Schema fields backed by a relationship, loaded in batches. See prefetch above.
+    __prefetch__: Dict[str, str] = {}
+    # Denormalized counter properties and the relationships they count
+    __counters__: Dict[str, Counter] = {}
+    # Properties with a uniqueness constraint, see UniquenessError
+    __unique__: Tuple[str, ...] = ("uuid",)
 
     _uuid = Property(key="uuid")
     _created_at = Property(key="created_at")
@@ -46,25 +982,128 @@ class BaseModel(Model):
         self.update(**kwargs)
 
     @classmethod
-    def get_by_uuid(cls, uuid: str) -> BaseModel:
+    def get_by_uuid(cls, uuid: str) -> Optional[BaseModel]:
         """Returns a node that matches the UUID4 hex string.
 
         Args:
             uuid (str): An UUID4 hex string
 
         Returns:
-            BaseModel: Node with matching uuid
+            Optional[BaseModel]: Node with matching uuid
         """
-        return cls.match(repository).where(uuid=uuid).first()
+        loaded = _identity_map.get()
+        if loaded is not None and (cls.__primarylabel__, uuid) in loaded:
+            return loaded[(cls.__primarylabel__, uuid)]
+        with QUERY_SECONDS.labels(f"{cls.__primarylabel__}.get_by_uuid").time():
+            return cls.get_many([uuid]).get(uuid)
 
     @classmethod
-    def get_all(cls, skip: int = 0, limit: int = 100) -> List[BaseModel]:
+    def get_all(
+        cls, skip: int = 0, limit: int = 100, after: Optional[Cursor] = None
+    ) -> List[BaseModel]:
         """Returns all nodes of this Model from the database
 
         Returns:
             Optional[List[Model]]: List of Nodes with this Model type
         """
-        return [model for model in cls.match(repository).skip(skip).limit(limit).all()]
+        return cls.find(skip=skip, limit=limit, after=after)
+
+    @classmethod
+    def find(
+        cls,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
+        **properties: Any,
+    ) -> List[BaseModel]:
+        """Returns the nodes of this Model with matching properties, ordered by
+        (created_at, uuid). Pages can be selected with skip or, preferably, with a
+        cursor; the latter stays fast and stable for deep pages.
+
+        Args:
+            skip (int): Number of nodes to skip. Defaults to 0.
+            limit (int): Maximum number of nodes to return. Defaults to 100.
+            after (Optional[Cursor]): Only return the nodes after this cursor
+            properties (dict): Property values the nodes must have
+
+        Returns:
+            List[BaseModel]: List of matching Nodes
+        """
+        nodes = get_backend().find(cls.__primarylabel__, properties, skip, limit, after)
+        return [cls.wrap(node) for node in nodes]
+
+    @classmethod
+    def wrap(cls, node: Node) -> BaseModel:
+        """Converts a py2neo Node into a Neo4j Model Object. Used by py2neo for both
+        matching and relationship traversal. Inside an identity map scope, returns
+        the already loaded Object if there is one.
+
+        Args:
+            node (Node): The py2neo Node
+
+        Returns:
+            BaseModel: Neo4j Model Object wrapping the Node
+        """
+        return super().wrap(node)._register()
+
+    @classmethod
+    async def aget_by_uuid(cls, uuid: str) -> Optional[BaseModel]:
+        """Asynchronous version of get_by_uuid, runs on the database executor.
+
+        Args:
+            uuid (str): An UUID4 hex string
+
+        Returns:
+            Optional[BaseModel]: Node with matching uuid
+        """
+        return await run_async(cls.get_by_uuid, uuid)
+
+    @classmethod
+    async def aget_all(
+        cls, skip: int = 0, limit: int = 100, after: Optional[Cursor] = None
+    ) -> List[BaseModel]:
+        """Asynchronous version of get_all, runs on the database executor.
+
+        Returns:
+            Optional[List[Model]]: List of Nodes with this Model type
+        """
+        return await run_async(cls.get_all, skip, limit, after)
+
+    @classmethod
+    def get_many(cls, uuids: Sequence[str]) -> Dict[str, BaseModel]:
+        """Returns the nodes that match the UUID4 hex strings, in a single query.
+
+        Args:
+            uuids (Sequence[str]): The UUID4 hex strings
+
+        Returns:
+            Dict[str, BaseModel]: Nodes by uuid, missing uuids are left out
+        """
+        nodes = get_backend().get_many(cls.__primarylabel__, uuids)
+        return {node["uuid"]: cls.wrap(node) for node in nodes}
+
+    @classmethod
+    async def aget_many(cls, uuids: Sequence[str]) -> Dict[str, BaseModel]:
+        """Asynchronous version of get_many, runs on the database executor.
+
+        Args:
+            uuids (Sequence[str]): The UUID4 hex strings
+
+        Returns:
+            Dict[str, BaseModel]: Nodes by uuid, missing uuids are left out
+        """
+        return await run_async(cls.get_many, uuids)
+
+    def _register(self) -> BaseModel:
+        """Adds this object to the identity map of the current scope.
+
+        Returns:
+            BaseModel: The object already in the identity map, otherwise this object
+        """
+        loaded = _identity_map.get()
+        if loaded is None or not self._uuid:
+            return self
+        return loaded.setdefault((self.__primarylabel__, self._uuid), self)
 
     @property
     def uuid(self) -> Optional[str]:
@@ -108,18 +1147,107 @@ class BaseModel(Model):
                 setattr(self, key, value)
 
     def save(self) -> None:
-        """Save the Neo4j Model Object"""
+        """Save the Neo4j Model Object. Inside a unit of work, the object is only
+        scheduled and written when the unit commits."""
+        unit = _unit_of_work.get()
+        if unit is not None:
+            unit.save(self)
+        else:
+            UnitOfWork().save(self).commit()
+
+    def _stamp(self) -> None:
         current_time = DateTime.utc_now()
         if not self._uuid:
             self._uuid = uuid4().hex
         if not self._created_at:
             self._created_at = current_time
         self._updated_at = current_time
-        repository.save(self)
+
+    @property
+    def _pending_counts(self) -> List[Tuple[BaseModel, str, int]]:
+        return self.__dict__.setdefault("_pending", [])
+
+    @property
+    def _pending_links(self) -> List[Link]:
+        return self.__dict__.setdefault("_links", [])
+
+    def _link(self, related: RelatedObjects, obj: BaseModel, **properties: Any) -> None:
+        """Adds an object to a relationship set of this object. Only this relationship
+        is written when this object is saved, not the whole set.
+
+        Args:
+            related (RelatedObjects): The relationship set, e.g. self._following
+            obj (BaseModel): The Object to relate to
+            properties (dict): Properties of the relationship
+        """
+        related.add(obj, **properties)
+        current = next(p for o, p in related._related_objects if o == obj)
+        self._pending_links.append((related, obj, dict(current)))
+
+    def _unlink(self, related: RelatedObjects, obj: BaseModel) -> None:
+        """Removes an object from a relationship set of this object, see _link.
+
+        Args:
+            related (RelatedObjects): The relationship set, e.g. self._following
+            obj (BaseModel): The related Object to remove
+        """
+        related.remove(obj)
+        self._pending_links.append((related, obj, None))
+
+    def _count(self, target: BaseModel, key: str, delta: int) -> None:
+        """Schedules an atomic change of a counter property; applied when this object
+        is saved. The target can be this object or a related one.
+
+        Args:
+            target (BaseModel): The Object that holds the counter
+            key (str): The counter property, must be in the target __counters__
+            delta (int): The value to add to the counter
+        """
+        self._pending_counts.append((target, key, delta))
+
+    @classmethod
+    def recount_all(cls, batch_size: int = 10000) -> Iterator[int]:
+        """Recomputes the counter properties of all the nodes, in batches.
+
+        Args:
+            batch_size (int): Number of nodes to recount per transaction
+
+        Yields:
+            Iterator[int]: The number of nodes recounted so far
+        """
+        if cls.__counters__:
+            yield from get_backend().recount_all(
+                cls.__primarylabel__, cls.__counters__, batch_size
+            )
 
     def delete(self) -> None:
-        """Delete the Neo4j Model Object"""
-        repository.delete(self)
+        """Delete the Neo4j Model Object. Inside a unit of work, the object is only
+        scheduled and deleted when the unit commits."""
+        unit = _unit_of_work.get()
+        if unit is not None:
+            unit.delete(self)
+        else:
+            UnitOfWork().delete(self).commit()
+
+    async def asave(self) -> None:
+        """Asynchronous version of save, runs on the database executor."""
+        await run_async(self.save)
+
+    async def adelete(self) -> None:
+        """Asynchronous version of delete, runs on the database executor."""
+        await run_async(self.delete)
+
+    async def afetch(self, attribute: str) -> Any:
+        """Returns an attribute of this object, resolving it on the database executor.
+        Use this for properties backed by lazily loaded relationships.
+
+        Args:
+            attribute (str): Name of the attribute, e.g. "creator"
+
+        Returns:
+            Any: Value of the attribute
+        """
+        return await run_async(getattr, self, attribute)
 
     def to_json(self) -> str:
         """Returns a JSON representation of this object.
@@ -130,6 +1258,12 @@ class BaseModel(Model):
         return jsonpickle.encode(self, unpicklable=False)
 
 
+def _subclasses(cls: Type[BaseModel]) -> Iterator[Type[BaseModel]]:
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
 class BaseSchema(Schema):
     """A Pydantic schema model that matches the py2Neo OGM BaseModel described above.
     By default orm_mode is set to True."""
@@ -140,3 +1274,12 @@ class BaseSchema(Schema):
 
     class Config:
         orm_mode = True
+
+
+class BatchResultSchema(Schema):
+    """The outcome of a single item of a batch request."""
+
+    index: int
+    status: int = Field(example=200)
+    uuid: Optional[str] = Field(example="12345678-1234-1234-1234-123456789abc")
+    detail: Optional[Any]
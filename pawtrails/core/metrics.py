@@ -0,0 +1,94 @@
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# With gunicorn every worker writes its metrics to files in PROMETHEUS_MULTIPROC_DIR
+# (see gunicorn.conf.py) and /metrics adds them up, whichever worker answers. The
+# gauges are summed over the live workers.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get(
+    "prometheus_multiproc_dir"
+)
+
+REQUEST_SECONDS = Histogram(
+    "pawtrails_http_request_duration_seconds",
+    "Duration of the HTTP requests",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "pawtrails_http_requests_in_progress",
+    "HTTP requests being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "pawtrails_password_hash_duration_seconds",
+    "Duration of the password hashing, by operation (hash or verify)",
+    ["operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0),
+)
+PASSWORD_HASH_PENDING = Gauge(
+    "pawtrails_password_hash_pending",
+    "Password hashing calls running or waiting for a thread",
+    multiprocess_mode="livesum",
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "pawtrails_password_hash_rejected",
+    "Password hashing calls rejected because the queue was full",
+)
+LOGIN_THROTTLED = Counter(
+    "pawtrails_login_throttled",
+    "Login attempts rejected by the rate limit, by limit (ip or account)",
+    ["limit"],
+)
+QUERY_SECONDS = Histogram(
+    "pawtrails_database_query_duration_seconds",
+    "Duration of the named database queries, e.g. Location.search",
+    ["query"],
+)
+POOL_SIZE = Gauge(
+    "pawtrails_database_pool_size",
+    "Database connections the workers may open",
+    multiprocess_mode="livesum",
+)
+POOL_IN_USE = Gauge(
+    "pawtrails_database_pool_in_use",
+    "Database connections in use",
+    multiprocess_mode="livesum",
+)
+POOL_WAITING = Gauge(
+    "pawtrails_database_pool_waiting",
+    "Calls waiting for a free database connection",
+    multiprocess_mode="livesum",
+)
+POOL_WAIT_SECONDS = Histogram(
+    "pawtrails_database_pool_wait_seconds",
+    "Time spent waiting for a free database connection",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_TIMEOUTS = Counter(
+    "pawtrails_database_pool_timeouts",
+    "Calls that gave up waiting for a free database connection",
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Renders the metrics of the application in the Prometheus text format.
+
+    Returns:
+        Tuple[bytes, str]: The metrics and their content type
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
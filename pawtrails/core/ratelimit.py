@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from pawtrails.core.database import get_graph, run_async
+from pawtrails.core.metrics import LOGIN_THROTTLED
+from pawtrails.core.settings import settings
+
+# Full buckets are dropped, at most this often (seconds)
+PRUNE_INTERVAL = 60.0
+# Fraction of the takes that also delete the full buckets from Neo4j
+NEO4J_PRUNE_RATE = 0.001
+
+
+class RateLimitStore:
+    """Where the token buckets of the rate limits are kept. A bucket holds up to
+    burst tokens and regains rate tokens per second; every request takes one. The
+    memory store is private to the worker process, the other stores share the
+    buckets between the workers. Other stores (e.g. Redis) implement take and are
+    installed with set_store.
+    """
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Takes a token from the bucket of a key.
+
+        Args:
+            key (str): The bucket, e.g. "ip:10.0.0.1"
+            rate (float): Tokens regained per second
+            burst (int): Size of the bucket
+
+        Returns:
+            float: 0 if a token was taken, else the seconds until one is available
+        """
+        raise NotImplementedError
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """The buckets of the current worker process, in a dict."""
+
+    def __init__(self) -> None:
+        # key -> (tokens, updated, full_at)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned > PRUNE_INTERVAL:
+                self._prune(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return 0.0 if taken else _wait(tokens, rate)
+
+    def _prune(self, now: float) -> None:
+        # A full bucket is the same as a missing one
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+        self._pruned = now
+
+
+def _wait(tokens: float, rate: float) -> float:
+    return max(0.0, (1 - tokens) / rate)
+
+
+class Neo4jRateLimitStore(RateLimitStore):
+    """The buckets as RateLimit nodes, shared by every worker and host. A take is
+    one write statement, much cheaper than the bcrypt check it guards.
+    """
+
+    # Setting the lock property takes the write lock of the bucket, so the
+    # concurrent takes of a key wait for each other instead of reading stale tokens
+    QUERY = """
+        MERGE (b:RateLimit { key: $key })
+        ON CREATE SET b.tokens = toFloat($burst), b.updated = $now
+        SET b.locked = true
+        WITH b, b.tokens + ($now - b.updated) * $rate AS tokens
+        WITH b, CASE WHEN tokens > $burst THEN toFloat($burst) ELSE tokens END AS tokens
+        SET b.tokens = CASE WHEN tokens >= 1 THEN tokens - 1 ELSE tokens END,
+            b.updated = $now
+        SET b.full_at = $now + ($burst - b.tokens) / $rate
+        REMOVE b.locked
+        RETURN tokens
+    """
+    PRUNE_QUERY = """
+        MATCH (b:RateLimit) WHERE b.full_at < $now
+        WITH b LIMIT 10000
+        DELETE b
+    """
+
+    def _take(self, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        if random.random() < NEO4J_PRUNE_RATE:
+            get_graph().run(self.PRUNE_QUERY, now=now)
+        parameters = {"key": key, "rate": rate, "burst": burst, "now": now}
+        tokens = get_graph().run(self.QUERY, parameters).evaluate()
+        return 0.0 if tokens >= 1 else _wait(tokens, rate)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        return await run_async(self._take, key, rate, burst)
+
+
+STORES = {"memory": MemoryRateLimitStore, "neo4j": Neo4jRateLimitStore}
+_store: Optional[RateLimitStore] = None
+
+
+def get_store() -> RateLimitStore:
+    """Returns the store of the rate limits, chosen by RATE_LIMIT_STORE.
+
+    Returns:
+        RateLimitStore: The store of the current process
+    """
+    global _store
+    if _store is None:
+        _store = STORES[settings.RATE_LIMIT_STORE]()
+    return _store
+
+
+def set_store(store: Optional[RateLimitStore]) -> None:
+    """Installs another store, e.g. a shared one. None goes back to RATE_LIMIT_STORE.
+
+    Args:
+        store (Optional[RateLimitStore]): The store
+    """
+    global _store
+    _store = store
+
+
+async def throttle_login(client: str, account: str) -> float:
+    """Takes a login attempt from the buckets of the client address and of the
+    account. The attempts rejected by the address limit do not count for the account.
+
+    Args:
+        client (str): The IP address of the client
+        account (str): The email the client logs in with
+
+    Returns:
+        float: 0 if the attempt is allowed, else the seconds until it would be
+    """
+    store = get_store()
+    wait = await store.take(
+        f"ip:{client}", settings.LOGIN_IP_PER_MINUTE / 60, settings.LOGIN_IP_BURST
+    )
+    if wait:
+        LOGIN_THROTTLED.labels("ip").inc()
+        return wait
+    wait = await store.take(
+        f"account:{account.strip().lower()}",
+        settings.LOGIN_ACCOUNT_PER_MINUTE / 60,
+        settings.LOGIN_ACCOUNT_BURST,
+    )
+    if wait:
+        LOGIN_THROTTLED.labels("account").inc()
+    return wait
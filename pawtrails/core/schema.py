@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+from typing import List, NamedTuple, Set, Tuple
+
+from pawtrails.core.database import get_graph
+
+logger = logging.getLogger(__name__)
+
+LABELS = ["User", "Pet", "Location", "Review", "Tag"]
+
+
+class SchemaItem(NamedTuple):
+    """An index or an uniqueness constraint on a single Node property."""
+
+    label: str
+    key: str
+    unique: bool = False
+
+    @property
+    def name(self) -> str:
+        suffix = "unique" if self.unique else "index"
+        return f"{self.label.lower()}_{self.key}_{suffix}"
+
+    @property
+    def query(self) -> str:
+        if self.unique:
+            return (
+                f"CREATE CONSTRAINT {self.name} ON (n:{self.label})"
+                f" ASSERT n.{self.key} IS UNIQUE"
+            )
+        return f"CREATE INDEX {self.name} FOR (n:{self.label}) ON (n.{self.key})"
+
+
+# NOTE: Neo4j 4.x B-tree indexes also serve as spatial indexes for point properties
+SCHEMA: List[SchemaItem] = [
+    *[SchemaItem(label, "uuid", unique=True) for label in LABELS],
+    SchemaItem("User", "email", unique=True),
+    SchemaItem("User", "username", unique=True),
+    SchemaItem("Tag", "name", unique=True),
+    SchemaItem("RateLimit", "key", unique=True),  # Login throttling buckets
+    SchemaItem("Location", "location"),
+    *[SchemaItem(label, "created_at") for label in LABELS],
+]
+
+
+def get_existing_schema() -> Set[Tuple[str, str, bool]]:
+    """Returns the single property indexes that currently exist in the database.
+    Uniqueness constraints are included, since they are backed by an index.
+
+    Returns:
+        Set[Tuple[str, str, bool]]: Set of (label, property, unique) tuples
+    """
+    existing: Set[Tuple[str, str, bool]] = set()
+    query = "CALL db.indexes() YIELD labelsOrTypes, properties, uniqueness"
+    for record in get_graph().run(query):
+        labels, properties = record["labelsOrTypes"], record["properties"]
+        if labels and properties and len(labels) == 1 and len(properties) == 1:
+            existing.add((labels[0], properties[0], record["uniqueness"] == "UNIQUE"))
+    return existing
+
+
+def get_missing_schema() -> List[SchemaItem]:
+    """Returns the indexes and constraints that are not yet present in the database.
+
+    Returns:
+        List[SchemaItem]: The missing schema items
+    """
+    existing = get_existing_schema()
+    return [
+        item for item in SCHEMA if (item.label, item.key, item.unique) not in existing
+    ]
+
+
+def apply_schema() -> List[SchemaItem]:
+    """Creates all the missing indexes and constraints. Safe to run multiple times.
+
+    Returns:
+        List[SchemaItem]: The schema items that were created
+    """
+    missing = get_missing_schema()
+    for item in missing:
+        get_graph().run(item.query)
+    return missing
+
+
+def check_schema() -> bool:
+    """Logs a warning for every missing index or constraint.
+
+    Returns:
+        bool: True if the database schema is up to date
+    """
+    missing = get_missing_schema()
+    for item in missing:
+        logger.warning(f"Database schema is missing {item.name}: {item.query}")
+    if missing:
+        logger.warning("Run db_migrate to create the missing indexes/constraints.")
+    return not missing
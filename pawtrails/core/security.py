@@ -1,12 +1,29 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Optional, Union
+from typing import Any, Callable, Dict, Optional, TypeVar, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel as Schema
 
+from pawtrails.core.metrics import (
+    PASSWORD_HASH_PENDING,
+    PASSWORD_HASH_REJECTED,
+    PASSWORD_HASH_SECONDS,
+)
 from pawtrails.core.settings import settings
 
+T = TypeVar("T")
+
+
+class PasswordHashBusyError(Exception):
+    """Raised when too many password hashing calls are already waiting."""
+
 
 class Token(Schema):
     access_token: str
@@ -15,19 +32,93 @@ class Token(Schema):
 
 class TokenData(Schema):
     uuid: str = ""
+    # Signed claims of the user at login, None in the tokens issued before them
+    username: Optional[str] = None
+    is_active: Optional[bool] = None
+    issued_at: float = 0.0
+
+
+class RevokedTokens:
+    """The users whose tokens, issued up to a point in time, must not be accepted
+    anymore, e.g. because they changed their password. The claims of a token are not
+    checked against the database, so this is how they are invalidated before they
+    expire. Every worker process has its own set, so it only covers the changes
+    made through that worker.
+    """
+
+    def __init__(self) -> None:
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, uuid: str) -> None:
+        """Revokes the tokens of a user that were issued until now.
+
+        Args:
+            uuid (str): uuid of the user
+        """
+        now = time.time()
+        with self._lock:
+            self._revoked[uuid] = now
+            # The tokens issued before the expiry time are rejected anyway
+            expired = now - settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            for key in [key for key, at in self._revoked.items() if at < expired]:
+                del self._revoked[key]
+
+    def is_revoked(self, uuid: str, issued_at: float) -> bool:
+        """Checks if a token was revoked.
+
+        Args:
+            uuid (str): uuid of the user of the token
+            issued_at (float): The iat claim of the token
+
+        Returns:
+            bool: True if the token must be rejected
+        """
+        revoked_at = self._revoked.get(uuid)
+        return revoked_at is not None and issued_at <= revoked_at
+
+
+revoked_tokens = RevokedTokens()
+
+
+# The schemes the stored hashes may use, all can be verified
+SCHEMES = ["bcrypt", "pbkdf2_sha256"]
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def create_password_context(scheme: str, rounds: Optional[int] = None) -> CryptContext:
+    """Creates the passlib context that hashes with a scheme and cost. The hashes of
+    the other schemes, or with another cost, still verify but need an update.
+
+    Args:
+        scheme (str): The scheme of the new hashes, e.g. bcrypt
+        rounds (Optional[int]): The cost, e.g. log2 rounds for bcrypt and
+            iterations for PBKDF2. Defaults to the passlib default.
+
+    Returns:
+        CryptContext: The context
+    """
+    options = {f"{scheme}__rounds": rounds} if rounds else {}
+    schemes = [scheme] + [other for other in SCHEMES if other != scheme]
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
+pwd_context = create_password_context(
+    settings.PASSWORD_HASH_SCHEME, settings.PASSWORD_HASH_ROUNDS
+)
 
 
 def create_access_token(
-    subject: Union[str, Any], expires_delta: Optional[timedelta] = None
+    subject: Union[str, Any],
+    expires_delta: Optional[timedelta] = None,
+    claims: Optional[Dict[str, Any]] = None,
 ) -> str:
     """Creates a JWT access token for the logged in user
 
     Args:
         subject (Union[str, Any]): Data which you wish to encode
         expires_delta (Optional[timedelta]): How long it will last. Defaults to None.
+        claims (Optional[Dict[str, Any]]): Signed claims about the subject, e.g. its
+            username and is_active. Defaults to None.
 
     Returns:
         str: A JWT encoded access token
@@ -38,7 +129,14 @@ def create_access_token(
         expire = datetime.utcnow() + timedelta(
             minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
         )
-    to_encode = {"exp": expire, "sub": str(subject)}
+    # iat has a sub-second precision, so that a token issued right after a
+    # revocation is not revoked with the older ones
+    to_encode = {
+        **(claims or {}),
+        "exp": expire,
+        "iat": time.time(),
+        "sub": str(subject),
+    }
     encoded_jwt = jwt.encode(
         to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM
     )
@@ -55,7 +153,8 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True if the password matches the hash
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    with PASSWORD_HASH_SECONDS.labels("verify").time():
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
@@ -67,4 +166,106 @@ def get_password_hash(password: str) -> str:
     Returns:
         str: HMAC-SHA256 hash of the given RAW password
     """
-    return pwd_context.hash(password)
+    with PASSWORD_HASH_SECONDS.labels("hash").time():
+        return pwd_context.hash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Checks if a hash uses another scheme or cost than the configured ones.
+
+    Args:
+        hashed_password (str): The stored hash
+
+    Returns:
+        bool: True if the password should be hashed again
+    """
+    return pwd_context.needs_update(hashed_password)
+
+
+class _HashPool:
+    """The threads that hash and verify passwords. bcrypt takes 100-300 ms and
+    releases the GIL, so it runs here instead of on the event loop or the database
+    threads. Created on first use, so that every (forked) worker has its own.
+    """
+
+    executor: Optional[ThreadPoolExecutor] = None
+    pid = 0
+    pending = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> ThreadPoolExecutor:
+        with cls.lock:
+            if cls.executor is None or cls.pid != os.getpid():
+                cls.executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    thread_name_prefix="password",
+                )
+                cls.pid = os.getpid()
+                cls.pending = 0
+            return cls.executor
+
+
+async def _run_hashing(func: Callable[..., T], *args: Any) -> T:
+    """Runs a hashing call on the password threads and awaits the result. At most
+    PASSWORD_HASH_QUEUE calls wait for a thread, the calls over it are rejected, so a
+    burst of logins is answered quickly instead of waiting behind each other.
+
+    Args:
+        func (Callable[..., T]): The blocking hashing function
+        args (list): Positional arguments for the function
+
+    Raises:
+        PasswordHashBusyError: The queue is full
+
+    Returns:
+        T: The result of the function call
+    """
+    executor = _HashPool.get()
+    with _HashPool.lock:
+        limit = settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE
+        if _HashPool.pending >= limit:
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHashBusyError(
+                "Too many password checks in progress, try again later."
+            )
+        _HashPool.pending += 1
+    PASSWORD_HASH_PENDING.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args))
+    finally:
+        with _HashPool.lock:
+            _HashPool.pending -= 1
+        PASSWORD_HASH_PENDING.dec()
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the password threads, see _run_hashing.
+
+    Args:
+        plain_password (str): RAW password
+        hashed_password (str): HMAC-SHA256 hash
+
+    Raises:
+        PasswordHashBusyError: Too many password checks are waiting
+
+    Returns:
+        bool: True if the password matches the hash
+    """
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password: str) -> str:
+    """get_password_hash on the password threads, see _run_hashing.
+
+    Args:
+        password (str): The original RAW password
+
+    Raises:
+        PasswordHashBusyError: Too many password checks are waiting
+
+    Returns:
+        str: HMAC-SHA256 hash of the given RAW password
+    """
+    return await _run_hashing(get_password_hash, password)
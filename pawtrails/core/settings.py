@@ -1,5 +1,5 @@
 import secrets
-from typing import List, Union
+from typing import List, Literal, Optional, Union
 
 from dotenv import load_dotenv
 from pydantic import AnyHttpUrl, BaseSettings, validator
@@ -11,17 +11,50 @@ class Settings(BaseSettings):
     APP_DESCRIPTION: str = "A Web API for the PawTrails Application"
     APP_VERSION: str = "1.0.0"
     API_PREFIX: str = "/api/v0"  # This is the API prefix for version 0
+    BATCH_MAX_SIZE: int = 100  # Max number of items in a single batch request
 
     # JWT STUFF
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 1  # This means 1 day
     JWT_SECRET_KEY: str = secrets.token_urlsafe(32)
 
+    # Password hashing, off the event loop. Pick the cost with calibrate_hash; the
+    # hashes of another scheme or cost are replaced when their users log in.
+    PASSWORD_HASH_SCHEME: Literal["bcrypt", "pbkdf2_sha256"] = "bcrypt"
+    PASSWORD_HASH_ROUNDS: Optional[int] = None  # None is the default, bcrypt 12
+    PASSWORD_HASH_WORKERS: int = 2  # Threads hashing and verifying passwords per worker
+    PASSWORD_HASH_QUEUE: int = 32  # Calls that may wait for a thread, then 503
+
+    # Login throttling, token buckets per client address and per account. The
+    # "memory" store is per worker, "neo4j" shares the buckets between the workers.
+    RATE_LIMIT_STORE: Literal["memory", "neo4j"] = "memory"
+    LOGIN_IP_PER_MINUTE: float = 30.0  # Login attempts an address regains per minute
+    LOGIN_IP_BURST: int = 20  # Attempts an address can make at once
+    LOGIN_ACCOUNT_PER_MINUTE: float = 5.0  # Same, per account (email)
+    LOGIN_ACCOUNT_BURST: int = 10
+
+    # Database: "neo4j", or "memory" for tests and benchmarks without a server
+    DATABASE_BACKEND: Literal["neo4j", "memory"] = "neo4j"
+
     # Neo4j
     NEO4J_HOST: str = "pawtrails_neo4j"
     NEO4J_USER: str = "neo4j"
     NEO4J_PASS: str = "test"
     NEO4J_GRAPH_NAME: str = "pawtrails"
+    NEO4J_POOL_SIZE: int = 16  # Max connections (and py2neo threads) per worker
+    NEO4J_POOL_INIT_SIZE: int = 4  # Connections opened when the worker starts
+    NEO4J_ACQUISITION_TIMEOUT: float = 30.0  # Seconds to wait for a free connection
+    NEO4J_MAX_CONNECTION_LIFETIME: int = 3600  # Seconds before a connection is closed
+    NEO4J_MAX_RETRY_TIME: float = 15.0  # Seconds a failed transaction is retried for
+    # NEO4J_READ_HOSTS is a comma separated (or JSON) list of read replica hosts
+    NEO4J_READ_HOSTS: List[str] = []
+    NEO4J_REPLICA_MAX_LAG: float = 5.0  # Seconds reads stay on primary after a write
+
+    # Diagnostics
+    QUERY_REPEAT_WARNING: int = 10  # Warn when a request runs a query more often
+    SLOW_QUERY_SECONDS: float = 0.5  # Log the Cypher statements that take longer
+    SLOW_QUERY_PROFILE_RATE: float = 0.1  # Fraction of slow reads re-run with PROFILE
+    SLOW_QUERY_PROFILE_FILE: str = "slow_queries.jsonl"  # Where their plans are saved
 
     # SERVER_NAME: str
     # SERVER_HOST: AnyHttpUrl
@@ -39,6 +72,14 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
 
+    @validator("NEO4J_READ_HOSTS", pre=True)
+    def assemble_read_hosts(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        elif isinstance(v, (list, str)):
+            return v
+        raise ValueError(v)
+
     class Config:
         case_sensitive = True
 
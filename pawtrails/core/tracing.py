@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from py2neo import Graph
+
+from pawtrails.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class QueryStats:
+    """The database work of a (request) scope: the statements sent, the network
+    round trips, the time spent in the database calls and how often each query shape
+    ran. A shape is the Cypher text, the parameters are sent separately.
+    """
+
+    def __init__(self, name: Optional[str] = None) -> None:
+        self.name = name
+        self.statements = 0
+        self.round_trips = 0
+        self.seconds = 0.0
+        self.shapes: Dict[str, int] = {}
+        self.lock = threading.Lock()  # The calls of a request may run in parallel
+
+    def record(self, shape: Optional[str], seconds: float, round_trips: int) -> None:
+        """Accounts a database call.
+
+        Args:
+            shape (Optional[str]): The query it sent, None if it sent no statement
+            seconds (float): The duration of the call
+            round_trips (int): The network round trips the call made
+        """
+        with self.lock:
+            self.seconds += seconds
+            self.round_trips += round_trips
+            if shape is not None:
+                self.statements += 1
+                self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, limit: int) -> Dict[str, int]:
+        """Returns the shapes that ran more than limit times, likely an N+1 pattern.
+
+        Args:
+            limit (int): The allowed number of runs of a shape
+
+        Returns:
+            Dict[str, int]: How often each of the shapes ran
+        """
+        return {shape: n for shape, n in self.shapes.items() if n > limit}
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """Formats the stats as the value of a Server-Timing header.
+
+        Args:
+            total (Optional[float]): Seconds the whole request took
+
+        Returns:
+            str: e.g. db;dur=3.2, db-statements;desc=4, db-round-trips;desc=4
+        """
+        metrics = [
+            f"db;dur={self.seconds * 1000:.3f}",
+            f"db-statements;desc={self.statements}",
+            f"db-round-trips;desc={self.round_trips}",
+        ]
+        if total is not None:
+            metrics.append(f"app;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+# The stats of the open scopes, innermost last. See query_stats.
+_scopes: contextvars.ContextVar[Tuple[QueryStats, ...]] = contextvars.ContextVar(
+    "query_stats", default=()
+)
+# Set while a traced call runs, so the calls it makes itself are not counted again
+_tracing = threading.local()
+
+
+@contextmanager
+def query_stats(name: Optional[str] = None) -> Iterator[QueryStats]:
+    """Opens a (request) scope whose database calls are accounted in the yielded
+    stats, including the calls of nested scopes. When the scope is named, a warning
+    is logged for every query that ran more than QUERY_REPEAT_WARNING times in it.
+
+    Args:
+        name (Optional[str]): Name of the scope for the warnings, e.g. the route
+
+    Yields:
+        Iterator[QueryStats]: The stats of the scope
+    """
+    stats = QueryStats(name)
+    token = _scopes.set(_scopes.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _scopes.reset(token)
+    if name is not None:
+        for shape, runs in stats.repeated(settings.QUERY_REPEAT_WARNING).items():
+            logger.warning(f"{name} ran the same query {runs} times (N+1?): {shape}")
+
+
+def trace(func: F, shape: Callable[..., Optional[str]], round_trips: int = 1) -> F:
+    """Wraps a database call, so that it is accounted in the open scopes.
+
+    Args:
+        func (F): The database call
+        shape (Callable[..., Optional[str]]): Returns the query shape from the
+            arguments of the call, or None if the call sends no statement
+        round_trips (int): The network round trips of a call. Defaults to 1.
+
+    Returns:
+        F: The wrapped call
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        scopes = _scopes.get()
+        if not scopes or getattr(_tracing, "active", False):
+            return func(*args, **kwargs)
+        _tracing.active = True
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _tracing.active = False
+            seconds = time.perf_counter() - start
+            query = shape(*args, **kwargs)
+            if query is not None:
+                query = " ".join(query.split())
+            for stats in scopes:
+                stats.record(query, seconds, round_trips)
+
+    return wrapper  # type: ignore
+
+
+def traced(
+    shape: Callable[..., Optional[str]], round_trips: int = 1
+) -> Callable[[F], F]:
+    """Decorator version of trace.
+
+    Args:
+        shape (Callable[..., Optional[str]]): Returns the query shape, see trace
+        round_trips (int): The network round trips of a call. Defaults to 1.
+
+    Returns:
+        Callable[[F], F]: The decorator
+    """
+    return functools.partial(trace, shape=shape, round_trips=round_trips)
+
+
+# PROFILE runs the query again, so Cypher that writes is not profiled
+_WRITE = re.compile(r"\b(CREATE|MERGE|SET|DELETE|REMOVE|FOREACH|CALL|LOAD)\b", re.I)
+_PROFILED = re.compile(r"\s*(PROFILE|EXPLAIN)\b", re.I)
+# Re-runs the slow queries with PROFILE, off the request threads
+_profiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile")
+_profile_lock = threading.Lock()
+# The statement queued by the last run of this thread, until pull sends it
+_statement = threading.local()
+# The profiles of the statements run in the current profiled scope
+_profiles: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = (
+    contextvars.ContextVar("profiles", default=None)
+)
+
+
+@contextmanager
+def profiled() -> Iterator[List[Dict[str, Any]]]:
+    """Opens a scope in which every Cypher statement is run with PROFILE. PROFILE runs
+    the statement for real, only use it for reads.
+
+    Yields:
+        Iterator[List[Dict[str, Any]]]: The query, db hits and rows of every statement
+    """
+    profiles: List[Dict[str, Any]] = []
+    token = _profiles.set(profiles)
+    try:
+        yield profiles
+    finally:
+        _profiles.reset(token)
+
+
+def _save_profile(query: str, result: Any) -> None:
+    """Saves the plan of a statement run in a profiled scope. Neo4j sends the plan
+    of a PROFILE in the summary that ends the result, so it is only complete after
+    the PULL of all the records.
+    """
+    profiles = _profiles.get()
+    if profiles is None:
+        return
+    plan = result.summary().get("profile")
+    if plan:
+        profiles.append(
+            {
+                "query": " ".join(query.split()),
+                "db_hits": db_hits(plan),
+                "rows": plan.get("rows", 0),
+            }
+        )
+
+
+def _redact(value: Any) -> Any:
+    """Hides the password (hash) parameters, they must not end up in the logs."""
+    if isinstance(value, dict):
+        return {
+            key: "***" if "password" in str(key).lower() else _redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    return value
+
+
+def db_hits(plan: Optional[Dict[str, Any]]) -> int:
+    """Returns the total database hits of a PROFILE plan.
+
+    Args:
+        plan (Optional[Dict[str, Any]]): The profile of a query, e.g. Cursor.plan()
+
+    Returns:
+        int: The database hits of the plan and all its children
+    """
+    if not plan:
+        return 0
+    hits = plan.get("dbHits", 0) or 0
+    return hits + sum(db_hits(child) for child in plan.get("children", []))
+
+
+def _profile(graph: Graph, slow: Dict[str, Any], parameters: Any) -> None:
+    try:
+        plan = graph.run(f"PROFILE {slow['query']}", parameters).plan()
+    except Exception:
+        logger.exception(f"Could not PROFILE the slow query: {slow['query']}")
+        return
+    slow.update(time=time.time(), db_hits=db_hits(plan), plan=plan)
+    with _profile_lock, open(settings.SLOW_QUERY_PROFILE_FILE, "a") as file:
+        file.write(json.dumps(slow, default=str) + "\n")
+
+
+def _slow_query(graph: Graph, query: str, parameters: Any, seconds: float) -> None:
+    if _PROFILED.match(query):
+        return  # The re-run of a slow query, see _profile
+    scopes = _scopes.get()
+    route = next((s.name for s in reversed(scopes) if s.name), None)
+    slow = {
+        "route": route,
+        "seconds": round(seconds, 6),
+        "query": " ".join(query.split()),
+        "parameters": _redact(parameters or {}),
+    }
+    logger.warning(
+        f"Slow query ({seconds * 1000:.0f} ms) in {route}: {slow['query']}"
+        f" with {json.dumps(slow['parameters'], default=str)[:1000]}"
+    )
+    if random.random() < settings.SLOW_QUERY_PROFILE_RATE and not _WRITE.search(query):
+        _profiler.submit(_profile, graph, slow, parameters)
+
+
+def trace_graph(graph: Graph) -> None:
+    """Accounts the Cypher statements and the Bolt round trips of a Graph in the open
+    scopes. Every Graph.run, transaction and OGM Repository call goes through the
+    Connector of the Graph, so that is where the calls are wrapped. RUN is only
+    queued, it is sent with the PULL that follows it. Statements that take longer
+    than SLOW_QUERY_SECONDS are logged, and a sample of them is re-run with PROFILE
+    and saved to SLOW_QUERY_PROFILE_FILE together with the plan. Inside profiled,
+    every statement is run with PROFILE.
+
+    Args:
+        graph (Graph): The Graph
+    """
+    connector = graph.service.connector
+
+    def run(func: F, position: int) -> F:
+        traced_func = trace(func, lambda *args, **kwargs: args[position], 0)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            query = args[position]
+            parameters = kwargs.get("parameters")
+            if len(args) > position + 1:
+                parameters = args[position + 1]
+            if _profiles.get() is not None and not _PROFILED.match(query):
+                args = args[:position] + (f"PROFILE {query}",) + args[position + 1 :]
+            _statement.queued = (query, parameters, time.perf_counter())
+            return traced_func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    def pull(func: F) -> F:
+        traced_func = trace(func, lambda *args, **kwargs: None)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return traced_func(*args, **kwargs)
+            finally:
+                queued = getattr(_statement, "queued", None)
+                _statement.queued = None
+                if queued is not None:
+                    query, parameters, start = queued
+                    seconds = time.perf_counter() - start
+                    if seconds >= settings.SLOW_QUERY_SECONDS:
+                        _slow_query(graph, query, parameters, seconds)
+                    _save_profile(query, args[0])
+
+        return wrapper  # type: ignore
+
+    connector.auto_run = run(connector.auto_run, 0)
+    connector.run = run(connector.run, 1)
+    connector.pull = pull(connector.pull)
+    for name in ["begin", "discard", "commit", "rollback"]:
+        setattr(connector, name, trace(getattr(connector, name), lambda *a, **k: None))
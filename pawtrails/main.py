@@ -1,9 +1,30 @@
+import time
+from typing import Any, Dict
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from pawtrails.api.deps import CONSISTENCY_HEADER
 from pawtrails.api.v0.api import api_router
+from pawtrails.core.database import (
+    DatabaseBusyError,
+    encode_consistency_token,
+    get_pool_stats,
+    identity_map,
+    read_routing,
+    run_async,
+    warm_up,
+)
+from pawtrails.core.metrics import REQUEST_SECONDS, REQUESTS_IN_PROGRESS, render_metrics
+from pawtrails.core.schema import check_schema
+from pawtrails.core.security import PasswordHashBusyError
 from pawtrails.core.settings import settings
+from pawtrails.core.tracing import query_stats
 
 app = FastAPI(
     title=settings.APP_TITLE,
@@ -25,11 +46,113 @@ if settings.BACKEND_CORS_ORIGINS:
 app.include_router(api_router, prefix=settings.API_PREFIX)
 
 
+def _route_template(scope: Scope) -> str:
+    """Returns the path template of the route, so the metrics have one label per
+    route (e.g. /api/v0/user/{uuid}) instead of one per path."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class RequestMiddleware:
+    """Sets up the database scopes of every request and accounts it: the identity
+    map, the read routing and its consistency token, the query stats in the
+    Server-Timing header and the request metrics. A single pure ASGI middleware,
+    since every @app.middleware adds a task and a hop of the response stream to
+    each request.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        start = time.perf_counter()
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        in_progress = REQUESTS_IN_PROGRESS.labels(request.method)
+        in_progress.inc()
+        readonly = request.method in ("GET", "HEAD")
+        token = request.headers.get(CONSISTENCY_HEADER)
+        scope_name = f"{request.method} {request.url.path}"
+        try:
+            with query_stats(scope_name) as stats, identity_map(), read_routing(
+                readonly, token
+            ) as routing:
+                last_write = routing.last_write
+
+                async def send_with_headers(message: Message) -> None:
+                    nonlocal status_code
+                    if message["type"] == "http.response.start":
+                        status_code = message["status"]
+                        headers = MutableHeaders(scope=message)
+                        # Hand the time of this write back, so the client's next
+                        # reads see it
+                        if routing.last_write > last_write:
+                            headers[CONSISTENCY_HEADER] = encode_consistency_token(
+                                routing.last_write
+                            )
+                        headers["Server-Timing"] = stats.server_timing(
+                            time.perf_counter() - start
+                        )
+                    await send(message)
+
+                await self.app(scope, receive, send_with_headers)
+        finally:
+            in_progress.dec()
+            REQUEST_SECONDS.labels(
+                request.method, _route_template(scope), status_code
+            ).observe(time.perf_counter() - start)
+
+
+# Added last, so it wraps the other middleware and times the whole request
+app.add_middleware(RequestMiddleware)
+
+
+@app.exception_handler(DatabaseBusyError)
+async def database_busy_handler(request: Request, exc: DatabaseBusyError) -> Response:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)}
+    )
+
+
+@app.exception_handler(PasswordHashBusyError)
+async def password_hash_busy_handler(
+    request: Request, exc: PasswordHashBusyError
+) -> Response:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)}
+    )
+
+
+@app.on_event("startup")
+async def startup_database() -> None:
+    await run_async(warm_up)
+    if settings.DATABASE_BACKEND == "neo4j":
+        await run_async(check_schema)
+
+
 @app.get("/healthcheck", status_code=200)
 async def healthcheck() -> str:
     return "OK"
 
 
+@app.get("/healthcheck/pool", status_code=200)
+async def healthcheck_pool() -> Dict[str, Any]:
+    return get_pool_stats()
+
+
+@app.get("/metrics", status_code=200, include_in_schema=False)
+async def metrics() -> Response:
+    content, media_type = render_metrics()
+    return Response(content, media_type=media_type)
+
+
 # This line is necessary for debugging the application using VSCode
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,14 +1,30 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import math
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
 from neotime import DateTime
+from py2neo import Node
 from py2neo.data.spatial import WGS84Point
 from py2neo.ogm import Property, RelatedFrom, RelatedTo
 from pydantic import BaseModel as Schema
 from pydantic.fields import Field
-
-from pawtrails.core.database import BaseModel, BaseSchema, graph
+from typing_extensions import Annotated
+
+from pawtrails.core.database import (
+    AFTER_CURSOR,
+    BaseModel,
+    BaseSchema,
+    Counter,
+    Cursor,
+    MemoryBackend,
+    Neo4jBackend,
+    cursor_parameters,
+    get_backend,
+    get_graph,
+    run_async,
+)
 from pawtrails.models.constants import (
     AllowedLocationSizes,
     AllowedLocationTypes,
@@ -30,54 +46,42 @@ class Location(BaseModel):
     _type = Property(key="type", default="park")
     _size = Property(key="size", default="medium")
     _location = Property(key="location")
+    _favorites_count = Property(key="favorites_count", default=0)
+    _review_count = Property(key="review_count", default=0)
+    _grade_sum = Property(key="grade_sum", default=0)
 
     _creator = RelatedFrom("pawtrails.models.user.User", "CREATED")
     _tags = RelatedTo("pawtrails.models.tag.Tag", "TAGGED_AS")
     _favorites = RelatedFrom("pawtrails.models.user.User", "FAVORITED")
     _reviews = RelatedFrom("pawtrails.models.review.Review", "FOR")
 
-    @classmethod
-    def search(cls, params: SearchLocationOptions) -> List[Location]:
-        query: str = (
-            "MATCH (l:Location)"
-            f'\nWHERE toLower(l.name) CONTAINS toLower("{params.name}")'
-        )
-        if params.size:
-            query += f' AND l.size = "{params.size.lower()}"'
-        if params.type:
-            query += f' AND l.type = "{params.type.lower()}"'
-        if params.user:
-            query += (
-                "\nWITH l"
-                f'\nMATCH (u:User {{ uuid: "{params.user.uuid}" }})'
-                "\nWITH u, l"
-            )
-            if params.user.created:
-                query += "\nMATCH (u)-[:CREATED]->(l)"
-            if params.user.favorited:
-                query += "\nMATCH (u)-[:FAVORITED]->(l)"
-        if params.grade:
-            query += (
-                "\nWITH l"
-                "\nMATCH (l)<-[:FOR]-(r:Review)"
-                "\nWITH l, avg(r.grade) AS grade"
-                f"\nWHERE grade >= {params.grade}"
-            )
-        if params.distance:
-            query += (
-                f"\nWITH l, distance(point({{longitude: {params.distance.longitude},"
-                f" latitude: {params.distance.latitude}}}), l.location)/1000 AS dist"
-                f"\nWHERE dist <= {params.distance.max}"
-            )
-        query += f"\nRETURN l SKIP {params.skip} LIMIT {params.limit}"
-        # print(query, flush=True)
+    __prefetch__ = {
+        "creator": "_creator",
+        "tags": "_tags",
+        "favorites": "_favorites",
+    }
+    __counters__ = {
+        "favorites_count": Counter("FAVORITED", -1, "User"),
+        "review_count": Counter("FOR", -1, "Review"),
+        "grade_sum": Counter("FOR", -1, "Review", total="grade"),
+    }
 
+    @classmethod
+    def search(
+        cls, params: SearchLocationOptions, after: Optional[Cursor] = None
+    ) -> List[Location]:
         locs: List[Location] = []
-        for record in graph.run(query):
-            locs.append(Location.wrap(record["l"]))
+        for node in get_backend().query("Location.search", params, after):
+            locs.append(Location.wrap(node))
 
         return locs
 
+    @classmethod
+    async def asearch(
+        cls, params: SearchLocationOptions, after: Optional[Cursor] = None
+    ) -> List[Location]:
+        return await run_async(cls.search, params, after)
+
     @property
     def type(self) -> AllowedLocationTypes:
         return self._type
@@ -129,13 +133,13 @@ class Location(BaseModel):
     def add_creator(self, user: User) -> bool:
         if self._creator:
             return False  # We already have a creator
-        self._creator.add(user, created_at=DateTime.utc_now())
+        self._link(self._creator, user, created_at=DateTime.utc_now())
         return True
 
     def remove_creator(self, user: User) -> bool:
         if user not in self._creator:
             return False
-        self._creator.remove(user)
+        self._unlink(self._creator, user)
         return True
 
     @property
@@ -145,45 +149,52 @@ class Location(BaseModel):
     def add_tag(self, tag: Tag) -> bool:
         if tag in self._tags:
             return False
-        self._tags.add(tag, created_at=DateTime.utc_now())
+        self._link(self._tags, tag, created_at=DateTime.utc_now())
         return True
 
     def remove_tag(self, tag: Tag) -> bool:
         if tag not in self._tags:
             return False
-        self._tags.remove(tag)
+        self._unlink(self._tags, tag)
         return True
 
     @property
     def favorites(self) -> List[User]:
         return [favorite for favorite in self._favorites]
 
+    @property
+    def favorites_count(self) -> int:
+        return self._favorites_count or 0
+
     def add_favorite(self, user: User) -> bool:
         if user in self._favorites:
             return False
-        self._favorites.add(user, created_at=DateTime.utc_now())
+        self._link(self._favorites, user, created_at=DateTime.utc_now())
+        self._count(self, "favorites_count", 1)
+        self._count(user, "favorites_count", 1)
         return True
 
     def remove_favorite(self, user: User) -> bool:
         if user not in self._favorites:
             return False
-        self._favorites.add(user, created_at=DateTime.utc_now())
+        self._unlink(self._favorites, user)
+        self._count(self, "favorites_count", -1)
+        self._count(user, "favorites_count", -1)
         return True
 
     @property
     def reviews(self) -> List[Review]:
         return [review for review in self._reviews]
 
+    @property
+    def review_count(self) -> int:
+        return self._review_count or 0
+
     @property
     def grade(self) -> float:
-        i = 0
-        sum = 0
-        for review in self._reviews:
-            i += 1
-            sum += review.grade
-        if i <= 0 or sum <= 0:
+        if not self._review_count or not self._grade_sum:
             return 0
-        return sum / i
+        return self._grade_sum / self._review_count
 
     @override
     def save(self) -> None:
@@ -198,6 +209,127 @@ class Location(BaseModel):
         super().save()
 
 
+@lru_cache(maxsize=None)
+def _search_query(
+    size: bool,
+    type: bool,
+    created: bool,
+    favorited: bool,
+    grade: bool,
+    distance: bool,
+    after: bool,
+) -> str:
+    """Builds the Cypher query for Location.search. Only the shape of the query
+    depends on which filters are used; all the values are passed as parameters, so
+    Neo4j can reuse the cached plan for every search with the same filters.
+    """
+    query = "MATCH (l:Location)\nWHERE toLower(l.name) CONTAINS toLower($name)"
+    if after:
+        query += " AND " + AFTER_CURSOR.replace("_.", "l.")
+    if size:
+        query += " AND l.size = $size"
+    if type:
+        query += " AND l.type = $type"
+    if grade:
+        query += " AND l.review_count > 0 AND l.grade_sum >= $grade * l.review_count"
+    if created or favorited:
+        query += "\nWITH l\nMATCH (u:User { uuid: $user_uuid })\nWITH u, l"
+        if created:
+            query += "\nMATCH (u)-[:CREATED]->(l)"
+        if favorited:
+            query += "\nMATCH (u)-[:FAVORITED]->(l)"
+    if distance:
+        query += (
+            "\nWITH l, distance(point({longitude: $longitude, latitude: $latitude}),"
+            " l.location)/1000 AS dist"
+            "\nWHERE dist <= $max_distance"
+        )
+    return query + ("\nRETURN l ORDER BY l.created_at, l.uuid SKIP $skip LIMIT $limit")
+
+
+@Neo4jBackend.register("Location.search")
+def _search_neo4j(
+    backend: Neo4jBackend, params: SearchLocationOptions, after: Optional[Cursor]
+) -> List[Node]:
+    query = _search_query(
+        size=bool(params.size),
+        type=bool(params.type),
+        created=bool(params.user and params.user.created),
+        favorited=bool(params.user and params.user.favorited),
+        grade=bool(params.grade),
+        distance=bool(params.distance),
+        after=bool(after),
+    )
+    parameters = {
+        "name": params.name or "",
+        "size": params.size.lower() if params.size else None,
+        "type": params.type.lower() if params.type else None,
+        "user_uuid": params.user.uuid if params.user else None,
+        "grade": params.grade,
+        "longitude": params.distance.longitude if params.distance else None,
+        "latitude": params.distance.latitude if params.distance else None,
+        "max_distance": params.distance.max if params.distance else None,
+        "skip": params.skip,
+        "limit": params.limit,
+        **cursor_parameters(after),
+    }
+    return [record["l"] for record in get_graph(readonly=True).run(query, parameters)]
+
+
+# Neo4j measures the distance of WGS-84 points with the haversine formula and this
+EARTH_RADIUS_KM = 6378.14
+
+
+def _distance(longitude: float, latitude: float, point: Sequence[float]) -> float:
+    """Returns the distance of two points in kilometers, like _search_query."""
+    lon1, lat1, lon2, lat2 = map(math.radians, (longitude, latitude, *point[:2]))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+@MemoryBackend.register("Location.search")
+def _search_memory(
+    backend: MemoryBackend, params: SearchLocationOptions, after: Optional[Cursor]
+) -> List[Node]:
+    name = (params.name or "").lower()
+    locs = [loc for loc in backend.all("Location") if name in loc["name"].lower()]
+    if params.size:
+        locs = [loc for loc in locs if loc["size"] == params.size.lower()]
+    if params.type:
+        locs = [loc for loc in locs if loc["type"] == params.type.lower()]
+    if params.grade:
+        grade = params.grade
+        locs = [
+            loc
+            for loc in locs
+            if (loc["review_count"] or 0) > 0
+            and (loc["grade_sum"] or 0) >= grade * loc["review_count"]
+        ]
+    if params.user:
+        user = params.user
+        for relationship_type, wanted in (
+            ("CREATED", user.created),
+            ("FAVORITED", user.favorited),
+        ):
+            if wanted:
+                related = backend.related("User", [user.uuid], relationship_type, 1)
+                uuids = {node["uuid"] for _, _, node in related}
+                locs = [loc for loc in locs if loc["uuid"] in uuids]
+    if params.distance:
+        d = params.distance
+        locs = [
+            loc
+            for loc in locs
+            if loc["location"] is not None
+            and _distance(d.longitude, d.latitude, loc["location"]) <= d.max
+        ]
+    limit = params.limit if params.limit is not None else 100
+    return backend.page(locs, params.skip or 0, limit, after)
+
+
 class LocationSchema(BaseSchema):
     name: str
     description: str
@@ -215,7 +347,7 @@ class FullLocationSchema(LocationSchema):
 
 
 class AddLocationSchema(Schema):
-    name: str
+    name: Annotated[str, Field(example="Central Park", min_length=1)]
     description: str
     type: AllowedLocationTypes
     size: AllowedLocationSizes
@@ -223,7 +355,7 @@ class AddLocationSchema(Schema):
 
 
 class UpdateLocationSchema(Schema):
-    name: Optional[str]
+    name: Annotated[Optional[str], Field(example="Central Park", min_length=1)]
     description: Optional[str]
     type: Optional[AllowedLocationTypes]
     size: Optional[AllowedLocationSizes]
@@ -265,6 +397,7 @@ class SearchLocationSchema(Schema):
     max_distance: Optional[float]
     skip: Optional[int] = 0
     limit: Optional[int] = 100
+    cursor: Optional[str]
 
 
 class Point(Schema):
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, List, Optional, cast
 
 from neotime import DateTime
 from py2neo.ogm import Property, RelatedFrom
@@ -8,7 +8,7 @@ from pydantic import BaseModel as Schema
 from pydantic import Field
 from typing_extensions import Annotated
 
-from pawtrails.core.database import BaseModel, BaseSchema, repository
+from pawtrails.core.database import BaseModel, BaseSchema, Counter, Cursor
 from pawtrails.models.constants import AllowedPetEnergies, AllowedPetSizes
 from pawtrails.models.user import UserSchema
 from pawtrails.utils import is_allowed_literal, override
@@ -22,56 +22,56 @@ class Pet(BaseModel):
     breed = Property(key="breed")
     _energy = Property(key="energy", default=3)
     _size = Property(key="size", default="Medium")
+    _owners_count = Property(key="owners_count", default=0)
 
     _owners = RelatedFrom("pawtrails.models.user.User", "OWNS")
 
+    __prefetch__ = {"owners": "_owners"}
+    __counters__ = {"owners_count": Counter("OWNS", -1, "User")}
+
     @classmethod
-    def get_by_name(cls, name: str, skip: int = 0, limit: int = 100) -> List[Pet]:
-        return [
-            pet
-            for pet in cls.match(repository)
-            .where(name=name)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+    def get_by_name(
+        cls,
+        name: str,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
+    ) -> List[Pet]:
+        return cast(List[Pet], cls.find(skip=skip, limit=limit, after=after, name=name))
 
     @classmethod
-    def get_by_breed(cls, breed: str, skip: int = 0, limit: int = 100) -> List[Pet]:
-        return [
-            pet
-            for pet in cls.match(repository)
-            .where(breed=breed)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+    def get_by_breed(
+        cls,
+        breed: str,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
+    ) -> List[Pet]:
+        return cast(
+            List[Pet], cls.find(skip=skip, limit=limit, after=after, breed=breed)
+        )
 
     @classmethod
     def get_by_energy(
-        cls, energy: AllowedPetEnergies, skip: int = 0, limit: int = 100
+        cls,
+        energy: AllowedPetEnergies,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
     ) -> List[Pet]:
-        return [
-            pet
-            for pet in cls.match(repository)
-            .where(energy=energy)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+        return cast(
+            List[Pet], cls.find(skip=skip, limit=limit, after=after, energy=energy)
+        )
 
     @classmethod
     def get_by_size(
-        cls, size: AllowedPetSizes, skip: int = 0, limit: int = 100
+        cls,
+        size: AllowedPetSizes,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
     ) -> List[Pet]:
-        return [
-            pet
-            for pet in cls.match(repository)
-            .where(size=size)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+        return cast(List[Pet], cls.find(skip=skip, limit=limit, after=after, size=size))
 
     @property
     def energy(self) -> AllowedPetEnergies:
@@ -100,16 +100,24 @@ class Pet(BaseModel):
     def owners(self) -> List[User]:
         return [owner for owner in self._owners]
 
+    @property
+    def owners_count(self) -> int:
+        return self._owners_count or 0
+
     def add_owner(self, user: User) -> bool:
         if user in self._owners:
             return False
-        self._owners.add(user, created_at=DateTime.utc_now())
+        self._link(self._owners, user, created_at=DateTime.utc_now())
+        self._count(self, "owners_count", 1)
+        self._count(user, "pets_count", 1)
         return True
 
     def remove_owner(self, user: User) -> bool:
         if user not in self._owners:
             return False
-        self._owners.remove(user)
+        self._unlink(self._owners, user)
+        self._count(self, "owners_count", -1)
+        self._count(user, "pets_count", -1)
         return True
 
     @override
@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, List, Optional, cast
 
 from neotime import DateTime
 from py2neo.ogm import Property, RelatedFrom, RelatedTo
 from pydantic import BaseModel as Schema
 
-from pawtrails.core.database import BaseModel, BaseSchema, repository
+from pawtrails.core.database import BaseModel, BaseSchema, Cursor
 from pawtrails.models.constants import AllowedReviewGrades
 from pawtrails.models.location import LocationSchema
 from pawtrails.models.user import UserSchema
@@ -24,18 +24,19 @@ class Review(BaseModel):
     _writer = RelatedFrom("pawtrails.models.user.User", "WROTE")
     _location = RelatedTo("pawtrails.models.location.Location", "FOR")
 
+    __prefetch__ = {"writer": "_writer", "location": "_location"}
+
     @classmethod
     def get_by_grade(
-        cls, grade: AllowedReviewGrades, skip: int = 0, limit: int = 100
+        cls,
+        grade: AllowedReviewGrades,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
     ) -> List[Review]:
-        return [
-            review
-            for review in cls.match(repository)
-            .where(grade=grade)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+        return cast(
+            List[Review], cls.find(skip=skip, limit=limit, after=after, grade=grade)
+        )
 
     @property
     def grade(self) -> AllowedReviewGrades:
@@ -46,6 +47,8 @@ class Review(BaseModel):
         if not isinstance(grade, int):
             raise TypeError(f"Grade {grade} is not an integer.")
         is_allowed_literal(grade, "Grade", AllowedReviewGrades)
+        if self.__node__.graph is not None and self._location:
+            self._count(self.location, "grade_sum", grade - self._grade)
         self._grade = grade
 
     @property
@@ -57,13 +60,13 @@ class Review(BaseModel):
     def add_writer(self, user: User) -> bool:
         if self._writer:
             return False
-        self._writer.add(user, created_at=DateTime.utc_now())
+        self._link(self._writer, user, created_at=DateTime.utc_now())
         return True
 
     def remove_writer(self, user: User) -> bool:
         if user not in self._writer:
             return False
-        self._writer.remove(user)
+        self._unlink(self._writer, user)
         return True
 
     @property
@@ -75,13 +78,13 @@ class Review(BaseModel):
     def add_location(self, location: Location) -> bool:
         if self._location:
             return False
-        self._location.add(location, created_at=DateTime.utc_now())
+        self._link(self._location, location, created_at=DateTime.utc_now())
         return True
 
     def remove_location(self, location: Location) -> bool:
         if location not in self._location:
             return False
-        self._location.remove(location)
+        self._unlink(self._location, location)
         return True
 
     @override
@@ -94,6 +97,10 @@ class Review(BaseModel):
             raise AttributeError("Cannot save Review: more than 1 writer.")
         if len(self._location) > 1:
             raise AttributeError("Cannot save Review: more than 1 location.")
+        # New review, add it to the location aggregate (once, if saved again unsaved)
+        if self.__node__.graph is None and not self._pending_counts:
+            self._count(self.location, "review_count", 1)
+            self._count(self.location, "grade_sum", self.grade)
         super().save()
 
 
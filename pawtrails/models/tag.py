@@ -1,13 +1,13 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import List, Optional, cast
 
 from py2neo.ogm import Property
 from pydantic import BaseModel as Schema
 from pydantic.fields import Field
 from typing_extensions import Annotated
 
-from pawtrails.core.database import BaseModel, BaseSchema, repository
+from pawtrails.core.database import BaseModel, BaseSchema, Cursor
 from pawtrails.models.constants import AllowedTagColors
 from pawtrails.utils import is_allowed_literal
 
@@ -19,26 +19,26 @@ class Tag(BaseModel):
     """
 
     __primarykey__ = "name"  # This will prevent duplicates
+    __unique__ = ("uuid", "name")
 
     _name = Property(key="name")
     _color = Property(key="color", default="primary")
 
     @classmethod
     def get_by_name(cls, name: str) -> Optional[Tag]:
-        return cls.match(repository).where(name=name).first()
+        return cast(Optional[Tag], next(iter(cls.find(limit=1, name=name)), None))
 
     @classmethod
     def get_by_color(
-        cls, color: AllowedTagColors, skip: int = 0, limit: int = 100
+        cls,
+        color: AllowedTagColors,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
     ) -> List[Tag]:
-        return [
-            tag
-            for tag in cls.match(repository)
-            .where(color=color)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+        return cast(
+            List[Tag], cls.find(skip=skip, limit=limit, after=after, color=color)
+        )
 
     @property
     def name(self) -> str:
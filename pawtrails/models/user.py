@@ -3,7 +3,7 @@ from __future__ import annotations
 import operator
 import textwrap
 from datetime import datetime
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, cast
 
 from neotime import DateTime
 from py2neo.data.spatial import WGS84Point
@@ -13,8 +13,25 @@ from pydantic import EmailStr
 from pydantic.fields import Field
 from typing_extensions import Annotated
 
-from pawtrails.core.database import BaseModel, BaseSchema, graph, repository
-from pawtrails.core.security import get_password_hash, verify_password
+from pawtrails.core.database import (
+    BaseModel,
+    BaseSchema,
+    Counter,
+    Cursor,
+    MemoryBackend,
+    Neo4jBackend,
+    get_backend,
+    get_graph,
+    run_async,
+)
+from pawtrails.core.security import (
+    PasswordHashBusyError,
+    aget_password_hash,
+    averify_password,
+    get_password_hash,
+    password_needs_rehash,
+    verify_password,
+)
 
 if TYPE_CHECKING:
     from pawtrails.models.location import Location
@@ -31,6 +48,10 @@ class User(BaseModel):
     _username = Property(key="username")
     _password = Property(key="password")
     _home = Property(key="home")
+    _following_count = Property(key="following_count", default=0)
+    _followers_count = Property(key="followers_count", default=0)
+    _favorites_count = Property(key="favorites_count", default=0)
+    _pets_count = Property(key="pets_count", default=0)
 
     # NOTE: Import this whole things so there is not CIRCULAR IMPORTS
     _following = RelatedTo("pawtrails.models.user.User", "FOLLOWS")
@@ -40,26 +61,36 @@ class User(BaseModel):
     _favorites = RelatedTo("pawtrails.models.location.Location", "FAVORITED")
     _reviews = RelatedTo("pawtrails.models.review.Review", "WROTE")
 
+    __counters__ = {
+        "following_count": Counter("FOLLOWS", 1, "User"),
+        "followers_count": Counter("FOLLOWS", -1, "User"),
+        "favorites_count": Counter("FAVORITED", 1, "Location"),
+        "pets_count": Counter("OWNS", 1, "Pet"),
+    }
+    # A duplicate email or username fails the save, see UniquenessError
+    __unique__ = ("uuid", "email", "username")
+
     @classmethod
     def get_by_is_active(
-        cls, is_active: bool, skip: int = 0, limit: int = 100
+        cls,
+        is_active: bool,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Cursor] = None,
     ) -> List[User]:
-        return [
-            user
-            for user in cls.match(repository)
-            .where(is_active=is_active)
-            .skip(skip)
-            .limit(limit)
-            .all()
-        ]
+        return cast(
+            List[User],
+            cls.find(skip=skip, limit=limit, after=after, is_active=is_active),
+        )
 
     @classmethod
     def get_by_email(cls, email: str) -> Optional[User]:
-        return cls.match(repository).where(email=email).first()
+        return cast(Optional[User], next(iter(cls.find(limit=1, email=email)), None))
 
     @classmethod
     def get_by_username(cls, username: str) -> Optional[User]:
-        return cls.match(repository).where(username=username).first()
+        users = cls.find(limit=1, username=username)
+        return cast(Optional[User], next(iter(users), None))
 
     @classmethod
     def authenticate(cls, email: str, password: str) -> Optional[User]:
@@ -68,6 +99,22 @@ class User(BaseModel):
             return None
         return user
 
+    @classmethod
+    async def aget_by_email(cls, email: str) -> Optional[User]:
+        return await run_async(cls.get_by_email, email)
+
+    @classmethod
+    async def aget_by_username(cls, username: str) -> Optional[User]:
+        return await run_async(cls.get_by_username, username)
+
+    @classmethod
+    async def aauthenticate(cls, email: str, password: str) -> Optional[User]:
+        # The lookup runs on the database threads, bcrypt on the password threads
+        user = await cls.aget_by_email(email)
+        if not user or not await averify_password(password, user.password):
+            return None
+        return user
+
     @property
     def email(self) -> str:
         return self._email
@@ -76,8 +123,6 @@ class User(BaseModel):
     def email(self, email: str) -> None:
         if not isinstance(email, str):
             raise TypeError(f"Email {email} is not an email.")
-        if User.get_by_email(email):
-            raise ValueError(f"Email {email} already exists.")
         self._email = email
 
     @property
@@ -88,8 +133,6 @@ class User(BaseModel):
     def username(self, username: str) -> None:
         if not isinstance(username, str):
             raise TypeError(f"Username {username} is not a string.")
-        if User.get_by_username(username):
-            raise ValueError(f"Username {username} already exists.")
         self._username = username
 
     @property
@@ -102,24 +145,58 @@ class User(BaseModel):
             raise TypeError(f"Password {password} is not a string.")
         self._password = get_password_hash(password)
 
+    async def aset_password(self, password: str) -> None:
+        """Sets the password like the setter, hashing it on the password threads.
+
+        Args:
+            password (str): The RAW password
+        """
+        if not isinstance(password, str):
+            raise TypeError(f"Password {password} is not a string.")
+        self._password = await aget_password_hash(password)
+
+    async def arehash_password(self, password: str) -> None:
+        """Hashes the password again if its hash uses another scheme or cost than
+        PASSWORD_HASH_SCHEME and PASSWORD_HASH_ROUNDS. Called in the background after
+        a login, when the password is known to match. Only the hash is written, and
+        only if it was not changed in the meantime.
+
+        Args:
+            password (str): The RAW password, already verified
+        """
+        current = self.password
+        if not password_needs_rehash(current):
+            return
+        try:
+            updated = await aget_password_hash(password)
+        except PasswordHashBusyError:
+            return  # Rehashed at a later login
+        query = get_backend().query
+        if await run_async(query, "User.rehash_password", self._uuid, current, updated):
+            self._password = updated
+
     @property
     def following(self) -> List[User]:
         return [follow for follow in self._following]
 
     @property
     def following_count(self) -> int:
-        return len(self._following)
+        return self._following_count or 0
 
     def add_following(self, user: User) -> bool:
         if self == user or user in self._following:
             return False
-        self._following.add(user, created_at=DateTime.utc_now())
+        self._link(self._following, user, created_at=DateTime.utc_now())
+        self._count(self, "following_count", 1)
+        self._count(user, "followers_count", 1)
         return True
 
     def remove_following(self, user: User) -> bool:
         if self == user or user not in self._following:
             return False
-        self._following.remove(user)
+        self._unlink(self._following, user)
+        self._count(self, "following_count", -1)
+        self._count(user, "followers_count", -1)
         return True
 
     @property
@@ -128,22 +205,30 @@ class User(BaseModel):
 
     @property
     def followers_count(self) -> int:
-        return len(self._followers)
+        return self._followers_count or 0
 
     @property
     def pets(self) -> List[Pet]:
         return [pet for pet in self._pets]
 
+    @property
+    def pets_count(self) -> int:
+        return self._pets_count or 0
+
     def add_pet(self, pet: Pet) -> bool:
         if pet in self._pets:
             return False
-        self._pets.add(pet, created_at=DateTime.utc_now())
+        self._link(self._pets, pet, created_at=DateTime.utc_now())
+        self._count(self, "pets_count", 1)
+        self._count(pet, "owners_count", 1)
         return True
 
     def remove_pet(self, pet: Pet) -> bool:
         if pet not in self._pets:
             return False
-        self._pets.remove(pet)
+        self._unlink(self._pets, pet)
+        self._count(self, "pets_count", -1)
+        self._count(pet, "owners_count", -1)
         return True
 
     @property
@@ -155,16 +240,24 @@ class User(BaseModel):
     def favorites(self) -> List[Location]:
         return [location for location in self._favorites]
 
+    @property
+    def favorites_count(self) -> int:
+        return self._favorites_count or 0
+
     def add_favorite(self, location: Location) -> bool:
         if location in self._favorites:
             return False
-        self._favorites.add(location, created_at=DateTime.utc_now())
+        self._link(self._favorites, location, created_at=DateTime.utc_now())
+        self._count(self, "favorites_count", 1)
+        self._count(location, "favorites_count", 1)
         return True
 
     def remove_favorite(self, location: Location) -> bool:
         if location not in self._favorites:
             return False
-        self._favorites.remove(location)
+        self._unlink(self._favorites, location)
+        self._count(self, "favorites_count", -1)
+        self._count(location, "favorites_count", -1)
         return True
 
     @property
@@ -191,149 +284,235 @@ class User(BaseModel):
 
     # TODO: Add a save checking function
     def get_dashboard(self) -> List[DashboardSchema]:
-        my_query: str = f'MATCH (me:User {{ uuid: "{self._uuid}" }})\n'
-        my_query += textwrap.dedent(
-            """
-            MATCH (me)-[owns:OWNS]-(pet:Pet)
-            WITH me, pet.name as mpn,
-            owns.created_at as mpt, pet.uuid as mpu
-
-            MATCH (me)-[created:CREATED]->(loc:Location)
-            WITH me, mpn, mpt, mpu, loc.name as mln,
-            created.created_at as mlt, loc.uuid as mlu
-
-            MATCH (me)-[favorited:FAVORITED]->(fav_loc:Location)
-            WITH me, mpn, mpt, mpu, mln, mlt, mlu,
-            fav_loc.name as mfn, favorited.created_at as mft, fav_loc.uuid as mfu
-
-            MATCH (me)-[wrote:WROTE]-(review:Review)-[:FOR]->(rew_loc:Location)
-            WITH me, mpn, mpt, mpu, mln, mlt, mlu, mfn, mft, mfu,
-            rew_loc.name as mrn, wrote.created_at as mrt, rew_loc.uuid as mru
-
-            RETURN
-            collect(DISTINCT {
-                user: "You",
-                user_uuid: me.uuid,
-                action: "created",
-                label: "pet",
-                name: mpn,
-                time: mpt,
-                uuid: mpu
-            }) as my_pets,
-            collect(DISTINCT {
-                user: "You",
-                user_uuid: me.uuid,
-                action: "reviewed",
-                label: "location",
-                name: mrn,
-                time: mrt,
-                uuid: mru
-            }) as my_reviews,
-            collect(DISTINCT {
-                user: "You",
-                user_uuid: me.uuid,
-                action: "created",
-                label: "location",
-                name: mln,
-                time: mlt,
-                uuid: mlu
-            }) as my_locations,
-            collect(DISTINCT {
-                user: "You",
-                user_uuid: me.uuid,
-                action: "favorited",
-                label: "location",
-                name: mfn,
-                time: mft,
-                uuid: mfu
-            }) as my_fav_locations"""
-        )
-        user_query: str = (
-            f'\nMATCH (:User {{ uuid: "{self._uuid}" }})-[:FOLLOWS]->(user:User)\n'
-        )
-        user_query += textwrap.dedent(
-            """
-            MATCH (user)-[owns:OWNS]-(pet:Pet)
-            WITH user, pet.name as mpn,
-            owns.created_at as mpt, pet.uuid as mpu
-
-            MATCH (user)-[created:CREATED]->(loc:Location)
-            WITH user, mpn, mpt, mpu, loc.name as mln,
-            created.created_at as mlt, loc.uuid as mlu
-
-            MATCH (user)-[favorited:FAVORITED]->(fav_loc:Location)
-            WITH user, mpn, mpt, mpu, mln, mlt, mlu,
-            fav_loc.name as mfn, favorited.created_at as mft, fav_loc.uuid as mfu
-
-            MATCH (user)-[wrote:WROTE]-(review:Review)-[:FOR]->(rew_loc:Location)
-            WITH user, mpn, mpt, mpu, mln, mlt, mlu, mfn, mft, mfu,
-            rew_loc.name as mrn, wrote.created_at as mrt, rew_loc.uuid as mru
-
-            RETURN
-            collect(DISTINCT {
-                user: user.username,
-                user_uuid: user.uuid,
-                action: "created",
-                label: "pet",
-                name: mpn,
-                time: mpt,
-                uuid: mpu
-            }) as pets,
-            collect(DISTINCT {
-                user: user.username,
-                user_uuid: user.uuid,
-                action: "reviewed",
-                label: "location",
-                name: mrn,
-                time: mrt,
-                uuid: mru
-            }) as reviews,
-            collect(DISTINCT {
-                user: user.username,
-                user_uuid: user.uuid,
-                action: "created",
-                label: "location",
-                name: mln,
-                time: mlt,
-                uuid: mlu
-            }) as locations,
-            collect(DISTINCT {
-                user: user.username,
-                user_uuid: user.uuid,
-                action: "favorited",
-                label: "location",
-                name: mfn,
-                time: mft,
-                uuid: mfu
-            }) as fav_locations
-            """
-        )
+        return self.get_dashboard_by_uuid(self._uuid)
 
-        updates: List[DashboardSchema] = []
+    async def aget_dashboard(self) -> List[DashboardSchema]:
+        return await run_async(self.get_dashboard)
 
-        def iterate_records(query: str, updates: list) -> None:
-            for records in graph.run(query):
-                for subrecords in records:
-                    for update in subrecords:
-                        updates.append(
-                            DashboardSchema(
-                                user=update["user"],
-                                user_uuid=update["user_uuid"],
-                                action=update["action"],
-                                label=update["label"],
-                                name=update["name"],
-                                time=str(update["time"]),
-                                uuid=update["uuid"],
-                            )
-                        )
-
-        iterate_records(my_query, updates)
-        iterate_records(user_query, updates)
+    @classmethod
+    def get_dashboard_by_uuid(cls, uuid: str) -> List[DashboardSchema]:
+        """The dashboard of a user that is not loaded, e.g. the one of a token."""
+        updates: List[DashboardSchema] = []
+        for update in get_backend().query("User.dashboard", uuid):
+            updates.append(DashboardSchema(**{**update, "time": str(update["time"])}))
 
         updates.sort(key=operator.attrgetter("time"), reverse=True)
 
         return updates
 
+    @classmethod
+    async def aget_dashboard_by_uuid(cls, uuid: str) -> List[DashboardSchema]:
+        return await run_async(cls.get_dashboard_by_uuid, uuid)
+
+
+@Neo4jBackend.register("User.dashboard")
+def _dashboard_neo4j(backend: Neo4jBackend, uuid: str) -> List[Dict[str, Any]]:
+    my_query: str = f'MATCH (me:User {{ uuid: "{uuid}" }})\n'
+    my_query += textwrap.dedent("""
+        MATCH (me)-[owns:OWNS]-(pet:Pet)
+        WITH me, pet.name as mpn,
+        owns.created_at as mpt, pet.uuid as mpu
+
+        MATCH (me)-[created:CREATED]->(loc:Location)
+        WITH me, mpn, mpt, mpu, loc.name as mln,
+        created.created_at as mlt, loc.uuid as mlu
+
+        MATCH (me)-[favorited:FAVORITED]->(fav_loc:Location)
+        WITH me, mpn, mpt, mpu, mln, mlt, mlu,
+        fav_loc.name as mfn, favorited.created_at as mft, fav_loc.uuid as mfu
+
+        MATCH (me)-[wrote:WROTE]-(review:Review)-[:FOR]->(rew_loc:Location)
+        WITH me, mpn, mpt, mpu, mln, mlt, mlu, mfn, mft, mfu,
+        rew_loc.name as mrn, wrote.created_at as mrt, rew_loc.uuid as mru
+
+        RETURN
+        collect(DISTINCT {
+            user: "You",
+            user_uuid: me.uuid,
+            action: "created",
+            label: "pet",
+            name: mpn,
+            time: mpt,
+            uuid: mpu
+        }) as my_pets,
+        collect(DISTINCT {
+            user: "You",
+            user_uuid: me.uuid,
+            action: "reviewed",
+            label: "location",
+            name: mrn,
+            time: mrt,
+            uuid: mru
+        }) as my_reviews,
+        collect(DISTINCT {
+            user: "You",
+            user_uuid: me.uuid,
+            action: "created",
+            label: "location",
+            name: mln,
+            time: mlt,
+            uuid: mlu
+        }) as my_locations,
+        collect(DISTINCT {
+            user: "You",
+            user_uuid: me.uuid,
+            action: "favorited",
+            label: "location",
+            name: mfn,
+            time: mft,
+            uuid: mfu
+        }) as my_fav_locations""")
+    user_query: str = f'\nMATCH (:User {{ uuid: "{uuid}" }})-[:FOLLOWS]->(user:User)\n'
+    user_query += textwrap.dedent("""
+        MATCH (user)-[owns:OWNS]-(pet:Pet)
+        WITH user, pet.name as mpn,
+        owns.created_at as mpt, pet.uuid as mpu
+
+        MATCH (user)-[created:CREATED]->(loc:Location)
+        WITH user, mpn, mpt, mpu, loc.name as mln,
+        created.created_at as mlt, loc.uuid as mlu
+
+        MATCH (user)-[favorited:FAVORITED]->(fav_loc:Location)
+        WITH user, mpn, mpt, mpu, mln, mlt, mlu,
+        fav_loc.name as mfn, favorited.created_at as mft, fav_loc.uuid as mfu
+
+        MATCH (user)-[wrote:WROTE]-(review:Review)-[:FOR]->(rew_loc:Location)
+        WITH user, mpn, mpt, mpu, mln, mlt, mlu, mfn, mft, mfu,
+        rew_loc.name as mrn, wrote.created_at as mrt, rew_loc.uuid as mru
+
+        RETURN
+        collect(DISTINCT {
+            user: user.username,
+            user_uuid: user.uuid,
+            action: "created",
+            label: "pet",
+            name: mpn,
+            time: mpt,
+            uuid: mpu
+        }) as pets,
+        collect(DISTINCT {
+            user: user.username,
+            user_uuid: user.uuid,
+            action: "reviewed",
+            label: "location",
+            name: mrn,
+            time: mrt,
+            uuid: mru
+        }) as reviews,
+        collect(DISTINCT {
+            user: user.username,
+            user_uuid: user.uuid,
+            action: "created",
+            label: "location",
+            name: mln,
+            time: mlt,
+            uuid: mlu
+        }) as locations,
+        collect(DISTINCT {
+            user: user.username,
+            user_uuid: user.uuid,
+            action: "favorited",
+            label: "location",
+            name: mfn,
+            time: mft,
+            uuid: mfu
+        }) as fav_locations
+        """)
+
+    updates: List[Dict[str, Any]] = []
+    for query in (my_query, user_query):
+        for records in get_graph(readonly=True).run(query):
+            for subrecords in records:
+                updates.extend(dict(update) for update in subrecords)
+    return updates
+
+
+@Neo4jBackend.register("User.rehash_password")
+def _rehash_password_neo4j(
+    backend: Neo4jBackend, uuid: str, current: str, updated: str
+) -> bool:
+    query = """
+        MATCH (u:User { uuid: $uuid }) WHERE u.password = $current
+        SET u.password = $updated
+        RETURN count(u)
+    """
+    return bool(
+        get_graph().run(query, uuid=uuid, current=current, updated=updated).evaluate()
+    )
+
+
+@MemoryBackend.register("User.dashboard")
+def _dashboard_memory(backend: MemoryBackend, uuid: str) -> List[Dict[str, Any]]:
+    def related(label: str, uuid: str, type: str, direction: int, other: str) -> list:
+        return [
+            (properties, node)
+            for _, properties, node in backend.related(label, [uuid], type, direction)
+            if node.has_label(other)
+        ]
+
+    users = [("You", uuid)] if backend.get_many("User", [uuid]) else []
+    users += [
+        (user["username"], user["uuid"])
+        for _, user in related("User", uuid, "FOLLOWS", 1, "User")
+    ]
+    updates: List[Dict[str, Any]] = []
+    for name, user_uuid in users:
+        events = {
+            ("created", "pet"): related("User", user_uuid, "OWNS", 0, "Pet"),
+            ("reviewed", "location"): [
+                (properties, location)
+                for properties, review in related(
+                    "User", user_uuid, "WROTE", 0, "Review"
+                )
+                for _, location in related(
+                    "Review", review["uuid"], "FOR", 1, "Location"
+                )
+            ],
+            ("created", "location"): related(
+                "User", user_uuid, "CREATED", 1, "Location"
+            ),
+            ("favorited", "location"): related(
+                "User", user_uuid, "FAVORITED", 1, "Location"
+            ),
+        }
+        # Like the chained MATCHes of the query, a user needs every kind of event
+        if not all(events.values()):
+            continue
+        for (action, label), items in events.items():
+            seen = set()
+            for properties, node in items:
+                time = properties.get("created_at")
+                if (node["uuid"], time) in seen:
+                    continue
+                seen.add((node["uuid"], time))
+                updates.append(
+                    {
+                        "user": name,
+                        "user_uuid": user_uuid,
+                        "action": action,
+                        "label": label,
+                        "name": node["name"],
+                        "time": time,
+                        "uuid": node["uuid"],
+                    }
+                )
+    return updates
+
+
+@MemoryBackend.register("User.rehash_password")
+def _rehash_password_memory(
+    backend: MemoryBackend, uuid: str, current: str, updated: str
+) -> bool:
+    with backend.lock:
+        identity = backend.uuids.get(uuid)
+        if identity is None:
+            return False
+        properties = backend.nodes[identity][1]
+        if properties.get("password") != current:
+            return False
+        properties["password"] = updated
+        return True
+
 
 class UserSchema(BaseSchema):
     full_name: Optional[str]
@@ -0,0 +1,376 @@
+"""Benchmarks the main routes through the ASGI app, in process. See benchmark."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+from pawtrails.core.database import get_backend
+from pawtrails.core.security import create_access_token
+from pawtrails.core.settings import settings
+from pawtrails.core.tracing import query_stats
+from pawtrails.scripts.database import seed_synthetic_data
+from pawtrails.scripts.generator import CITIES, LOCATION_TYPES, Scale
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+# Compared against the baseline, lower is better for all of them
+COMPARED = ["p50_ms", "p95_ms", "queries", "alloc_kib", "errors"]
+# Number of seeded users the requests are made as or about
+SAMPLE_USERS = 50
+
+Result = Dict[str, float]
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Tuple[Tuple[str, str], ...] = ()
+    body: bytes = b""
+
+
+class Fixture(NamedTuple):
+    """The seeded users the scenarios pick from, with their access tokens."""
+
+    users: List[Tuple[str, str, str]]  # (uuid, email, access token)
+
+
+def _auth(token: str) -> Tuple[str, str]:
+    return ("Authorization", f"Bearer {token}")
+
+
+def _json(data: Dict[str, Any]) -> Tuple[Tuple[str, str], bytes]:
+    return ("Content-Type", "application/json"), json.dumps(data).encode()
+
+
+def get_locations(fixture: Fixture, rng: random.Random) -> Request:
+    return Request("GET", f"{settings.API_PREFIX}/location/?limit=100")
+
+
+def search_locations(fixture: Fixture, rng: random.Random) -> Request:
+    _, longitude, latitude, _, radius = rng.choice(CITIES)
+    header, body = _json(
+        {
+            "type": rng.choice(LOCATION_TYPES),
+            "longitude": longitude,
+            "latitude": latitude,
+            "max_distance": radius,
+            "limit": 50,
+        }
+    )
+    token = rng.choice(fixture.users)[2]
+    path = f"{settings.API_PREFIX}/location/search"
+    return Request("POST", path, (header, _auth(token)), body)
+
+
+def get_dashboard(fixture: Fixture, rng: random.Random) -> Request:
+    token = rng.choice(fixture.users)[2]
+    return Request("GET", f"{settings.API_PREFIX}/me/dashboard", (_auth(token),))
+
+
+def login(fixture: Fixture, rng: random.Random) -> Request:
+    email = rng.choice(fixture.users)[1]
+    body = urlencode({"username": email, "password": "password"}).encode()
+    header = ("Content-Type", "application/x-www-form-urlencoded")
+    return Request("POST", f"{settings.API_PREFIX}/login", (header,), body)
+
+
+def get_followers(fixture: Fixture, rng: random.Random) -> Request:
+    uuid = rng.choice(fixture.users)[0]
+    return Request("GET", f"{settings.API_PREFIX}/user/{uuid}/followers")
+
+
+SCENARIOS: Dict[str, Callable[[Fixture, random.Random], Request]] = {
+    "GET /location/": get_locations,
+    "POST /location/search": search_locations,
+    "GET /me/dashboard": get_dashboard,
+    "POST /login": login,
+    "GET /user/{uuid}/followers": get_followers,
+}
+
+
+async def call(app: Any, request: Request) -> int:
+    """Sends a request straight to the ASGI app, without a server or a socket.
+
+    Args:
+        app (Any): The ASGI application
+        request (Request): The request
+
+    Returns:
+        int: The status code of the response
+    """
+    path, _, query = request.path.partition("?")
+    headers = [(k.lower().encode(), v.encode()) for k, v in request.headers]
+    headers.append((b"content-length", str(len(request.body)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": request.method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    body = [{"type": "http.request", "body": request.body, "more_body": False}]
+    done = asyncio.Event()
+    status = 0
+
+    async def receive() -> Dict[str, Any]:
+        if body:
+            return body.pop()
+        await done.wait()  # The client only disconnects after the response
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif not message.get("more_body", False):
+            done.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+async def run_scenario(
+    app: Any,
+    fixture: Fixture,
+    scenario: Callable[[Fixture, random.Random], Request],
+    requests: int,
+    warmup: int,
+    allocations: int,
+    seed: int,
+) -> Result:
+    """Runs the requests of a scenario one after the other.
+
+    Args:
+        app (Any): The ASGI application
+        fixture (Fixture): The seeded users
+        scenario (Callable[[Fixture, random.Random], Request]): Builds the requests
+        requests (int): Number of timed requests
+        warmup (int): Number of untimed requests made first
+        allocations (int): Number of requests whose memory allocation is traced
+        seed (int): The random seed
+
+    Returns:
+        Result: The latency percentiles, queries and allocations per request
+    """
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        await call(app, scenario(fixture, rng))
+
+    latencies: List[float] = []
+    errors = 0
+    with query_stats() as stats:
+        for _ in range(requests):
+            request = scenario(fixture, rng)
+            start = time.perf_counter()
+            status = await call(app, request)
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += status >= 400
+
+    # Tracing slows everything down, so the allocations are measured separately
+    peaks: List[float] = []
+    tracemalloc.start()
+    try:
+        for _ in range(allocations):
+            request = scenario(fixture, rng)
+            tracemalloc.clear_traces()
+            await call(app, request)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "queries": round(stats.statements / max(requests, 1), 2),
+        "round_trips": round(stats.round_trips / max(requests, 1), 2),
+        "alloc_kib": round(statistics.mean(peaks), 1) if peaks else 0.0,
+    }
+
+
+def _token(node: Dict[str, Any]) -> str:
+    # The same claims as the login route, so the routes take the same paths
+    claims = {"username": node["username"], "is_active": node.get("is_active", True)}
+    return create_access_token(subject=node["uuid"], claims=claims)
+
+
+def load_fixture(seed: int) -> Fixture:
+    backend = get_backend()
+    nodes = backend.find("User", {}, 0, 1000, None)
+    if not nodes:
+        raise RuntimeError("The graph has no users, seed it first.")
+    sample = random.Random(seed).sample(nodes, min(SAMPLE_USERS, len(nodes)))
+    return Fixture([(node["uuid"], node["email"], _token(node)) for node in sample])
+
+
+def compare(
+    results: Dict[str, Result],
+    baseline: Dict[str, Result],
+    threshold: float,
+    metrics: List[str] = COMPARED,
+) -> List[str]:
+    """Returns the regressions of the results against the baseline.
+
+    Args:
+        results (Dict[str, Result]): The results by scenario
+        baseline (Dict[str, Result]): The baseline results by scenario
+        threshold (float): The allowed relative increase, e.g. 0.2 for 20%
+        metrics (List[str]): The compared metrics. Defaults to COMPARED.
+
+    Returns:
+        List[str]: A description of every regression
+    """
+    regressions: List[str] = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in metrics:
+            base, value = baseline[name].get(metric), result.get(metric)
+            if base is None or value is None:
+                continue
+            if value > base * (1 + threshold) and value - base > 1e-9:
+                change = (value - base) / base * 100 if base else math.inf
+                regressions.append(
+                    f"{name}: {metric} {base} -> {value} (+{change:.0f}%)"
+                )
+    return regressions
+
+
+def report(results: Dict[str, Result], baseline: Dict[str, Result]) -> None:
+    columns = ["p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    columns += ["queries", "round_trips", "alloc_kib"]
+    print(f"{'ROUTE':<28}" + "".join(f"{c:>12}" for c in columns) + f"{'ERRORS':>8}")
+    for name, result in results.items():
+        line = f"{name:<28}" + "".join(f"{result[c]:>12}" for c in columns)
+        print(line + f"{int(result['errors']):>8}")
+        if name in baseline:
+            base = baseline[name]
+            print(
+                f"{'  baseline':<28}"
+                + "".join(f"{base.get(c, ''):>12}" for c in columns)
+            )
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Result]:
+    from pawtrails.main import app
+
+    await app.router.startup()
+    try:
+        fixture = load_fixture(args.seed)
+        results: Dict[str, Result] = {}
+        for name, scenario in SCENARIOS.items():
+            if args.route and name not in args.route:
+                continue
+            print(f"BENCHMARKING {name}")
+            results[name] = await run_scenario(
+                app,
+                fixture,
+                scenario,
+                args.requests,
+                args.warmup,
+                args.allocations,
+                args.seed,
+            )
+        return results
+    finally:
+        await app.router.shutdown()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Seeds a synthetic graph and benchmarks the main routes through"
+        " the ASGI app in process. Compares the results with a baseline file and fails"
+        " on regressions.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["memory", "neo4j"],
+        default=settings.DATABASE_BACKEND,
+        help="Defaults to DATABASE_BACKEND",
+    )
+    parser.add_argument("--users", type=int, default=1000, help="Seeded graph size")
+    parser.add_argument(
+        "--no-seed", action="store_true", help="Benchmark the existing Neo4j graph"
+    )
+    parser.add_argument("--requests", type=int, default=100, help="Per route")
+    parser.add_argument("--warmup", type=int, default=5, help="Per route")
+    parser.add_argument(
+        "--allocations", type=int, default=10, help="Traced requests per route"
+    )
+    parser.add_argument("--route", action="append", help="Only benchmark this route")
+    parser.add_argument("--seed", type=int, default=42, help="The random seed")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Allowed increase, 0.2 is 20%%"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the new baseline"
+    )
+    args = parser.parse_args(argv)
+
+    settings.DATABASE_BACKEND = args.backend
+    # All the logins come from one address as fast as possible, which the login
+    # throttling would reject. The buckets are still taken from, so it is measured.
+    settings.LOGIN_IP_BURST = settings.LOGIN_ACCOUNT_BURST = 10**9
+    if args.no_seed and args.backend == "memory":
+        parser.error("The memory backend starts empty, it has to be seeded.")
+    config = {"backend": args.backend, "users": args.users, "seed": args.seed}
+    if args.no_seed:
+        config["users"] = None
+    else:
+        print(f"SEEDING {args.users} USERS")
+        seed_synthetic_data(Scale.from_users(args.users), seed=args.seed)
+
+    results = asyncio.run(benchmark(args))
+
+    path = Path(args.baseline)
+    stored = json.loads(path.read_text()) if path.exists() else {}
+    baseline: Dict[str, Result] = stored.get("results", {})
+    report(results, baseline)
+
+    if args.save:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"config": config, "results": {**baseline, **results}}
+        path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+        print(f"SAVED BASELINE {path}")
+        return
+    if not baseline:
+        print(f"NO BASELINE {path}, run with --save to create it")
+        return
+    if stored.get("config") != config:
+        print(f"WARNING: the baseline was recorded with {stored.get('config')}")
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("NO REGRESSIONS")
@@ -0,0 +1,195 @@
+"""Profiles the important queries and checks them against budgets. See db_budget."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pawtrails.core.database import decode_cursor, encode_cursor, get_graph
+from pawtrails.core.settings import settings
+from pawtrails.core.tracing import profiled
+from pawtrails.models.location import (
+    Location,
+    SearchLocationDistanceOptions,
+    SearchLocationOptions,
+    SearchLocationUserOptions,
+)
+from pawtrails.models.user import User
+from pawtrails.scripts.benchmark import Result, compare
+from pawtrails.scripts.database import seed_synthetic_data
+from pawtrails.scripts.generator import CITIES, Scale
+
+DEFAULT_BUDGETS = "benchmarks/db_hits.json"
+# Rows and statements change with the semantics of a query, db hits with its plan
+COMPARED = ["db_hits", "rows", "statements"]
+
+
+class Sample(NamedTuple):
+    """The seeded nodes the cases query."""
+
+    user: str  # uuid of the first generated user
+    location: Location  # The oldest location
+
+
+# A case prepares its objects and returns the call whose queries are profiled
+Case = Callable[[Sample], Callable[[], Any]]
+
+
+def _search(**options: Any) -> Callable[[], Any]:
+    return lambda: Location.search(SearchLocationOptions(**options))
+
+
+def _for_user(
+    sample: Sample, created: bool, favorited: bool
+) -> SearchLocationUserOptions:
+    return SearchLocationUserOptions(
+        uuid=sample.user, created=created, favorited=favorited
+    )
+
+
+def _distance() -> SearchLocationDistanceOptions:
+    _, longitude, latitude, _, radius = CITIES[0]
+    return SearchLocationDistanceOptions(
+        longitude=longitude, latitude=latitude, max=radius
+    )
+
+
+def _related(label: str, attribute: str) -> Case:
+    def case(sample: Sample) -> Callable[[], Any]:
+        obj = User.get_by_uuid(sample.user) if label == "User" else sample.location
+        return lambda: getattr(obj, attribute)
+
+    return case
+
+
+def _after(sample: Sample) -> Callable[[], Any]:
+    after = decode_cursor(encode_cursor(sample.location))
+    return lambda: Location.search(SearchLocationOptions(), after)
+
+
+def _dashboard(sample: Sample) -> Callable[[], Any]:
+    user = User.get_by_uuid(sample.user)
+    return lambda: user.get_dashboard() if user else None
+
+
+CASES: Dict[str, Case] = {
+    "User.get_by_email": lambda s: lambda: User.get_by_email("user0@example.com"),
+    "User.get_by_uuid": lambda s: lambda: User.get_by_uuid(s.user),
+    "User.dashboard": _dashboard,
+    "Location.search": lambda s: _search(),
+    "Location.search name": lambda s: _search(name="park"),
+    "Location.search size": lambda s: _search(size="medium"),
+    "Location.search type": lambda s: _search(type="park"),
+    "Location.search grade": lambda s: _search(grade=4),
+    "Location.search created": lambda s: _search(user=_for_user(s, True, False)),
+    "Location.search favorited": lambda s: _search(user=_for_user(s, False, True)),
+    "Location.search distance": lambda s: _search(distance=_distance()),
+    "Location.search after": _after,
+    "Location.search all": lambda s: _search(
+        type="park", size="medium", grade=3, distance=_distance()
+    ),
+    "User.followers": _related("User", "followers"),
+    "User.following": _related("User", "following"),
+    "User.pets": _related("User", "pets"),
+    "User.reviews": _related("User", "reviews"),
+    "Location.reviews": _related("Location", "reviews"),
+}
+
+
+def run_case(case: Case, sample: Sample) -> Result:
+    """Runs the queries of a case with PROFILE.
+
+    Args:
+        case (Case): The case
+        sample (Sample): The seeded nodes
+
+    Returns:
+        Result: The db hits, rows and statements of the queries, added up
+    """
+    call = case(sample)
+    with profiled() as profiles:
+        call()
+    return {
+        "db_hits": sum(profile["db_hits"] for profile in profiles),
+        "rows": sum(profile["rows"] for profile in profiles),
+        "statements": len(profiles),
+    }
+
+
+def report(results: Dict[str, Result], budgets: Dict[str, Result]) -> None:
+    print(f"{'QUERY':<28}{'DB HITS':>12}{'BUDGET':>12}{'ROWS':>10}{'BUDGET':>10}")
+    for name, result in results.items():
+        budget = budgets.get(name, {})
+        print(
+            f"{name:<28}{result['db_hits']:>12}{budget.get('db_hits', ''):>12}"
+            f"{result['rows']:>10}{budget.get('rows', ''):>10}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="db_budget",
+        description="Seeds a synthetic graph, runs the important queries with PROFILE"
+        " and fails if their db hits or rows exceed the budgets, e.g. because an"
+        " index is missing or a rewrite turned a seek into a scan. Needs Neo4j.",
+    )
+    parser.add_argument("--users", type=int, default=1000, help="Seeded graph size")
+    parser.add_argument(
+        "--no-seed", action="store_true", help="Profile the existing graph"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="The random seed")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS)
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Allowed increase, 0.1 is 10%%"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the new budgets"
+    )
+    args = parser.parse_args(argv)
+
+    if settings.DATABASE_BACKEND != "neo4j":
+        parser.error("PROFILE needs Neo4j, the memory backend has no query plans.")
+    # The plans, and so the db hits, change with the Neo4j version too
+    config = {
+        "users": None if args.no_seed else args.users,
+        "seed": args.seed,
+        "neo4j": get_graph().service.product,
+    }
+    if not args.no_seed:
+        seed_synthetic_data(Scale.from_users(args.users), seed=args.seed)
+
+    user = User.get_by_email("user0@example.com")
+    locations = Location.get_all(limit=1)
+    if user is None or not locations:
+        raise RuntimeError("The graph was not seeded by db_seed --users.")
+    sample = Sample(user.uuid or "", locations[0])
+    results = {name: run_case(case, sample) for name, case in CASES.items()}
+
+    path = Path(args.budgets)
+    stored = json.loads(path.read_text()) if path.exists() else {}
+    budgets: Dict[str, Result] = stored.get("budgets", {})
+    report(results, budgets)
+
+    if args.save:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"config": config, "budgets": results}
+        path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+        print(f"SAVED BUDGETS {path}")
+        return
+    if not budgets:
+        print(f"NO BUDGETS {path}, run with --save to create them")
+        sys.exit(1)
+    if stored.get("config") != config:
+        print(f"WARNING: the budgets were recorded with {stored.get('config')}")
+    missing = [name for name in results if name not in budgets]
+    for name in missing:
+        print(f"NO BUDGET {name}, run with --save to record it")
+    regressions = compare(results, budgets, args.threshold, COMPARED)
+    for regression in regressions:
+        print(f"OVER BUDGET {regression}")
+    if regressions or missing:
+        sys.exit(1)
+    print("WITHIN BUDGET")
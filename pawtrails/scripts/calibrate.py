@@ -0,0 +1,100 @@
+"""Picks the password hashing cost for this machine. See calibrate_hash."""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from typing import List, Optional, Tuple
+
+from pawtrails.core.security import create_password_context
+from pawtrails.core.settings import settings
+
+# The cost of every scheme: the lowest one, whether the time doubles with every
+# round (bcrypt log2 rounds) or grows linearly (PBKDF2 iterations), and the lowest
+# one that is still recommended
+COSTS = {"bcrypt": (4, True, 10), "pbkdf2_sha256": (10000, False, 600000)}
+
+
+def measure(scheme: str, rounds: int, samples: int) -> float:
+    """Measures how long hashing a password takes.
+
+    Args:
+        scheme (str): The scheme, e.g. bcrypt
+        rounds (int): The cost
+        samples (int): Hashes to time
+
+    Returns:
+        float: The median seconds of a hash
+    """
+    context = create_password_context(scheme, rounds)
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration password")
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def calibrate(scheme: str, target: float, samples: int) -> List[Tuple[int, float]]:
+    """Finds the highest cost whose hashes take at most the target time.
+
+    Args:
+        scheme (str): The scheme, e.g. bcrypt
+        target (float): Seconds a hash may take
+        samples (int): Hashes to time for every cost
+
+    Returns:
+        List[Tuple[int, float]]: The measured (rounds, seconds), the last one is the
+            chosen cost. The first one is over the target if even it is too slow.
+    """
+    rounds, exponential, _ = COSTS[scheme]
+    measured = [(rounds, measure(scheme, rounds, samples))]
+    if exponential:
+        while measured[-1][1] <= target:
+            rounds += 1
+            measured.append((rounds, measure(scheme, rounds, samples)))
+        if len(measured) > 1:
+            measured.append(measured[-2])  # The last one under the target
+        return measured
+    # Linear: scale the cost to the target, twice, since the first estimate comes
+    # from a short and noisy measurement
+    for _ in range(2):
+        rounds, seconds = measured[-1]
+        rounds = max(COSTS[scheme][0], int(rounds * target / seconds) // 1000 * 1000)
+        measured.append((rounds, measure(scheme, rounds, samples)))
+    return measured
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="calibrate_hash",
+        description="Measures the password hashing time on this machine and picks the"
+        " highest cost (PASSWORD_HASH_ROUNDS) that stays within the target latency."
+        " Run it on the deployment hardware.",
+    )
+    parser.add_argument(
+        "--scheme",
+        choices=sorted(COSTS),
+        default=settings.PASSWORD_HASH_SCHEME,
+        help="Defaults to PASSWORD_HASH_SCHEME",
+    )
+    parser.add_argument(
+        "--target", type=float, default=0.25, help="Seconds a hash may take"
+    )
+    parser.add_argument("--samples", type=int, default=5, help="Hashes per cost")
+    args = parser.parse_args(argv)
+
+    measured = calibrate(args.scheme, args.target, args.samples)
+    print(f"{'ROUNDS':>10}{'MS':>12}")
+    for rounds, seconds in measured[:-1]:
+        print(f"{rounds:>10}{seconds * 1000:>12.1f}")
+
+    rounds, seconds = measured[-1]
+    print(f"CHOSEN {rounds} ROUNDS, {seconds * 1000:.1f} MS A HASH")
+    if rounds < COSTS[args.scheme][2]:
+        print(
+            f"WARNING: below the recommended {COSTS[args.scheme][2]} rounds, the"
+            " target is too short for this machine."
+        )
+    print(f"\nPASSWORD_HASH_SCHEME={args.scheme}\nPASSWORD_HASH_ROUNDS={rounds}")
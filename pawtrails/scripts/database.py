@@ -1,18 +1,132 @@
-from typing import List
+import argparse
+from typing import List, Optional, Type
 
-from pawtrails.core.database import graph
+from pawtrails.core.database import BaseModel, MemoryBackend, get_backend, get_graph
+from pawtrails.core.schema import apply_schema
 from pawtrails.models.location import Location
 from pawtrails.models.pet import Pet
 from pawtrails.models.user import User
+from pawtrails.scripts.generator import Generator, Scale
 
 
-def prune() -> None:
-    print("PRUNNING")
-    graph.delete_all()
+def prune(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="db_prune",
+        description="Deletes the nodes and relationships in batches. Each batch is"
+        " committed, so an interrupted prune resumes when started again.",
+    )
+    parser.add_argument(
+        "--label", action="append", help="Only delete nodes with this label"
+    )
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+    try:
+        prune_graph(args.label, args.batch_size)
+    except KeyboardInterrupt:
+        print("INTERRUPTED, run db_prune again to resume")
+        return
+    if args.label:
+        print("Run db_recount, the counters of the remaining nodes are outdated")
 
 
-def seed() -> None:
-    prune()
+def prune_graph(labels: Optional[List[str]] = None, batch_size: int = 10000) -> None:
+    """Deletes the nodes together with their relationships, in batches of batch_size
+    nodes. Deleting everything in one transaction runs out of memory on large
+    graphs. Every batch only matches the nodes that are left, so the batches stay
+    as cheap as the first one.
+
+    Args:
+        labels (Optional[List[str]]): Only delete nodes with these labels
+        batch_size (int): Number of nodes to delete per transaction
+    """
+    backend = get_backend()
+    if isinstance(backend, MemoryBackend):
+        backend.clear(labels)
+        return
+    selected: List[Optional[str]] = list(labels) if labels else [None]
+    for label in selected:
+        if label is not None and not label.isidentifier():
+            raise ValueError(f"Invalid label {label}")
+        node = f"(n:{label})" if label else "(n)"
+        _delete_batches(
+            f"PRUNING {label or 'ALL'} NODES",
+            f"MATCH {node} RETURN count(n) AS total",
+            f"MATCH {node} WITH n LIMIT $limit DETACH DELETE n"
+            " RETURN count(*) AS deleted",
+            batch_size,
+        )
+
+
+def _delete_batches(title: str, count: str, query: str, batch_size: int) -> None:
+    print(title)
+    total = get_graph().evaluate(count) or 0
+    done = 0
+    while True:
+        deleted = get_graph().evaluate(query, limit=batch_size)
+        if not deleted:
+            break
+        done += deleted
+        print(f"DELETED {done}/{total}")
+
+
+def migrate() -> None:
+    print("MIGRATING")
+    for item in apply_schema():
+        print(f"CREATED {item.name}")
+
+
+def recount() -> None:
+    models: List[Type[BaseModel]] = [User, Location, Pet]
+    for model in models:
+        print(f"RECOUNTING {model.__primarylabel__}")
+        for done in model.recount_all():
+            print(f"RECOUNTED {done}")
+
+
+def seed(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="db_seed",
+        description="Prunes the database and seeds it with the test data or, given a"
+        " scale, with a synthetic production shaped data set.",
+    )
+    parser.add_argument("--users", type=int, help="e.g. 100000, sets the scale")
+    for name in ["follows", "pets", "locations", "favorites", "reviews"]:
+        parser.add_argument(f"--{name}", type=int, help="Defaults to a users ratio")
+    parser.add_argument("--seed", type=int, default=42, help="The random seed")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    if args.users is None:
+        seed_test_data()
+        return
+
+    overrides = {
+        name: getattr(args, name)
+        for name in Scale._fields
+        if getattr(args, name) is not None
+    }
+    scale = Scale.from_users(args.users)._replace(**overrides)
+    seed_synthetic_data(scale, seed=args.seed, batch_size=args.batch_size)
+
+
+def seed_synthetic_data(scale: Scale, seed: int = 42, batch_size: int = 10000) -> None:
+    """Replaces the graph with a synthetic data set, see Generator.
+
+    Args:
+        scale (Scale): The number of nodes and relationships to generate
+        seed (int): The random seed. Defaults to 42.
+        batch_size (int): Rows written per transaction. Defaults to 10000.
+    """
+    prune_graph()
+    if not isinstance(get_backend(), MemoryBackend):
+        migrate()  # The generator matches the nodes by uuid, it needs the indexes
+    print(f"SEEDING {scale}")
+    Generator(scale, seed=seed, batch_size=batch_size).run()
+    recount()
+
+
+def seed_test_data() -> None:
+    prune_graph()
     print("SEEDING USERS")
 
     users: List[User] = []
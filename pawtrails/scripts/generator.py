@@ -0,0 +1,419 @@
+"""Generates synthetic, production shaped data for capacity testing. See db_seed."""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import itertools
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Set, Tuple
+from uuid import UUID
+
+from neotime import DateTime
+from py2neo.data.spatial import WGS84Point
+
+from pawtrails.core.database import MemoryBackend, Neo4jBackend, get_backend, get_graph
+from pawtrails.core.security import get_password_hash
+
+Row = Dict[str, Any]
+
+# (name, longitude, latitude, weight, radius in km) of the cities locations cluster
+# around. The weight is roughly the population, in millions.
+CITIES: List[Tuple[str, float, float, float, float]] = [
+    ("Zagreb", 15.9819, 45.8150, 0.8, 8.0),
+    ("Split", 16.4402, 43.5081, 0.2, 4.0),
+    ("Rijeka", 14.4422, 45.3271, 0.1, 4.0),
+    ("Osijek", 18.6955, 45.5550, 0.1, 3.0),
+    ("Ljubljana", 14.5058, 46.0569, 0.3, 5.0),
+    ("Budapest", 19.0402, 47.4979, 1.7, 10.0),
+    ("Vienna", 16.3738, 48.2082, 1.9, 10.0),
+    ("Graz", 15.4395, 47.0707, 0.3, 5.0),
+    ("Belgrade", 20.4489, 44.7866, 1.2, 8.0),
+    ("Sarajevo", 18.4131, 43.8563, 0.3, 5.0),
+    ("Munich", 11.5820, 48.1351, 1.5, 9.0),
+    ("Milan", 9.1900, 45.4642, 1.4, 9.0),
+    ("Prague", 14.4378, 50.0755, 1.3, 9.0),
+    ("Berlin", 13.4050, 52.5200, 3.6, 14.0),
+    ("Paris", 2.3522, 48.8566, 2.2, 10.0),
+    ("London", -0.1276, 51.5072, 8.9, 18.0),
+    ("Madrid", -3.7038, 40.4168, 3.2, 12.0),
+    ("Rome", 12.4964, 41.9028, 2.8, 12.0),
+    ("Amsterdam", 4.9041, 52.3676, 0.9, 7.0),
+    ("New York", -74.0060, 40.7128, 8.4, 18.0),
+]
+# Lowercase, as the Model setters store them
+LOCATION_TYPES = ["park", "meadow", "fenced meadow", "beach", "other"]
+SIZES = ["mini", "small", "medium", "large", "giant"]
+BREEDS = ["Mixed", "Labrador", "German Shepherd", "Poodle", "Beagle", "Shiba Inu"]
+COMMENTS = ["Great place!", "Nice and quiet.", "Too crowded.", "Lots of mud.", ""]
+# Weights of the review grades 1 to 5, reviews are mostly positive
+GRADE_WEIGHTS = [5, 8, 17, 35, 35]
+
+# Generated timestamps fall within the two years before this (fixed) date
+EPOCH = datetime(2021, 6, 1)
+PERIOD = timedelta(days=730).total_seconds()
+
+USERS_QUERY = """
+UNWIND $rows AS row
+CREATE (n:User) SET n = row.properties
+FOREACH (home IN CASE WHEN row.home IS NULL THEN [] ELSE [row.home] END |
+    SET n.home = point(home))
+"""
+FOLLOWS_QUERY = """
+UNWIND $rows AS row
+MATCH (a:User { uuid: row.a }) MATCH (b:User { uuid: row.b })
+CREATE (a)-[:FOLLOWS { created_at: row.created_at }]->(b)
+"""
+PETS_QUERY = """
+UNWIND $rows AS row
+CREATE (p:Pet) SET p = row.properties
+WITH p, row UNWIND row.owners AS owner
+MATCH (u:User { uuid: owner })
+CREATE (u)-[:OWNS { created_at: row.properties.created_at }]->(p)
+"""
+LOCATIONS_QUERY = """
+UNWIND $rows AS row
+CREATE (l:Location) SET l = row.properties, l.location = point(row.point)
+WITH l, row MATCH (u:User { uuid: row.creator })
+CREATE (u)-[:CREATED { created_at: row.properties.created_at }]->(l)
+"""
+FAVORITES_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User { uuid: row.a }) MATCH (l:Location { uuid: row.b })
+CREATE (u)-[:FAVORITED { created_at: row.created_at }]->(l)
+"""
+REVIEWS_QUERY = """
+UNWIND $rows AS row
+MATCH (u:User { uuid: row.writer }) MATCH (l:Location { uuid: row.location })
+CREATE (r:Review) SET r = row.properties
+CREATE (u)-[:WROTE { created_at: row.properties.created_at }]->(r)
+CREATE (r)-[:FOR { created_at: row.properties.created_at }]->(l)
+"""
+
+
+QUERIES = {
+    "users": USERS_QUERY,
+    "follows": FOLLOWS_QUERY,
+    "pets": PETS_QUERY,
+    "locations": LOCATIONS_QUERY,
+    "favorites": FAVORITES_QUERY,
+    "reviews": REVIEWS_QUERY,
+}
+
+
+def _write_neo4j(query: str, backend: Neo4jBackend, rows: List[Row]) -> None:
+    get_graph().update(lambda tx: tx.run(query, rows=rows))
+
+
+for _name, _query in QUERIES.items():
+    Neo4jBackend.register(f"Generator.{_name}")(functools.partial(_write_neo4j, _query))
+
+
+def _point(point: Dict[str, float]) -> WGS84Point:
+    return WGS84Point((point["longitude"], point["latitude"]))
+
+
+@MemoryBackend.register("Generator.users")
+def _users_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    for row in rows:
+        properties = dict(row["properties"])
+        if row["home"]:
+            properties["home"] = _point(row["home"])
+        backend.create(["User"], properties)
+
+
+def _relate_memory(backend: MemoryBackend, type: str, rows: List[Row]) -> None:
+    for row in rows:
+        a, b = backend.uuids[row["a"]], backend.uuids[row["b"]]
+        backend.relate(a, type, b, {"created_at": row["created_at"]})
+
+
+@MemoryBackend.register("Generator.follows")
+def _follows_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    _relate_memory(backend, "FOLLOWS", rows)
+
+
+@MemoryBackend.register("Generator.favorites")
+def _favorites_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    _relate_memory(backend, "FAVORITED", rows)
+
+
+@MemoryBackend.register("Generator.pets")
+def _pets_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    for row in rows:
+        pet = backend.create(["Pet"], row["properties"])
+        properties = {"created_at": row["properties"]["created_at"]}
+        for owner in row["owners"]:
+            backend.relate(backend.uuids[owner], "OWNS", pet, properties)
+
+
+@MemoryBackend.register("Generator.locations")
+def _locations_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    for row in rows:
+        properties = dict(row["properties"], location=_point(row["point"]))
+        location = backend.create(["Location"], properties)
+        created = {"created_at": properties["created_at"]}
+        backend.relate(backend.uuids[row["creator"]], "CREATED", location, created)
+
+
+@MemoryBackend.register("Generator.reviews")
+def _reviews_memory(backend: MemoryBackend, rows: List[Row]) -> None:
+    for row in rows:
+        review = backend.create(["Review"], row["properties"])
+        properties = {"created_at": row["properties"]["created_at"]}
+        backend.relate(backend.uuids[row["writer"]], "WROTE", review, properties)
+        backend.relate(review, "FOR", backend.uuids[row["location"]], properties)
+
+
+class Scale(NamedTuple):
+    """The number of nodes and relationships to generate."""
+
+    users: int
+    follows: int
+    pets: int
+    locations: int
+    favorites: int
+    reviews: int
+
+    @classmethod
+    def from_users(cls, users: int) -> Scale:
+        """Returns a scale with production like ratios for the given number of users.
+
+        Args:
+            users (int): Number of users
+
+        Returns:
+            Scale: The scale
+        """
+        return cls(
+            users=users,
+            follows=users * 10,
+            pets=users * 6 // 5,
+            locations=users * 2,
+            favorites=users * 4,
+            reviews=users * 20,
+        )
+
+
+def _chunks(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Generator:
+    """Writes a synthetic data set, in batched UNWIND transactions (or straight into
+    the memory backend). The same seed always generates the same data set.
+
+    Popularity follows a power law: a few users are followed by very many and a few
+    locations get most of the favorites and reviews. Locations and homes cluster
+    around real city centers.
+    """
+
+    def __init__(
+        self,
+        scale: Scale,
+        seed: int = 42,
+        batch_size: int = 10000,
+        log: Callable[[str], Any] = print,
+    ) -> None:
+        self.scale = scale
+        self.batch_size = batch_size
+        self.log = log
+        self.random = random.Random(seed)
+        self.users: List[str] = []
+        self.locations: List[str] = []
+
+    def run(self) -> None:
+        """Generates the whole data set."""
+        self.seed_users()
+        self.seed_follows()
+        self.seed_pets()
+        self.seed_locations()
+        self.seed_favorites()
+        self.seed_reviews()
+
+    def _uuid(self) -> str:
+        return UUID(int=self.random.getrandbits(128), version=4).hex
+
+    def _timestamp(self) -> DateTime:
+        seconds = self.random.uniform(0, PERIOD)
+        return DateTime.from_native(EPOCH - timedelta(seconds=seconds))
+
+    def _properties(self, **properties: Any) -> Row:
+        created_at = self._timestamp()
+        return dict(
+            uuid=self._uuid(),
+            created_at=created_at,
+            updated_at=created_at,
+            **properties,
+        )
+
+    def _power_law(self, n: int, exponent: float) -> Callable[[], int]:
+        """Returns a sampler of indexes in [0, n), where index i has a weight of
+        1 / (i + 1) ** exponent. Exponent 0 is uniform, higher is more skewed."""
+        if n <= 0:
+            raise ValueError("Cannot sample from an empty population.")
+        weights = itertools.accumulate(1 / (i + 1) ** exponent for i in range(n))
+        cumulative = list(weights)
+        total = cumulative[-1]
+        # The popular ones should not all be the first ones created
+        order = list(range(n))
+        self.random.shuffle(order)
+        return lambda: order[bisect.bisect(cumulative, self.random.random() * total)]
+
+    def _point(self) -> Dict[str, float]:
+        weights = [city[3] for city in CITIES]
+        _, longitude, latitude, _, radius = self.random.choices(CITIES, weights)[0]
+        # Normally distributed around the center, ~111 km per degree of latitude
+        latitude += self.random.gauss(0, radius) / 111
+        longitude += self.random.gauss(0, radius) / (
+            111 * math.cos(math.radians(latitude))
+        )
+        return {"longitude": round(longitude, 6), "latitude": round(latitude, 6)}
+
+    def _pairs(
+        self, total: int, a: Callable[[], int], b: Callable[[], int], loops: bool
+    ) -> Iterator[Tuple[int, int]]:
+        """Yields unique (a, b) index pairs, drawn from the given samplers."""
+        seen: Set[Tuple[int, int]] = set()
+        attempts = 0
+        while len(seen) < total and attempts < total * 20:
+            attempts += 1
+            pair = (a(), b())
+            if pair in seen or (not loops and pair[0] == pair[1]):
+                continue
+            seen.add(pair)
+            yield pair
+
+    def _write(self, name: str, rows: Iterable[Row], total: int) -> None:
+        title = name.upper()
+        self.log(f"SEEDING {title}")
+        start = time.perf_counter()
+        done = 0
+        for chunk in _chunks(rows, self.batch_size):
+            get_backend().query(f"Generator.{name}", chunk)
+            done += len(chunk)
+            rate = done / max(time.perf_counter() - start, 1e-9)
+            percent = done * 100 // max(total, 1)
+            self.log(f"SEEDED {title} {done}/{total} ({percent}%, {rate:.0f}/s)")
+
+    def seed_users(self) -> None:
+        # Hashing is slow on purpose, so every user gets the same password
+        password = get_password_hash("password")
+
+        def rows() -> Iterator[Row]:
+            for i in range(self.scale.users):
+                properties = self._properties(
+                    email=f"user{i}@example.com",
+                    username=f"user{i}",
+                    password=password,
+                    full_name=f"User {i}",
+                    is_active=True,
+                )
+                self.users.append(properties["uuid"])
+                home = self._point() if self.random.random() < 0.5 else None
+                yield {"properties": properties, "home": home}
+
+        self._write("users", rows(), self.scale.users)
+
+    def seed_follows(self) -> None:
+        n = len(self.users)
+        if n < 2:
+            return
+        total = min(self.scale.follows, n * (n - 1))
+        followers, followed = self._power_law(n, 0.5), self._power_law(n, 1.0)
+        rows = (
+            {"a": self.users[a], "b": self.users[b], "created_at": self._timestamp()}
+            for a, b in self._pairs(total, followers, followed, loops=False)
+        )
+        self._write("follows", rows, total)
+
+    def seed_pets(self) -> None:
+        if not self.users:
+            return
+        owner = self._power_law(len(self.users), 0.3)
+
+        def rows() -> Iterator[Row]:
+            for i in range(self.scale.pets):
+                properties = self._properties(
+                    name=f"pet{i}",
+                    breed=self.random.choice(BREEDS),
+                    energy=self.random.randint(1, 5),
+                    size=self.random.choice(SIZES),
+                )
+                # Some pets are shared, e.g. by a couple
+                owners = {
+                    owner() for _ in range(2 if self.random.random() < 0.1 else 1)
+                }
+                yield {
+                    "properties": properties,
+                    "owners": [self.users[i] for i in owners],
+                }
+
+        self._write("pets", rows(), self.scale.pets)
+
+    def seed_locations(self) -> None:
+        if not self.users:
+            return
+        creator = self._power_law(len(self.users), 0.8)
+
+        def rows() -> Iterator[Row]:
+            for i in range(self.scale.locations):
+                type = self.random.choice(LOCATION_TYPES)
+                properties = self._properties(
+                    name=f"{type.capitalize()} {i}",
+                    description=f"A {type} for dogs",
+                    type=type,
+                    size=self.random.choice(SIZES),
+                )
+                self.locations.append(properties["uuid"])
+                yield {
+                    "properties": properties,
+                    "point": self._point(),
+                    "creator": self.users[creator()],
+                }
+
+        self._write("locations", rows(), self.scale.locations)
+
+    def seed_favorites(self) -> None:
+        n, m = len(self.users), len(self.locations)
+        if not n or not m:
+            return
+        total = min(self.scale.favorites, n * m)
+        users, locations = self._power_law(n, 0.5), self._power_law(m, 0.9)
+        rows = (
+            {
+                "a": self.users[a],
+                "b": self.locations[b],
+                "created_at": self._timestamp(),
+            }
+            for a, b in self._pairs(total, users, locations, loops=True)
+        )
+        self._write("favorites", rows, total)
+
+    def seed_reviews(self) -> None:
+        if not self.users or not self.locations:
+            return
+        writer = self._power_law(len(self.users), 0.6)
+        location = self._power_law(len(self.locations), 0.9)
+
+        def rows() -> Iterator[Row]:
+            for _ in range(self.scale.reviews):
+                properties = self._properties(
+                    comment=self.random.choice(COMMENTS),
+                    grade=self.random.choices(range(1, 6), GRADE_WEIGHTS)[0],
+                )
+                yield {
+                    "properties": properties,
+                    "writer": self.users[writer()],
+                    "location": self.locations[location()],
+                }
+
+        self._write("reviews", rows(), self.scale.reviews)
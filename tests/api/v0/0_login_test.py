@@ -1,6 +1,14 @@
+import pytest
 from fastapi.testclient import TestClient
+from pytest import MonkeyPatch
 
+from pawtrails.core import security
+from pawtrails.core.backend import UniquenessError
+from pawtrails.core.database import UnitOfWork
+from pawtrails.core.ratelimit import MemoryRateLimitStore, set_store
+from pawtrails.core.security import create_password_context
 from pawtrails.core.settings import settings
+from pawtrails.models.user import User
 from tests.api.data import testData
 
 
@@ -30,6 +38,15 @@ class TestRegister:
         response = client.post(f"{settings.API_PREFIX}/register", json=reg_data)
         assert response.status_code == 409
 
+    def test_duplicate_in_batch(self) -> None:
+        email = "batch_" + testData.TEST_EMAIL
+        with pytest.raises(UniquenessError) as error:
+            with UnitOfWork() as work:
+                work.save(User(email=email, username="batch_user1"))
+                work.save(User(email=email, username="batch_user2"))
+        assert error.value.key == "email"
+        assert User.get_by_email(email) is None
+
 
 class TestLogin:
     def test_invalid_parameters(self, client: TestClient) -> None:
@@ -54,3 +71,70 @@ class TestLogin:
         response_json = response.json()
         testData.bearer_token = response_json["access_token"]
         assert response.status_code == 200
+
+    def test_rehash(self, client: TestClient, monkeypatch: MonkeyPatch) -> None:
+        monkeypatch.setattr(
+            security, "pwd_context", create_password_context("bcrypt", 5)
+        )
+        login_data = {
+            "username": testData.TEST_EMAIL,
+            "password": testData.TEST_PASSWORD,
+        }
+        response = client.post(f"{settings.API_PREFIX}/login", data=login_data)
+        assert response.status_code == 200
+        user = User.get_by_email(testData.TEST_EMAIL)
+        assert user is not None and user.password.startswith("$2b$05$")
+
+    def test_throttled(self, client: TestClient) -> None:
+        set_store(MemoryRateLimitStore())
+        login_data = {"username": "flood@example.com", "password": "password"}
+        try:
+            for _ in range(settings.LOGIN_ACCOUNT_BURST):
+                response = client.post(f"{settings.API_PREFIX}/login", data=login_data)
+                assert response.status_code == 401
+            response = client.post(f"{settings.API_PREFIX}/login", data=login_data)
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) > 0
+        finally:
+            set_store(None)
+
+
+class TestRevocation:
+    def test_password_change(self, client: TestClient) -> None:
+        def dashboard(token: str) -> int:
+            headers = {"Authorization": f"Bearer {token}"}
+            response = client.get(
+                f"{settings.API_PREFIX}/me/dashboard", headers=headers
+            )
+            return response.status_code
+
+        assert dashboard(testData.bearer_token) == 200
+        update_data = {
+            "old_password": testData.TEST_PASSWORD,
+            "password": testData.TEST_PASSWORD,
+        }
+        response = client.patch(
+            f"{settings.API_PREFIX}/me/",
+            json=update_data,
+            headers={"Authorization": f"Bearer {testData.bearer_token}"},
+        )
+        assert response.status_code == 200
+        assert dashboard(testData.bearer_token) == 401
+
+        login_data = {
+            "username": testData.TEST_EMAIL,
+            "password": testData.TEST_PASSWORD,
+        }
+        response = client.post(f"{settings.API_PREFIX}/login", data=login_data)
+        testData.bearer_token = response.json()["access_token"]
+        assert dashboard(testData.bearer_token) == 200
+
+
+class TestUpdateMe:
+    def test_username_exists(self, client: TestClient) -> None:
+        response = client.patch(
+            f"{settings.API_PREFIX}/me/",
+            json={"username": "user1"},
+            headers={"Authorization": f"Bearer {testData.bearer_token}"},
+        )
+        assert response.status_code == 409
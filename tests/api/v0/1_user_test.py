@@ -28,6 +28,19 @@ class TestGetUserList:
         assert response.status_code == 200
         assert len(response_json) == 2
 
+    def test_cursor(self, client: TestClient) -> None:
+        response = client.get(f"{settings.API_PREFIX}/user/?limit=4")
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(f"{settings.API_PREFIX}/user/?limit=4&cursor={cursor}")
+        response_json = response.json()
+        assert response.status_code == 200
+        assert len(response_json) == 2
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_invalid_cursor(self, client: TestClient) -> None:
+        response = client.get(f"{settings.API_PREFIX}/user/?cursor=gibberish")
+        assert response.status_code == 400
+
 
 class TestGetUserByUUID:
     def test_invalid_user(self, client: TestClient) -> None:
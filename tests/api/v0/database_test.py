@@ -0,0 +1,132 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from fastapi.testclient import TestClient
+from pytest import CaptureFixture, MonkeyPatch
+
+from pawtrails.core import schema, tracing
+from pawtrails.core.settings import settings
+from pawtrails.core.tracing import profiled
+from pawtrails.models.user import User
+from pawtrails.scripts import database
+from tests.api.data import testData
+
+
+class FakeResult:
+    def __init__(self, summary: Dict[str, Any]) -> None:
+        self._summary = summary
+
+    def summary(self) -> Dict[str, Any]:
+        return self._summary
+
+
+class FakeGraph:
+    """Nodes deleted in batches, the interrupt_at-th batch is interrupted once."""
+
+    def __init__(self, nodes: int, interrupt_at: int = 0) -> None:
+        self.nodes = nodes
+        self.interrupt_at = interrupt_at
+        self.batches: List[int] = []
+        self.queries: List[str] = []
+
+    def evaluate(self, query: str, limit: int = 0) -> int:
+        if "count(n) AS total" in query:
+            return self.nodes
+        self.queries.append(query)
+        if len(self.queries) == self.interrupt_at:
+            raise KeyboardInterrupt
+        deleted = min(limit, self.nodes)
+        self.nodes -= deleted
+        self.batches.append(deleted)
+        return deleted
+
+
+class SchemaGraph:
+    """The indexes of a database, CREATE INDEX and CREATE CONSTRAINT add one."""
+
+    def __init__(self) -> None:
+        self.indexes: List[Dict[str, Any]] = [
+            {"labelsOrTypes": ["User"], "properties": ["email"], "uniqueness": "UNIQUE"}
+        ]
+        self.created: List[str] = []
+
+    def run(self, query: str) -> List[Dict[str, Any]]:
+        if query.startswith("CALL db.indexes()"):
+            return self.indexes
+        item = next(item for item in schema.SCHEMA if item.query == query)
+        self.created.append(item.name)
+        self.indexes.append(
+            {
+                "labelsOrTypes": [item.label],
+                "properties": [item.key],
+                "uniqueness": "UNIQUE" if item.unique else "NONUNIQUE",
+            }
+        )
+        return []
+
+
+class TestRunAsync:
+    def test_busy(self, client: TestClient, monkeypatch: MonkeyPatch) -> None:
+        timeouts = client.get("/healthcheck/pool").json()["timeouts"]
+        # Every connection is in use
+        monkeypatch.setattr(
+            "pawtrails.core.database._get_slots", lambda: asyncio.Semaphore(0)
+        )
+        monkeypatch.setattr(settings, "NEO4J_ACQUISITION_TIMEOUT", 0.01)
+
+        response = client.get(f"{settings.API_PREFIX}/pet")
+        assert response.status_code == 503
+        assert response.json() == {"detail": "No database connection is available."}
+        assert client.get("/healthcheck/pool").json()["timeouts"] == timeouts + 1
+
+
+class TestProfiled:
+    def test_plan_from_summary(self) -> None:
+        plan = {"dbHits": 2, "rows": 1, "children": [{"dbHits": 3, "rows": 1}]}
+        with profiled() as profiles:
+            tracing._save_profile("MATCH (n) RETURN n", FakeResult({"profile": plan}))
+            tracing._save_profile("MATCH (n) RETURN n", FakeResult({}))
+        assert profiles == [{"query": "MATCH (n) RETURN n", "db_hits": 5, "rows": 1}]
+
+    @pytest.mark.skipif(
+        settings.DATABASE_BACKEND != "neo4j", reason="PROFILE needs Neo4j"
+    )
+    def test_db_hits(self) -> None:
+        with profiled() as profiles:
+            User.get_by_email(testData.TEST_EMAIL)
+        assert len(profiles) == 1
+        assert profiles[0]["db_hits"] > 0
+        assert profiles[0]["rows"] == 1
+
+
+class TestPrune:
+    def test_resume(self, monkeypatch: MonkeyPatch, capsys: CaptureFixture) -> None:
+        graph = FakeGraph(25, interrupt_at=2)
+        monkeypatch.setattr(database, "get_backend", lambda: None)
+        monkeypatch.setattr(database, "get_graph", lambda: graph)
+
+        database.prune(["--label", "Review", "--batch-size", "10"])
+        assert "INTERRUPTED" in capsys.readouterr().out
+        assert graph.nodes == 15
+
+        database.prune(["--label", "Review", "--batch-size", "10"])
+        assert graph.nodes == 0
+        assert graph.batches == [10, 10, 5, 0]
+        assert "DETACH DELETE" in graph.queries[-1]
+        assert "DELETED 15/15" in capsys.readouterr().out
+
+
+class TestMigrate:
+    def test_idempotent(self, monkeypatch: MonkeyPatch) -> None:
+        graph = SchemaGraph()
+        monkeypatch.setattr(schema, "get_graph", lambda: graph)
+        assert not schema.check_schema()
+
+        created = schema.apply_schema()
+        assert len(created) == len(schema.SCHEMA) - 1
+        assert "user_email_unique" not in graph.created
+        assert schema.check_schema()
+
+        assert schema.apply_schema() == []
+        assert len(graph.created) == len(created)
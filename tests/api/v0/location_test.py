@@ -0,0 +1,92 @@
+from typing import Any, Dict, List, Tuple, cast
+
+from fastapi.testclient import TestClient
+from pytest import MonkeyPatch
+
+from pawtrails.core.database import Neo4jBackend
+from pawtrails.core.settings import settings
+from pawtrails.models import location
+from pawtrails.models.location import (
+    SearchLocationDistanceOptions,
+    SearchLocationOptions,
+    SearchLocationUserOptions,
+)
+from tests.api.data import testData
+
+
+class SearchGraph:
+    def __init__(self) -> None:
+        self.runs: List[Tuple[str, Dict[str, Any]]] = []
+
+    def run(self, query: str, parameters: Dict[str, Any]) -> List[Any]:
+        self.runs.append((query, parameters))
+        return []
+
+
+class TestSearchQuery:
+    def search(self, monkeypatch: MonkeyPatch, **options: Any) -> Tuple[str, dict]:
+        graph = SearchGraph()
+        monkeypatch.setattr(location, "get_graph", lambda readonly: graph)
+        params = SearchLocationOptions(**options)
+        location._search_neo4j(cast(Neo4jBackend, None), params, None)
+        return graph.runs[0]
+
+    def test_values_are_parameters(self, monkeypatch: MonkeyPatch) -> None:
+        query, parameters = self.search(
+            monkeypatch, name="x' OR 1=1 //", size="Large", grade=4, limit=5
+        )
+        other_query, _ = self.search(monkeypatch, name="park", size="mini", grade=1)
+        assert query == other_query
+        assert "OR 1=1" not in query and "large" not in query.lower()
+        assert parameters["name"] == "x' OR 1=1 //"
+        assert (parameters["size"], parameters["grade"]) == ("large", 4)
+        assert parameters["limit"] == 5
+
+    def test_shapes(self, monkeypatch: MonkeyPatch) -> None:
+        user = SearchLocationUserOptions(uuid="u1", created=True, favorited=False)
+        distance = SearchLocationDistanceOptions(longitude=4.9, latitude=52.4, max=10)
+        filters: List[Dict[str, Any]] = [
+            {},
+            {"size": "small"},
+            {"type": "beach"},
+            {"grade": 3},
+            {"user": user},
+            {"distance": distance},
+        ]
+        shapes = {self.search(monkeypatch, **options)[0] for options in filters}
+        assert len(shapes) == 6
+        assert "$user_uuid" in self.search(monkeypatch, user=user)[0]
+        assert "$max_distance" in self.search(monkeypatch, distance=distance)[0]
+
+
+class TestAddLocations:
+    def test_mixed(self, client: TestClient) -> None:
+        item: Dict[str, Any] = {
+            "name": "Batch Park",
+            "description": "Added in a batch",
+            "type": "park",
+            "size": "medium",
+            "location": [4.9, 52.37],
+        }
+        locations = [
+            item,
+            dict(item, name=""),
+            dict(item, size="huge"),
+            {"name": "Batch Meadow"},
+        ]
+        response = client.post(
+            f"{settings.API_PREFIX}/location/batch",
+            json=locations,
+            headers=testData.bearer_header(),
+        )
+        response_json = response.json()
+        assert response.status_code == 200
+        assert [item["status"] for item in response_json] == [200, 422, 422, 422]
+        assert [item["index"] for item in response_json] == [0, 1, 2, 3]
+
+        uuid = response_json[0]["uuid"]
+        response = client.get(
+            f"{settings.API_PREFIX}/location/{uuid}", headers=testData.bearer_header()
+        )
+        assert response.status_code == 200
+        assert response.json()["name"] == "Batch Park"
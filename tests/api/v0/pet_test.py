@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
 
 from pawtrails.core.settings import settings
+from tests.api.data import testData
 
 
 class TestPetList:
@@ -8,3 +9,29 @@ class TestPetList:
         response = client.get(f"{settings.API_PREFIX}/pet")
         assert response.status_code == 200
         # assert response_json == "" TODO
+
+
+class TestAddPets:
+    def test_too_large(self, client: TestClient) -> None:
+        pets = [{}] * (settings.BATCH_MAX_SIZE + 1)
+        response = client.post(
+            f"{settings.API_PREFIX}/pet/batch",
+            json=pets,
+            headers=testData.bearer_header(),
+        )
+        assert response.status_code == 413
+
+    def test_success(self, client: TestClient) -> None:
+        pets = [
+            {"name": "Doge", "breed": "Shiba Inu", "energy": 3, "size": "Medium"},
+            {"name": "", "breed": "Shiba Inu"},
+        ]
+        response = client.post(
+            f"{settings.API_PREFIX}/pet/batch",
+            json=pets,
+            headers=testData.bearer_header(),
+        )
+        response_json = response.json()
+        assert response.status_code == 200
+        assert [item["status"] for item in response_json] == [200, 422]
+        assert response_json[0]["uuid"]
@@ -3,7 +3,16 @@ from typing import Generator
 import pytest
 from fastapi.testclient import TestClient
 
+from pawtrails.core.settings import settings
 from pawtrails.main import app
+from pawtrails.scripts.database import seed_test_data
+
+
+@pytest.fixture(scope="session", autouse=True)
+def memory_database() -> None:
+    # With DATABASE_BACKEND=memory the tests need no Neo4j, seed the empty graph
+    if settings.DATABASE_BACKEND == "memory":
+        seed_test_data()
 
 
 @pytest.fixture(scope="module")
@@ -1,7 +1,35 @@
 from fastapi.testclient import TestClient
 
+from pawtrails.core.settings import settings
+
 
 def test_healthcheck(client: TestClient) -> None:
     response = client.get("/healthcheck")
     assert response.status_code == 200
     assert response.json() == "OK"
+
+
+def test_healthcheck_pool(client: TestClient) -> None:
+    response = client.get("/healthcheck/pool")
+    response_json = response.json()
+    assert response.status_code == 200
+    assert response_json["in_use"] <= response_json["size"]
+
+
+def test_server_timing(client: TestClient) -> None:
+    response = client.get(f"{settings.API_PREFIX}/pet")
+    metrics = dict(
+        metric.strip().split(";", 1)
+        for metric in response.headers["Server-Timing"].split(",")
+    )
+    assert response.status_code == 200
+    assert int(metrics["db-statements"].split("=")[1]) > 0
+    assert metrics["db"].startswith("dur=")
+
+
+def test_metrics(client: TestClient) -> None:
+    client.get(f"{settings.API_PREFIX}/pet")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'route="/api/v0/pet/",status="200"' in response.text
+    assert "pawtrails_database_pool_size" in response.text